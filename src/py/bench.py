@@ -0,0 +1,258 @@
+"""
+Times the pipeline stages on synthetic maps of increasing size (see
+synth.py), saves the timings as JSON, and compares them against a stored
+baseline.
+
+Two checks flag regressions:
+    * a stage got slower than its baseline time by more than a tolerance
+    * a stage scales worse than it did in the baseline, i.e., the slope of
+      log(time) vs log(nodes) went up. This is what catches something going
+      quadratic, and it holds up across machines better than raw times do.
+
+Usage:
+    python bench.py --save-baseline   # once, to record a baseline
+    python bench.py                   # later: compare against it
+"""
+
+# imports
+# ---
+
+# builtins
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+# 3rd party
+import numpy as np
+
+# local
+import blocks_dataset
+import buildings
+import chunks_dataset
+import graph
+import osm
+import synth
+
+
+# settings
+# ---
+
+DEFAULT_SIZES = [8, 16, 32, 64]
+DEFAULT_OUT = os.path.join('data', 'bench', 'latest.json')
+DEFAULT_BASELINE = os.path.join('data', 'bench', 'baseline.json')
+
+# resolutions the stages run at (as in blocks_dataset / chunks_dataset)
+INTERMEDIATE_RES = (800, 600)
+CHUNK_RES = (500, 500)
+
+
+# code
+# ---
+
+@contextlib.contextmanager
+def quiet():
+    """Hides the stages' progress output."""
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        yield
+
+
+def best_time(fn: Callable[[], Any], repeats: int) -> Tuple[float, Any]:
+    """Runs `fn` `repeats` times. Returns (fastest wall time, last result)."""
+    best = math.inf
+    res = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with quiet():
+            res = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, res
+
+
+def bench_size(grid: int, work_dir: str, repeats: int, seed: int) -> Dict[str, Any]:
+    """Generates one synthetic map and times each stage on it."""
+    in_path = os.path.join(work_dir, 'synth-{}.osm'.format(grid))
+    synth_counts = synth.generate(in_path, grid=grid, seed=seed)
+    times = {}  # type: Dict[str, float]
+
+    def cold_preproc():
+        # fresh cache every time, so this includes parsing
+        cache_dir = tempfile.mkdtemp(dir=work_dir)
+        try:
+            return osm.preproc(in_path, cache_dir=cache_dir)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    cache_dir = os.path.join(work_dir, 'cache')
+    times['preproc'], _ = best_time(cold_preproc, repeats)
+    with quiet():
+        osm.preproc(in_path, cache_dir=cache_dir)
+    times['preproc_cached'], (node_map, ways, geo_bounds) = best_time(
+        lambda: osm.preproc(in_path, cache_dir=cache_dir), repeats)
+
+    times['graph_build'], g = best_time(lambda: graph.build(node_map, ways), repeats)
+    times['find_blocks'], (_, block_refs, block_pixels) = best_time(
+        lambda: graph.find_blocks(g, node_map, geo_bounds, INTERMEDIATE_RES), repeats)
+
+    def get_buildings():
+        building_geos, _ = buildings.get(node_map, ways)
+        return graph.geo_ways_to_pixel_coords(building_geos, geo_bounds, INTERMEDIATE_RES)
+    times['buildings'], building_pixels = best_time(get_buildings, repeats)
+    times['match'], block_map = best_time(
+        lambda: blocks_dataset.match_buildings_blocks(building_pixels, block_pixels), repeats)
+
+    a_dir, b_dir = os.path.join(work_dir, 'A'), os.path.join(work_dir, 'B')
+    os.makedirs(a_dir, exist_ok=True)
+    os.makedirs(b_dir, exist_ok=True)
+    # timed warm (parse cached, as in any rebuild), so this is the work after
+    # parsing: picking out ways, pixel conversion and writing. the cold
+    # parse is timed by 'preproc' above.
+    def process_file():
+        return chunks_dataset.process_file(
+            in_path, a_dir, b_dir, CHUNK_RES, 'bench', grid, cache_dir=cache_dir)
+    with quiet():
+        process_file()
+    times['process_file_cached'], _ = best_time(process_file, repeats)
+
+    return {
+        'grid': grid,
+        'counts': {
+            'nodes': len(node_map),
+            'ways': len(ways),
+            'roads': synth_counts['roads'],
+            'graph_nodes': len(g),
+            'blocks': len(block_refs),
+            'buildings': len(building_pixels),
+            'matched': sum(len(v) for v in block_map.values()),
+        },
+        'times': times,
+    }
+
+
+def scaling(results: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Returns each stage's empirical exponent: the least squares slope of
+    log(time) vs log(nodes) across sizes (1 is linear, 2 quadratic)."""
+    if len(results) < 2:
+        return {}
+    log_n = np.log([r['counts']['nodes'] for r in results])
+    res = {}  # type: Dict[str, float]
+    for stage in results[0]['times']:
+        # (clamp so that stages too fast to time don't blow up the log)
+        log_t = np.log([max(r['times'][stage], 1e-6) for r in results])
+        res[stage] = float(np.polyfit(log_n, log_t, 1)[0])
+    return res
+
+
+def compare(
+        current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+        min_seconds: float, exponent_slack: float) -> List[str]:
+    """Returns descriptions of regressions in `current` vs `baseline`."""
+    problems = []  # type: List[str]
+    base_times = {r['grid']: r['times'] for r in baseline['results']}
+    for r in current['results']:
+        if r['grid'] not in base_times:
+            continue
+        for stage, t in sorted(r['times'].items()):
+            bt = base_times[r['grid']].get(stage)
+            if bt is None:
+                continue
+            if t > bt * tolerance and t - bt > min_seconds:
+                problems.append('{} at grid {}: {:.3f}s vs {:.3f}s baseline ({:.1f}x)'.format(
+                    stage, r['grid'], t, bt, t / max(bt, 1e-9)))
+
+    for stage, exp in sorted(current['scaling'].items()):
+        base_exp = baseline['scaling'].get(stage)
+        # (stages that stay too fast to time have noise for exponents)
+        slowest = max(r['times'][stage] for r in current['results'])
+        if base_exp is not None and exp > base_exp + exponent_slack and slowest > min_seconds:
+            problems.append('{} scales worse: time ~ nodes^{:.2f} vs ^{:.2f} baseline'.format(
+                stage, exp, base_exp))
+    return problems
+
+
+def report(current: Dict[str, Any]) -> None:
+    stages = list(current['results'][0]['times'].keys())
+    print('{:>6} {:>8} '.format('grid', 'nodes') + ' '.join('{:>14}'.format(s) for s in stages))
+    for r in current['results']:
+        print('{:>6} {:>8} '.format(r['grid'], r['counts']['nodes']) + ' '.join(
+            '{:>14.4f}'.format(r['times'][s]) for s in stages))
+    if len(current['scaling']) > 0:
+        print('{:>15} '.format('exponent') + ' '.join(
+            '{:>14.2f}'.format(current['scaling'][s]) for s in stages))
+    for r in current['results']:
+        print('grid {}: {}'.format(r['grid'], ', '.join(
+            '{} {}'.format(v, k) for k, v in sorted(r['counts'].items()))))
+
+
+def save(path: str, data: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline on synthetic maps')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='grid sizes to run')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per stage (fastest counts)')
+    parser.add_argument('--seed', type=int, default=0, help='synth seed')
+    parser.add_argument('--out', type=str, default=DEFAULT_OUT, help='where to write results')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE, help='baseline to compare to')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed slowdown factor per stage')
+    parser.add_argument('--min-seconds', type=float, default=0.05, help='ignore slowdowns smaller than this')
+    parser.add_argument('--exponent-slack', type=float, default=0.3, help='allowed increase in scaling exponent')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mapgen-bench-')
+    try:
+        results = []
+        for grid in sorted(args.sizes):
+            print('Benchmarking grid {}...'.format(grid))
+            results.append(bench_size(grid, work_dir, args.repeats, args.seed))
+    finally:
+        shutil.rmtree(work_dir)
+
+    current = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeats': args.repeats,
+            'seed': args.seed,
+        },
+        'results': results,
+        'scaling': scaling(results),
+    }  # type: Dict[str, Any]
+    report(current)
+    save(args.out, current)
+    print('Wrote results to "{}"'.format(args.out))
+
+    if args.save_baseline:
+        save(args.baseline, current)
+        print('Saved as baseline "{}"'.format(args.baseline))
+        return
+    if not os.path.exists(args.baseline):
+        print('WARNING: No baseline at "{}" to compare against (use --save-baseline)'.format(args.baseline))
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    problems = compare(current, baseline, args.tolerance, args.min_seconds, args.exponent_slack)
+    for p in problems:
+        print('REGRESSION: {}'.format(p))
+    if len(problems) > 0:
+        sys.exit(1)
+    print('No regressions vs baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,19 +6,22 @@ Building "block w/ buildings" dataset.
 import argparse
 import code
 import os
-from typing import Dict, Set, Tuple, List, FrozenSet
+from typing import Dict, Set, Tuple, List, FrozenSet, Union
 
 # 3rd party
 from tqdm import tqdm
 
 # local
 import buildings
+import chunkfmt
 import graph
 import osm
 import geo
 from geo import Polygon
 import polygon
 from polygon import DiscretePoly
+import spatial
+import tracing
 
 
 class FullPixelBlock:
@@ -54,22 +57,38 @@ def full_block_pixel_coords(
     return fbs
 
 
+@tracing.traced('match_buildings_blocks')
 def match_buildings_blocks(
         building_pixels: List[DiscretePoly],
         block_pixels: List[DiscretePoly]) -> Dict[int, List[int]]:
     """
     Returns: mapping from block index to list of building indices that are
         inside of it.
-    """
-    res = {}  # type: Dict[int, List[int]]
 
-    # check each against the other
-    for i, block in enumerate(tqdm(block_pixels)):
-        res[i] = []
-        for j, building in enumerate(building_pixels):
-            if graph.polygon_contains(block, building):
+    Only blocks whose bounding box contains a building's bounding box can
+    contain the building, so those candidates (from a grid index over the
+    blocks) are the only ones tested exactly.
+    """
+    res = {i: [] for i in range(len(block_pixels))}  # type: Dict[int, List[int]]
+    index = spatial.BBoxIndex.from_polys(block_pixels)
+    all_blocks = list(range(len(block_pixels)))
+
+    # check each building against its candidate blocks
+    tested = 0
+    for j, building in enumerate(tqdm(building_pixels)):
+        # (an empty building is trivially contained by every block)
+        candidates = index.containing(spatial.poly_bbox(building)) if len(building) > 0 else all_blocks
+        tested += len(candidates)
+        for i in candidates:
+            if graph.polygon_contains(block_pixels[i], building):
                 res[i].append(j)
 
+    total = len(block_pixels) * len(building_pixels)
+    tracing.count('containment_tests', tested)
+    tracing.count('matched', sum(len(v) for v in res.values()))
+    print('Matching: tested {} of {} building/block pairs ({} pruned)'.format(
+        tested, total, total - tested))
+
     return res
 
 # remember....
@@ -81,33 +100,63 @@ def match_buildings_blocks(
 #     buildings: List[DiscretePoly]
 
 
-def gen_for_file(in_fn: str, out_dir: str, ir_w: int, ir_h: int, res: int) -> None:
-    # get filename info to use as prefix
-    prefix, _ = os.path.basename(in_fn).split('.')
-
-    intermediate_resolution = (ir_w, ir_h)
-
-    node_map, ways, geo_bounds = osm.preproc(in_fn)
-
-    # blocks
-    print('Extracting blocks...')
-    g = graph.build(node_map, ways)
-    block_geos, block_refs, block_pixels = graph.find_blocks(g, node_map, geo_bounds, intermediate_resolution)
-
-    # buildings
-    print('Extracting buildings...')
-    building_geos, building_refs = buildings.get(node_map, ways)
-    building_pixels = graph.geo_ways_to_pixel_coords(building_geos, geo_bounds, intermediate_resolution)
-
-    # find buildings in blocks
-    print('Matching buildings to blocks...')
-    block_map = match_buildings_blocks(building_pixels, block_pixels)
-
-    # get pixel coords per block
-    fbs = full_block_pixel_coords(block_map, building_geos, block_geos, (res - 1, res - 1))
-
-    # write data out so processing can render
+def gen_for_file(
+        in_fn: str, out_dir: str, ir_w: int, ir_h: int,
+        res: Union[int, List[int]], fmt: str = 'txt', method: str = 'faces',
+        workers: int = 1) -> None:
+    """Writes one file per full block (the block, then its buildings) to
+    `out_dir`, as text for Processing (`fmt` 'txt') or in chunkfmt's binary
+    format ('bin'). Blocks are found with `method` in `workers` processes
+    (see graph.find_blocks()).
+
+    `res` can also be a list of resolutions. Then parsing, block finding and
+    matching happen once, and each resolution gets its own pixel conversion
+    and output subdirectory (e.g., out_dir/250x250/)."""
+    with tracing.stage('file', path=in_fn):
+        # get filename info to use as prefix
+        prefix, _ = os.path.basename(in_fn).split('.')
+
+        intermediate_resolution = (ir_w, ir_h)
+
+        node_map, ways, geo_bounds = osm.preproc(in_fn)
+
+        # blocks
+        print('Extracting blocks...')
+        g = graph.build(node_map, ways)
+        block_geos, block_refs, block_pixels = graph.find_blocks(
+            g, node_map, geo_bounds, intermediate_resolution, method, workers)
+
+        # buildings
+        print('Extracting buildings...')
+        building_geos, building_refs = buildings.get(node_map, ways)
+        building_pixels = graph.geo_ways_to_pixel_coords(building_geos, geo_bounds, intermediate_resolution)
+
+        # find buildings in blocks
+        print('Matching buildings to blocks...')
+        block_map = match_buildings_blocks(building_pixels, block_pixels)
+
+        # everything so far is the same at any output resolution
+        if isinstance(res, list):
+            variants = [(r, os.path.join(out_dir, '{}x{}'.format(r, r))) for r in res]
+            for _, d in variants:
+                os.makedirs(d, exist_ok=True)
+        else:
+            variants = [(res, out_dir)]
+
+        for r, d in variants:
+            # get pixel coords per block
+            fbs = full_block_pixel_coords(block_map, building_geos, block_geos, (r - 1, r - 1))
+            write_blocks(fbs, d, prefix, fmt)
+
+
+def write_blocks(fbs: List[FullPixelBlock], out_dir: str, prefix: str, fmt: str = 'txt') -> None:
+    """Writes data out so processing can render."""
     for i, fb in enumerate(fbs):
+        if fmt == 'bin':
+            chunkfmt.write(
+                os.path.join(out_dir, '{}-{}.bin'.format(prefix, str(i))),
+                [('block', fb.block)] + [('building', b) for b in fb.buildings])
+            continue
         block = polygon.poly2str(fb.block)
         bs = [polygon.poly2str(b) for b in fb.buildings]
         with open(os.path.join(out_dir, '{}-{}.txt'.format(prefix, str(i))), 'w') as f:
@@ -128,8 +177,9 @@ def main():
     parser.add_argument(
         '--out_res',
         type=int,
-        default=250,
-        help='output image resolution in pixels (per side)')
+        nargs='+',
+        default=[250],
+        help='output image resolution in pixels (per side). give several to make each (in subdirectories)')
     parser.add_argument(
         '--ir_w',
         type=int,
@@ -140,9 +190,35 @@ def main():
         type=int,
         default=600,
         help='intermediate resolution (for raster tests): height')
+    parser.add_argument(
+        '--format',
+        choices=['txt', 'bin'],
+        default='txt',
+        help='output file format (bin: compact binary, see chunkfmt.py)')
+    parser.add_argument(
+        '--method',
+        choices=['faces', 'rings'],
+        default='faces',
+        help='block finding method (see graph.find_blocks())')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of processes to find blocks with (rings method)')
+    parser.add_argument(
+        '--trace',
+        type=str,
+        default=None,
+        help='write per-stage timings and counters (JSON lines) to this path')
     args = parser.parse_args()
 
-    gen_for_file(args.in_fn, args.out_dir, args.ir_w, args.ir_h, args.out_res)
+    if args.trace is not None:
+        tracing.enable(args.trace)
+    out_res = args.out_res[0] if len(args.out_res) == 1 else args.out_res
+    gen_for_file(
+        args.in_fn, args.out_dir, args.ir_w, args.ir_h, out_res, args.format,
+        args.method, args.workers)
+    tracing.disable()
 
 
 if __name__ == '__main__':
@@ -9,7 +9,6 @@ Extracting buildings from map file(s)
 import code
 import pickle
 from typing import List, Tuple, Dict
-import xml.etree.ElementTree as ET
 
 # 3rd party
 from PIL import Image
@@ -19,6 +18,7 @@ from tqdm import tqdm
 import geo
 import osm
 import polygon
+import tracing
 
 
 def str_raster_to_bin(raster: List[List[str]]) -> List[Tuple[int,int,int]]:
@@ -29,14 +29,16 @@ def str_raster_to_bin(raster: List[List[str]]) -> List[Tuple[int,int,int]]:
     return res
 
 
+@tracing.traced('buildings.get')
 def get(
-        node_map: Dict[int, ET.Element],
-        ways: List[ET.Element]) -> Tuple[List[List[Tuple[float, float]]], List[List[int]]]:
+        node_map: osm.NodeStore,
+        ways: List[osm.Way]) -> Tuple[List[List[Tuple[float, float]]], List[List[int]]]:
     """
     Retrieve buildings.
     """
-    buildings_raw = [way for way in ways if 'building' in osm.get_way_features(way)]
+    buildings_raw = [way for way in ways if 'building' in way.tags]
     building_geos, building_refs = osm.transform_ways(node_map, buildings_raw)
+    tracing.count('buildings', len(building_geos))
     return building_geos, building_refs
 
 
@@ -46,13 +48,13 @@ def test_build():
 
     node_map, ways, geo_bounds = osm.preproc(fn)
     print('Extracting buildings')
-    buildings = [way for way in ways if 'building' in osm.get_way_features(way)]
+    buildings = [way for way in ways if 'building' in way.tags]
     print('Extracting geo polys')
     geo_polys, _ = osm.transform_ways(node_map, buildings)
     print('Converting to pixel polys')
     pixel_polys = [geo.convert_poly(g, (res, res)) for g in geo_polys]
     print('Rasterizing pixel polys')
-    rasters = [polygon.brute_force_raster(p, res) for p in tqdm(pixel_polys)]
+    rasters = [polygon.raster_to_str(polygon.scanline_raster(p, res)) for p in tqdm(pixel_polys)]
     d = polygon.display_raster
     d(rasters[0])
     code.interact(local=dict(globals(), **locals()))
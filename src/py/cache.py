@@ -0,0 +1,237 @@
+"""
+On-disk cache of arrays derived from an input file (e.g., a parsed .osm).
+
+Each entry is a single binary file: a small JSON header followed by the raw
+arrays, so loading is just a memory map. Entries are keyed on the input's
+absolute path and validated against its size, mtime and content hash, and
+against the version of whatever made them (see load()); the
+cache directory is kept under a size cap by evicting the least recently used
+entries.
+"""
+
+# imports
+# ---
+
+# builtins
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from typing import Dict, Optional
+
+# 3rd party
+import numpy as np
+
+
+# settings
+# ---
+
+# $MAPGEN_CACHE_DIR if set, else mapgen/ in the user's cache directory
+# ($XDG_CACHE_HOME, or ~/.cache). never relative to the working directory,
+# so runs from inside the checkout don't write binaries into it.
+CACHE_DIR = os.environ.get('MAPGEN_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'mapgen')
+CACHE_MAX_BYTES = 4 * 1024**3
+
+MAGIC = b'MGCACHE1'
+
+# version of the entry layout (header fields, array placement). entries
+# with any other format are ignored.
+FORMAT = 2
+ALIGN = 64
+
+
+# code
+# ---
+
+def content_hash(fn: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def entry_path(fn: str, cache_dir: str, kind: str) -> str:
+    key = hashlib.sha1(os.path.abspath(fn).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, '{}-{}.bin'.format(key, kind))
+
+
+def read_header(path: str) -> Optional[Dict]:
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MAGIC) + 8)
+        if len(prefix) < len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            return None
+        header_len, = struct.unpack('<Q', prefix[len(MAGIC):])
+        return json.loads(f.read(header_len).decode('utf-8'))
+
+
+def write_header(path: str, header: Dict) -> None:
+    """Rewrites an entry's header in place. It has to fit in the space
+    reserved for it when the entry was stored."""
+    header_bytes = json.dumps(header).encode('utf-8')
+    with open(path, 'r+b') as f:
+        f.seek(len(MAGIC))
+        header_space, = struct.unpack('<Q', f.read(8))
+        if len(header_bytes) > header_space:
+            raise ValueError('Cache header too large ({} bytes)'.format(len(header_bytes)))
+        f.write(header_bytes.ljust(header_space))
+
+
+def remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        # (another process got to it first)
+        pass
+
+
+def load(fn: str, cache_dir: str, kind: str, version: str = '') -> Optional[Dict[str, np.ndarray]]:
+    """Returns the arrays cached for `fn` (as read-only views into a memory
+    map), or None if there's no valid entry.
+
+    `version` identifies the code that made the arrays (e.g., a hash of it);
+    an entry stored with a different version (or entry format) is stale.
+
+    An entry whose size and mtime match `fn` is trusted as is. If only the
+    mtime differs (e.g., the file was copied or touched), the content hash
+    decides; if it matches, the entry takes the new mtime, so the next load
+    is quick again. Stale entries are removed.
+    """
+    path = entry_path(fn, cache_dir, kind)
+    try:
+        header = read_header(path)
+    except (OSError, ValueError):
+        return None
+    if header is None:
+        return None
+
+    stat = os.stat(fn)
+    if (header.get('format') != FORMAT or header.get('version') != version or
+            header['size'] != stat.st_size):
+        remove(path)
+        return None
+    if header['mtime_ns'] != stat.st_mtime_ns:
+        if header['hash'] != content_hash(fn):
+            remove(path)
+            return None
+        header['mtime_ns'] = stat.st_mtime_ns
+        try:
+            write_header(path, header)
+        except (OSError, ValueError) as e:
+            print('WARNING: Could not update cache entry "{}": {}'.format(path, e))
+
+    mm = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}  # type: Dict[str, np.ndarray]
+    for name, spec in header['arrays'].items():
+        arrays[name] = np.ndarray(
+            tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=mm,
+            offset=spec['offset'])
+
+    # mark as recently used (for eviction)
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return arrays
+
+
+def store(
+        fn: str, cache_dir: str, kind: str, arrays: Dict[str, np.ndarray],
+        version: str = '', max_bytes: int = CACHE_MAX_BYTES) -> None:
+    """Writes `arrays` as the cache entry for `fn` (made by code `version`;
+    see load()), then evicts old entries until the cache fits in
+    `max_bytes`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(fn)
+    header = {
+        'format': FORMAT,
+        'version': version,
+        'path': os.path.abspath(fn),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': content_hash(fn),
+        'arrays': {},
+    }
+
+    # lay out arrays after the header. offsets depend on the header's size,
+    # which depends on the offsets, so pad the header to a fixed guess.
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    header_space = 1024 + 128 * len(arrays)
+    offset = len(MAGIC) + 8 + header_space
+    for name, arr in arrays.items():
+        offset = (offset + ALIGN - 1) // ALIGN * ALIGN
+        header['arrays'][name] = {
+            'dtype': arr.dtype.str,
+            'shape': list(arr.shape),
+            'offset': offset,
+        }
+        offset += arr.nbytes
+    header_bytes = json.dumps(header).encode('utf-8')
+    if len(header_bytes) > header_space:
+        raise ValueError('Cache header too large ({} bytes)'.format(len(header_bytes)))
+
+    path = entry_path(fn, cache_dir, kind)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', header_space))
+            f.write(header_bytes.ljust(header_space))
+            for name, arr in arrays.items():
+                f.seek(header['arrays'][name]['offset'])
+                f.write(arr.tobytes())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir: str, max_bytes: int) -> None:
+    """Removes least recently used entries until the cache fits."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.bin'):
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            # (another process got to it first)
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        remove(os.path.join(cache_dir, name))
+        total -= size
+
+
+def test_cache() -> None:
+    cache_dir = tempfile.mkdtemp()
+    fn = os.path.join(cache_dir, 'input.osm')
+    with open(fn, 'w') as f:
+        f.write('<osm/>')
+    store(fn, cache_dir, 'test', {'a': np.arange(5)}, 'v1')
+    assert load(fn, cache_dir, 'test', 'v1')['a'].tolist() == list(range(5))
+
+    # touched: the hash still matches, and the entry picks up the new mtime
+    os.utime(fn, ns=(0, 12345))
+    assert load(fn, cache_dir, 'test', 'v1') is not None
+    assert read_header(entry_path(fn, cache_dir, 'test'))['mtime_ns'] == 12345
+
+    # made by other code: stale
+    assert load(fn, cache_dir, 'test', 'v2') is None
+    assert not os.path.exists(entry_path(fn, cache_dir, 'test'))
+
+    # changed: stale
+    store(fn, cache_dir, 'test', {'a': np.arange(5)}, 'v1')
+    with open(fn, 'w') as f:
+        f.write('<osm></osm>')
+    assert load(fn, cache_dir, 'test', 'v1') is None
+    assert not os.path.exists(entry_path(fn, cache_dir, 'test'))
@@ -0,0 +1,241 @@
+"""
+Compact binary format for chunk / block geometry files (the A/B .txt files).
+
+A file is a list of shapes, each a category and a list of integer pixel
+points:
+
+    MAGIC
+    varint                  number of shapes (n)
+    n bytes                 category codes (index into CATEGORIES)
+    n varints               vertex counts
+    2 * sum(counts) varints x, y coordinates: zigzag deltas from the previous
+                            point (across shapes; the first is from (0, 0))
+
+Neighboring points are close together, so most coordinates take one byte,
+versus ~4 as text. Reading and writing are vectorized with NumPy.
+"""
+
+# imports
+# ---
+
+# builtins
+import argparse
+import os
+import re
+from typing import Dict, List, Tuple
+
+# 3rd party
+import numpy as np
+from tqdm import tqdm
+
+# local
+from polygon import DiscretePoly
+
+
+# settings
+# ---
+
+MAGIC = b'MGCHUNK1'
+
+# a category's code is its index here; only ever append to this list.
+CATEGORIES = ['building', 'park', 'walkarea', 'highway', 'footpath', 'water', 'block']
+CATEGORY_CODES = {cat: i for i, cat in enumerate(CATEGORIES)}
+
+Shape = Tuple[str, DiscretePoly]
+
+
+# code
+# ---
+
+def _varint_encode(vals: np.ndarray) -> bytes:
+    """LEB128-encodes non-negative integers."""
+    vals = np.asarray(vals, dtype=np.uint64)
+    nbytes = np.ones(len(vals), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += vals >= np.uint64(1 << (7 * k))
+    idx = np.repeat(np.arange(len(vals)), nbytes)
+    pos = np.arange(len(idx)) - np.repeat(np.cumsum(nbytes) - nbytes, nbytes)
+    out = (vals[idx] >> (7 * pos).astype(np.uint64)) & np.uint64(0x7f)
+    out[pos < nbytes[idx] - 1] |= np.uint64(0x80)
+    return out.astype(np.uint8).tobytes()
+
+
+def _varint_decode(buf: np.ndarray, count: int) -> Tuple[np.ndarray, int]:
+    """Decodes `count` varints from the start of `buf` (uint8). Returns
+    (values as uint64, number of bytes read)."""
+    if count == 0:
+        return np.zeros(0, dtype=np.uint64), 0
+    ends = np.flatnonzero(buf < 0x80)[:count]
+    if len(ends) < count:
+        raise ValueError('Truncated chunk file')
+    end = int(ends[-1]) + 1
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    group = np.repeat(np.arange(count), ends - starts + 1)
+    pos = np.arange(end) - starts[group]
+    vals = (buf[:end] & 0x7f).astype(np.uint64) << (7 * pos).astype(np.uint64)
+    return np.add.reduceat(vals, starts), end
+
+
+def _zigzag(vals: np.ndarray) -> np.ndarray:
+    vals = vals.astype(np.int64)
+    return ((vals << 1) ^ (vals >> 63)).astype(np.uint64)
+
+
+def _unzigzag(vals: np.ndarray) -> np.ndarray:
+    vals = vals.astype(np.int64)
+    return (vals >> 1) ^ -(vals & 1)
+
+
+def encode_arrays(codes: np.ndarray, counts: np.ndarray, coords: np.ndarray) -> bytes:
+    """Encodes shapes given as category codes (n,), vertex counts (n,) and
+    all points concatenated (sum(counts), 2)."""
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    deltas = np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    return b''.join([
+        MAGIC,
+        _varint_encode(np.array([len(codes)])),
+        np.asarray(codes, dtype=np.uint8).tobytes(),
+        _varint_encode(counts),
+        _varint_encode(_zigzag(deltas.ravel())),
+    ])
+
+
+def decode_arrays(data: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns (category codes (n,), offsets (n + 1,), points (N, 2)): shape
+    i's points are points[offsets[i]:offsets[i + 1]]."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a chunk file (bad magic)')
+    buf = np.frombuffer(data, dtype=np.uint8, offset=len(MAGIC))
+    (n,), used = _varint_decode(buf, 1)
+    n = int(n)
+    codes = buf[used:used + n].copy()
+    if len(codes) < n:
+        raise ValueError('Truncated chunk file')
+    used += n
+    counts, k = _varint_decode(buf[used:], n)
+    used += k
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts.astype(np.int64))
+    deltas, k = _varint_decode(buf[used:], 2 * int(offsets[-1]))
+    used += k
+    if used != len(buf):
+        raise ValueError('Trailing data in chunk file')
+    coords = np.cumsum(_unzigzag(deltas).reshape(-1, 2), axis=0)
+    return codes, offsets, coords
+
+
+def encode(shapes: List[Shape]) -> bytes:
+    codes = np.array([CATEGORY_CODES[cat] for cat, _ in shapes], dtype=np.uint8)
+    counts = np.array([len(poly) for _, poly in shapes], dtype=np.int64)
+    coords = [pt for _, poly in shapes for pt in poly]
+    return encode_arrays(codes, counts, np.array(coords, dtype=np.int64).reshape(-1, 2))
+
+
+def decode(data: bytes) -> List[Shape]:
+    codes, offsets, coords = decode_arrays(data)
+    pts = [(x, y) for x, y in coords.tolist()]
+    bounds = offsets.tolist()
+    return [
+        (CATEGORIES[code], pts[bounds[i]:bounds[i + 1]])
+        for i, code in enumerate(codes.tolist())
+    ]
+
+
+def write(path: str, shapes: List[Shape]) -> None:
+    with open(path, 'wb') as f:
+        f.write(encode(shapes))
+
+
+def read(path: str) -> List[Shape]:
+    with open(path, 'rb') as f:
+        return decode(f.read())
+
+
+def to_geometry(shapes: List[Shape]) -> Dict[str, List[DiscretePoly]]:
+    """Groups shapes by category (e.g., for render.render_chunk())."""
+    geometry = {}  # type: Dict[str, List[DiscretePoly]]
+    for cat, poly in shapes:
+        if cat not in geometry:
+            geometry[cat] = []
+        geometry[cat].append(poly)
+    return geometry
+
+
+# text conversion
+# ---
+
+# a category name followed by ';' starts a shape. (B chunk files have no
+# newline between the last rest line and the first building, so shapes can't
+# just be split by line.)
+_SHAPE_START = re.compile(r'(?<![a-z_])(?=(?:{});)'.format('|'.join(CATEGORIES)))
+
+
+def _str2poly(s: str) -> DiscretePoly:
+    nums = [int(n) for n in s.replace(',', ' ').split()]
+    return list(zip(nums[0::2], nums[1::2]))
+
+
+def parse_txt(text: str) -> List[Shape]:
+    """Parses either .txt format:
+        - chunks: 'category;x,y x,y ...' per line
+        - blocks: the block's points on the first line, then one building's
+          per line
+    """
+    if ';' in text:
+        shapes = []  # type: List[Shape]
+        for piece in _SHAPE_START.split(text):
+            if piece.strip() == '':
+                continue
+            cat, pts = piece.split(';')
+            shapes.append((cat.strip(), _str2poly(pts)))
+        return shapes
+    lines = [line for line in text.split('\n') if line.strip() != '']
+    return [('block' if i == 0 else 'building', _str2poly(line)) for i, line in enumerate(lines)]
+
+
+def convert(txt_path: str, bin_path: str) -> None:
+    with open(txt_path) as f:
+        write(bin_path, parse_txt(f.read()))
+
+
+def test_roundtrip() -> None:
+    shapes = [
+        ('water', [(0, 0), (499, 0), (499, 12)]),
+        ('highway', [(3, 400), (3, 401)]),
+        ('park', []),
+        ('building', [(-5, 1000), (70000, 3), (2, 2)]),
+    ]  # type: List[Shape]
+    assert decode(encode(shapes)) == shapes
+    assert decode(encode([])) == []
+    text = 'water;0,0 499,0 499,12\nhighway;3,400 3,401building;1,2 3,4 5,6\n'
+    assert parse_txt(text) == [
+        ('water', [(0, 0), (499, 0), (499, 12)]),
+        ('highway', [(3, 400), (3, 401)]),
+        ('building', [(1, 2), (3, 4), (5, 6)]),
+    ]
+    assert parse_txt('1,2 3,4 5,6\n7,8 9,10\n') == [
+        ('block', [(1, 2), (3, 4), (5, 6)]),
+        ('building', [(7, 8), (9, 10)]),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Converts .txt chunk/block files to the binary format')
+    parser.add_argument('in_dir', type=str, help='directory of .txt files')
+    parser.add_argument('out_dir', type=str, help='directory to write .bin files to')
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    txt_bytes, bin_bytes = 0, 0
+    for fn in tqdm(sorted(f for f in os.listdir(args.in_dir) if f.endswith('.txt'))):
+        txt_path = os.path.join(args.in_dir, fn)
+        bin_path = os.path.join(args.out_dir, fn[:-len('.txt')] + '.bin')
+        convert(txt_path, bin_path)
+        txt_bytes += os.path.getsize(txt_path)
+        bin_bytes += os.path.getsize(bin_path)
+    print('INFO: {} bytes of text -> {} bytes binary ({:.1f}x smaller)'.format(
+        txt_bytes, bin_bytes, txt_bytes / max(bin_bytes, 1)))
+
+
+if __name__ == '__main__':
+    main()
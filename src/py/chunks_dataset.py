@@ -16,75 +16,49 @@ just a single .osm file at a time.
 # ---
 
 # builtins
+import argparse
 from collections import Counter
 import code
+import contextlib
+import hashlib
+import inspect
+import json
+import multiprocessing
 import os
-import typing
-from typing import List, Tuple, Set, Dict, Optional
+import tempfile
+from typing import Any, List, Tuple, Set, Dict, Optional, Union
 
 # 3rd party
+import numpy as np
 from tqdm import tqdm
 
 # local
+import cache
+import chunkfmt
 import geo
 import osm
 import polygon
+from polygon import DiscretePoly
+import render
+import simplify
+import tracing
 
 
-# functions
+# settings
 # ---
 
-def get_category(features: Dict[str, str]) -> Optional[str]:
-    """
-    From the set of way features, returns a single one as the category.
+MANIFEST_VERSION = 2
 
-    This is probably overkill, as we'll likely only have one, but we have to
-    make sure that we pick one.
-    """
-    # priority order. maps feature key to its category
-    key_categories = [
-        ('building', 'building'),
-        ('water', 'water'),
-    ]
-    for key, cat in key_categories:
-        if key in features:
-            return cat
-
-    # secondary: try at more detailed key/vals
-    kv_categories = [
-        # not a footpath, but an area to walk on
-        ('man_made', 'pier', 'walkarea'),
-
-        # things that are "highway"s but for people, not cars
-        ('highway', 'path', 'footpath'),
-        ('highway', 'steps', 'footpath'),
-        ('highway', 'pedestrian', 'footpath'),
-        ('highway', 'footway', 'footpath'),
-        ('highway', 'track', 'footpath'),
-
-        # parks / greenery
-        ('liesure', 'park', 'park'),
-        ('landuse', 'meadow', 'park'),
-        ('natural', 'wood', 'park'),
-    ]
-    for key, val, cat in kv_categories:
-        if key in features and features[key] == val:
-            return cat
-
-    # backup: some have very little info
-    backup = [
-        ('highway', 'highway'),
-        # ('source', 'water'),
-    ]
-    for key, cat in backup:
-        if key in features:
-            return cat
+# output format -> file extension. 'txt' is what the Processing sketches read;
+# 'bin' is chunkfmt's binary format.
+FORMATS = {'txt': '.txt', 'bin': '.bin'}
 
-    return None
 
+# functions
+# ---
 
-def get_out_path(prefix: str, num: int, out_dir: str) -> str:
-    return os.path.join(out_dir, '{}-{}.txt'.format(prefix, num))
+def get_out_path(prefix: str, num: int, out_dir: str, ext: str = '.txt') -> str:
+    return os.path.join(out_dir, '{}-{}{}'.format(prefix, num, ext))
 
 
 def rest_buffer_stringify(rest_buffer: Dict[str, List[str]]) -> str:
@@ -93,107 +67,513 @@ def rest_buffer_stringify(rest_buffer: Dict[str, List[str]]) -> str:
     water doesn't get drawn on top of piers.
     """
     res = ''
-    order = ['water', 'park', 'highway', 'walkarea', 'footpath']
     ordered_rest = []  # type: List[str]
-    for o in order:
+    for o in render.REST_ORDER:
         ordered_rest += rest_buffer[o]
     return '\n'.join(ordered_rest)
 
 
-def process_file(
-        in_path: str, a_dir: str, b_dir: str, res: Tuple[int, int],
-        prefix: str, num: int) -> bool:
+def select_ways(ways: List[osm.Way]) -> Tuple[List[str], List[List[int]]]:
+    """
+    Picks out the ways we're considering. Returns their categories and their
+    node refs.
+    """
+    categories = []  # type: List[str]
+    refs = []  # type: List[List[int]]
+    for way in ways:
+        # (categories are worked out once per distinct set of tags, at parse)
+        category = way.category
+
+        # if the way isn't one of the things we're considering, ignore it
+        tracing.count('ways.{}'.format(category or 'other'))
+        if category is None:
+            continue
+
+        categories.append(category)
+        refs.append(osm.way_refs(way, False))
+    return categories, refs
+
+
+@tracing.traced('pixels')
+def pixel_geometry(
+        categories: List[str], geo_ways: geo.Ragged,
+        geo_bounds: Tuple[float, float, float, float],
+        res: Tuple[int, int],
+        simplify_tol: Optional[float] = None) -> Optional[Dict[str, List[DiscretePoly]]]:
     """
-    want:
-    - list of ways. for each way:
-       - feature, [pixel points]
+    Converts ways (`geo_ways`, with `categories`) within `geo_bounds` to
+    pixels. Returns their pixel points, grouped by category (in order), or
+    None if there are no buildings (and so the chunk should be skipped).
+
+    If `simplify_tol` (pixels) is given, the pixel ways are simplified (see
+    simplify.py) before they're returned.
     """
-    # setup
     res_w, res_h = res
     pixel_bounds = (res_w - 1, res_h - 1)
-    node_map, way_els, geo_bounds = osm.preproc(in_path)
-
-    # debugging
-    c = Counter()  # type: typing.Counter[str]
 
-    rest_buffer = {
+    geometry = {
         'highway': [],
         'park': [],
         'walkarea': [],
         'water': [],
         'footpath': [],
-    }  # type: Dict[str, List[str]]
-    building_buffer = []  # type: List[str]
-    for way_el in way_els:
-        features = osm.get_way_detailed_features(way_el)
-        category = get_category(features)
-
-        # debugging
-        for feat_k, feat_v in features.items():
-            c['{},{}'.format(feat_k,feat_v)] += 1
-
-        # if the way isn't one of the things we're considering, ignore it
-        if category is None:
-            continue
+        'building': [],
+    }  # type: Dict[str, List[DiscretePoly]]
+
+    # go from ways -> pixels, all at once
+    pixel_ways = geo.convert_ragged(geo_bounds, pixel_bounds, geo_ways, discrete=True)
+    if simplify_tol is not None:
+        pixel_ways, counts = simplify_ways(categories, pixel_ways, simplify_tol)
+        for category, (before, after) in counts.items():
+            tracing.count('points.{}'.format(category), before)
+            tracing.count('points_simplified.{}'.format(category), after)
+    for category, way_pixels in zip(categories, pixel_ways.tolist()):
+        geometry[category].append(way_pixels)
+
+    # if there were 0 buildings, skip this chunk.
+    if len(geometry['building']) == 0:
+        return None
+
+    return geometry
+
+
+@tracing.traced('simplify')
+def simplify_ways(
+        categories: List[str], pixel_ways: geo.Ragged,
+        tolerance: float) -> Tuple[geo.Ragged, Dict[str, Tuple[int, int]]]:
+    """Simplifies pixel ways with `categories` (areas as polygons, the rest as
+    lines). Returns them and each category's (points before, points after)."""
+    closed = np.array([category not in render.LINE_CATEGORIES for category in categories], dtype=bool)
+    simplified = simplify.simplify(pixel_ways, tolerance, closed)
+    return simplified, simplify.count_points(categories, pixel_ways, simplified)
+
+
+@tracing.traced('extract')
+def extract_ways(
+        in_path: str, cache_dir: Optional[str] = cache.CACHE_DIR
+        ) -> Tuple[List[str], geo.Ragged, Tuple[float, float, float, float]]:
+    """
+    The resolution-independent part of extracting a file: parses it (or
+    loads it from the parse cache in `cache_dir`; see osm.preproc()) and
+    picks out the ways we're considering.
 
-        # go from way -> pixels
-        way_geo, way_ids = osm.transform_way(node_map, way_el, False)
-        way_pixels = geo.convert_points_discrete(
-            geo_bounds,
-            pixel_bounds,
-            way_geo)
-
-        # get out representation
-        line = '{};{}'.format(
-            category,
-            polygon.poly2str(way_pixels))
-
-        # write out to desired buffer
-        if category == 'building':
-            building_buffer.append(line)
-        else:
-            rest_buffer[category].append(line)
+    Returns (categories, geo coords, geo bounds), ready for pixel_geometry().
+    """
+    node_map, ways, geo_bounds = osm.preproc(in_path, cache_dir)
+    categories, refs = select_ways(ways)
 
     # debug output
     # print('Geo features found:')
+    # c = Counter(feat for way in ways for feat in way.features)
     # for feat, freq in c.most_common():
     #     print('{} \t {}'.format(freq, feat))
 
-    # if there were 0 buildings, skip this file.
-    if len(building_buffer) == 0:
-        # print('Skipping {} (0 buildings found)'.format(in_path))
-        return False
+    return categories, osm.gather_ways(node_map, refs), geo_bounds
+
+
+def stringify(geometry: Dict[str, List[DiscretePoly]]) -> Tuple[str, str]:
+    """Returns (rest_str, building_str): the text format the Processing
+    sketches read, one 'category;x,y x,y ...' line per way."""
+    lines = {
+        category: ['{};{}'.format(category, polygon.poly2str(poly)) for poly in polys]
+        for category, polys in geometry.items()
+    }
+    return rest_buffer_stringify(lines), '\n'.join(lines['building'])
+
+
+@tracing.traced('render')
+def render_pngs(geometry: Dict[str, List[DiscretePoly]], res: Tuple[int, int]) -> Tuple[bytes, bytes]:
+    """Returns the (A, B) images for one file as PNG bytes."""
+    return (
+        render.png_bytes(render.render_chunk(geometry, res, buildings=False)),
+        render.png_bytes(render.render_chunk(geometry, res, buildings=True)))
+
+
+@tracing.traced('format')
+def format_pair(geometry: Dict[str, List[DiscretePoly]], fmt: str) -> Tuple[bytes, bytes]:
+    """Returns the (A, B) file contents for one chunk in format `fmt`. A gets
+    only rest, B gets rest + buildings."""
+    if fmt == 'txt':
+        rest_str, building_str = stringify(geometry)
+        # (no newline between rest and buildings in B. it's always been this
+        # way; chunkfmt.parse_txt() copes.)
+        return rest_str.encode('utf-8'), (rest_str + building_str + '\n').encode('utf-8')
+    if fmt == 'bin':
+        rest = [(cat, poly) for cat in render.REST_ORDER for poly in geometry[cat]]
+        buildings = [('building', poly) for poly in geometry['building']]
+        return chunkfmt.encode(rest), chunkfmt.encode(rest + buildings)
+    raise ValueError('Unknown format "{}"'.format(fmt))
+
+
+def write_pair(
+        pair: Tuple[bytes, bytes], out_dirs: Tuple[str, str], prefix: str,
+        num: int, ext: str) -> List[str]:
+    """Writes out one A/B pair of files. Returns their paths."""
+    paths = []
+    for content, out_dir in zip(pair, out_dirs):
+        path = get_out_path(prefix, num, out_dir, ext)
+        with open(path, 'wb') as f:
+            f.write(content)
+        paths.append(path)
+    return paths
 
-    # write out. A gets only rest, B gets rest + buildings
-    # print('Writing with {}'.format(in_path))
-    rest_str = rest_buffer_stringify(rest_buffer)
-    with open(get_out_path(prefix, num, a_dir), 'w') as f:
-        f.write(rest_str)
-    with open(get_out_path(prefix, num, b_dir), 'w') as f:
-        f.write(rest_str)
-        f.write('\n'.join(building_buffer))
-        f.write('\n')
-    return True
+
+def process_file(
+        in_path: str, a_dir: str, b_dir: str,
+        res: Union[Tuple[int, int], List[Tuple[int, int]]],
+        prefix: str, num: int,
+        render_dirs: Optional[Tuple[str, str]] = None,
+        fmt: str = 'txt', simplify_tol: Optional[float] = None,
+        cache_dir: Optional[str] = cache.CACHE_DIR) -> bool:
+    """
+    Extracts and writes out a single file in format `fmt` (see FORMATS). If
+    `render_dirs` (A, B) are given, also renders A/B images there (replacing
+    the Processing step). If `simplify_tol` is given, ways are simplified to
+    that many pixels (see pixel_geometry()). Returns whether anything was
+    written (i.e., the file had > 0 buildings).
+
+    `res` can also be a list of resolutions. Then the file is parsed and its
+    ways picked out just once, and each resolution gets its own pixel
+    conversion and output subdirectories (e.g., A/256x256/, see res_dir()).
+
+    Parses are cached in `cache_dir` (see osm.preproc()).
+    """
+    with tracing.stage('file', path=in_path):
+        categories, geo_ways, geo_bounds = extract_ways(in_path, cache_dir)
+        if 'building' not in categories:
+            return False
+
+        for r, a, b, rd in output_variants(res, a_dir, b_dir, render_dirs):
+            geometry = pixel_geometry(categories, geo_ways, geo_bounds, r, simplify_tol)
+            if geometry is None:
+                return False
+            write_geometry(geometry, a, b, r, prefix, num, rd, fmt)
+        return True
+
+
+def res_dir(out_dir: str, res: Tuple[int, int]) -> str:
+    """Where outputs at `res` go when several resolutions are made at once."""
+    return os.path.join(out_dir, '{}x{}'.format(*res))
+
+
+# (resolution, A dir, B dir, render dirs)
+Variant = Tuple[Tuple[int, int], str, str, Optional[Tuple[str, str]]]
+
+
+def output_variants(
+        res: Union[Tuple[int, int], List[Tuple[int, int]]], a_dir: str,
+        b_dir: str, render_dirs: Optional[Tuple[str, str]] = None) -> List[Variant]:
+    """Where each resolution's outputs go: straight into the given dirs for a
+    single `res`, or into per-resolution subdirectories (see res_dir()),
+    which are made here, for a list."""
+    if not isinstance(res, list):
+        return [(res, a_dir, b_dir, render_dirs)]
+    variants = [
+        (r, res_dir(a_dir, r), res_dir(b_dir, r),
+         None if render_dirs is None else (res_dir(render_dirs[0], r), res_dir(render_dirs[1], r)))
+        for r in res
+    ]  # type: List[Variant]
+    for _, a, b, rd in variants:
+        for d in [a, b] + list(rd or []):
+            os.makedirs(d, exist_ok=True)
+    return variants
+
+
+def write_geometry(
+        geometry: Dict[str, List[DiscretePoly]], a_dir: str, b_dir: str,
+        res: Tuple[int, int], prefix: str, num: int,
+        render_dirs: Optional[Tuple[str, str]] = None,
+        fmt: str = 'txt') -> List[str]:
+    """Writes out one chunk's extracted geometry (see process_file()).
+    Returns the paths written."""
+    paths = write_pair(format_pair(geometry, fmt), (a_dir, b_dir), prefix, num, FORMATS[fmt])
+    if render_dirs is not None:
+        paths += write_pair(render_pngs(geometry, res), render_dirs, prefix, num, '.png')
+    return paths
+
+
+Extracted = Tuple[Tuple[bytes, bytes], Optional[Tuple[bytes, bytes]]]
+
+
+def _extract_job(
+        args: Tuple[str, List[Tuple[int, int]], bool, str, Optional[float]]) -> Optional[List[Extracted]]:
+    """Pool entry point (needs to be picklable, so top-level). Returns, for
+    each of the resolutions asked for, the A/B file contents and A/B PNGs (if
+    rendering), or None if the file has no buildings. The file is parsed and
+    its ways picked out once for all of them. Formatting and rendering happen
+    here, so they're done by the workers too."""
+    in_path, resolutions, do_render, fmt, simplify_tol = args
+    with tracing.stage('file', path=in_path):
+        categories, geo_ways, geo_bounds = extract_ways(in_path)
+        if 'building' not in categories:
+            return None
+        res = []  # type: List[Extracted]
+        for r in resolutions:
+            geometry = pixel_geometry(categories, geo_ways, geo_bounds, r, simplify_tol)
+            if geometry is None:
+                return None
+            res.append((format_pair(geometry, fmt), render_pngs(geometry, r) if do_render else None))
+        return res
+
+
+# incremental builds
+# ---
+
+def hash_strs(strs: List[str]) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for s in strs:
+        h.update(s.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def get_code_version() -> str:
+    """Hash of the code that turns an .osm file into outputs. If any of it
+    changes, every output is stale."""
+    return hash_strs(
+        [inspect.getsource(m) for m in (cache, chunkfmt, geo, osm, polygon, render, simplify)] +
+        [inspect.getsource(f) for f in (
+            select_ways, pixel_geometry, simplify_ways, extract_ways, stringify,
+            rest_buffer_stringify, render_pngs, format_pair, write_pair)])
+
+
+def get_config_version(
+        res: Tuple[int, int], prefix: str, out_dirs: Tuple[str, str],
+        render_dirs: Optional[Tuple[str, str]] = None, fmt: str = 'txt',
+        simplify_tol: Optional[float] = None) -> str:
+    """Hash of the settings (category rules, resolution, naming, output and
+    rendering dirs, format, simplification) outputs were made with."""
+    return hash_strs([
+        inspect.getsource(osm.get_category), json.dumps(list(res)), prefix,
+        json.dumps(out_dirs), json.dumps(render_dirs), fmt, json.dumps(simplify_tol)])
+
+
+def new_manifest() -> Dict[str, Any]:
+    # next_idx only ever goes up, so an output index is never handed to a
+    # different input (even if its old input stops producing output).
+    return {'version': MANIFEST_VERSION, 'next_idx': 0, 'files': {}}
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """Returns the manifest at `path`, or a fresh one if there is none (or
+    it's from an older version of this script)."""
+    if not os.path.exists(path):
+        return new_manifest()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        print('WARNING: Ignoring manifest "{}" (old version)'.format(path))
+        return new_manifest()
+    return manifest
+
+
+def save_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    """Saves atomically (temp file + rename), so a crash never leaves a
+    half-written manifest."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def res_key(res: Tuple[int, int]) -> str:
+    return '{}x{}'.format(*res)
+
+
+def is_dirty(
+        entry: Optional[Dict[str, Any]], content_hash: str, code_version: str,
+        res: Tuple[int, int], config_version: str) -> bool:
+    """Whether an input needs (re)processing at `res` given its manifest
+    entry."""
+    if entry is None or entry['hash'] != content_hash or entry['code'] != code_version:
+        return True
+    res_entry = entry['res'].get(res_key(res))
+    if res_entry is None or res_entry['config'] != config_version:
+        return True
+    return not all(os.path.exists(p) for p in res_entry['outputs'])
+
+
+def build(
+        in_paths: List[str], a_dir: str, b_dir: str,
+        res: Union[Tuple[int, int], List[Tuple[int, int]]],
+        prefix: str, manifest_path: str, workers: int = 1, force: bool = False,
+        checkpoint_every: int = 50,
+        render_dirs: Optional[Tuple[str, str]] = None,
+        fmt: str = 'txt', trace_path: Optional[str] = None,
+        simplify_tol: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Processes `in_paths` into format `fmt` (rendering A/B images to
+    `render_dirs` too, if given; simplifying ways to `simplify_tol` pixels,
+    if given), skipping any whose input, code and config are
+    unchanged since they were last built (per the manifest at
+    `manifest_path`). Returns the updated manifest.
+
+    `res` can also be a list of resolutions, which go in subdirectories (as
+    in process_file()). Each input is then parsed and its ways picked out
+    once for all of them. The manifest tracks each resolution of an input
+    separately, so e.g. adding a resolution only builds that one. An input
+    has one index, shared by all of its resolutions.
+
+    Output indices are stable: an input keeps its index across rebuilds, and
+    inputs that newly produce output get fresh indices at the end. A fresh
+    build numbers outputs exactly as the old (non-incremental) loop did.
+    The price of stability is gaps: when an input stops producing output
+    (e.g., it no longer has buildings), its index is retired, never handed
+    to another input, so the numbering skips it from then on. Use `force`
+    to renumber everything densely.
+
+    The manifest is saved every `checkpoint_every` files, so a crashed run
+    resumes close to where it stopped. Inputs are handled in the order of
+    `in_paths`, so work redone after a crash gets the same indices it had
+    before as long as `in_paths` comes in the same order (main() always
+    lists it the same way). In another order, the redone inputs still get
+    unused indices, just not necessarily the same ones.
+
+    If `trace_path` is given, every process traces its stages there (see
+    tracing.py; use '{pid}' in it for a file per worker).
+    """
+    manifest = new_manifest() if force else load_manifest(manifest_path)
+    files = manifest['files']
+    code_version = get_code_version()
+    variants = output_variants(res, a_dir, b_dir, render_dirs)
+    config_versions = [
+        get_config_version(r, prefix, (a, b), rd, fmt, simplify_tol) for r, a, b, rd in variants
+    ]
+
+    # (input, content hash, which variants need building)
+    todo = []  # type: List[Tuple[str, str, List[int]]]
+    for in_path in in_paths:
+        content_hash = cache.content_hash(in_path)
+        dirty = [
+            i for i, (r, _, _, _) in enumerate(variants)
+            if is_dirty(files.get(in_path), content_hash, code_version, r, config_versions[i])
+        ]
+        if len(dirty) > 0:
+            todo.append((in_path, content_hash, dirty))
+    print('INFO: {} of {} inputs need (re)building'.format(len(todo), len(in_paths)))
+
+    # extraction (the expensive part) runs in the workers. results come back
+    # in input order, so output indices are assigned exactly as in a serial
+    # run: next_idx only advances for files that had buildings.
+    jobs = [
+        (in_path, [variants[i][0] for i in dirty], render_dirs is not None, fmt, simplify_tol)
+        for in_path, _, dirty in todo
+    ]
+    with contextlib.ExitStack() as stack:
+        if workers > 1:
+            # (exiting the pool's context shuts its workers down, also when
+            # a job or a write fails)
+            initializer = tracing.enable if trace_path is not None else None
+            pool = stack.enter_context(multiprocessing.Pool(workers, initializer, (trace_path,)))
+            results = pool.imap(_extract_job, jobs, chunksize=4)
+        else:
+            if trace_path is not None:
+                tracing.enable(trace_path)
+                stack.callback(tracing.disable)
+            results = map(_extract_job, jobs)
+
+        for n, extracted in enumerate(tqdm(results, total=len(jobs))):
+            in_path, content_hash, dirty = todo[n]
+            old = files.get(in_path)
+            idx = None if old is None else old['idx']  # type: Optional[int]
+            # resolutions built from other content or code are stale, so
+            # they're dropped (rebuilt when asked for again)
+            res_entries = {}  # type: Dict[str, Dict[str, Any]]
+            if old is not None and old['hash'] == content_hash and old['code'] == code_version:
+                res_entries = old['res']
+            if extracted is None:
+                # no buildings (anymore). drop anything it made before.
+                if old is not None:
+                    for res_entry in old['res'].values():
+                        for p in res_entry['outputs']:
+                            if os.path.exists(p):
+                                os.remove(p)
+                idx = None
+                res_entries = {key: dict(e, outputs=[]) for key, e in res_entries.items()}
+                for i in dirty:
+                    res_entries[res_key(variants[i][0])] = {'config': config_versions[i], 'outputs': []}
+            else:
+                if idx is None:
+                    idx = manifest['next_idx']
+                    manifest['next_idx'] += 1
+                for i, (pair, pngs) in zip(dirty, extracted):
+                    r, a, b, rd = variants[i]
+                    outputs = write_pair(pair, (a, b), prefix, idx, FORMATS[fmt])
+                    if pngs is not None and rd is not None:
+                        outputs += write_pair(pngs, rd, prefix, idx, '.png')
+                    res_entries[res_key(r)] = {'config': config_versions[i], 'outputs': outputs}
+            files[in_path] = {
+                'hash': content_hash,
+                'code': code_version,
+                'idx': idx,
+                'res': res_entries,
+            }
+            if (n + 1) % checkpoint_every == 0:
+                save_manifest(manifest_path, manifest)
+
+    save_manifest(manifest_path, manifest)
+    return manifest
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='number of processes to extract files with')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='ignore the manifest and rebuild everything')
+    parser.add_argument(
+        '--render',
+        action='store_true',
+        help='also render A/B images (instead of running the Processing sketch)')
+    parser.add_argument(
+        '--format',
+        choices=sorted(FORMATS.keys()),
+        default='txt',
+        help='output file format (bin: compact binary, see chunkfmt.py)')
+    parser.add_argument(
+        '--trace',
+        type=str,
+        default=None,
+        help="trace stages to this path ('{pid}' is filled in per process; aggregate with tracing.py)")
+    parser.add_argument(
+        '--simplify',
+        type=float,
+        default=None,
+        metavar='PX',
+        help='simplify ways (Douglas-Peucker) with this tolerance in pixels (see simplify.py)')
+    parser.add_argument(
+        '--res',
+        type=int,
+        nargs='+',
+        default=[500],
+        help='output resolution in pixels (per side). give several to make each (in subdirectories)')
+    args = parser.parse_args()
+
     # settings
     input_range_inclusive = 2966
-    out_idx = 0
-
-    for trial_idx in tqdm(range(input_range_inclusive + 1)):
-        # try processing it
-        success = process_file(
-            'data/chunks/osm/seattle-{}.osm'.format(trial_idx),
-            'data/chunks/A/',
-            'data/chunks/B/',
-            (500, 500),
-            'seattle',
-            out_idx)
-
-        # increase idx if it worked (i.e., > 0 buildings)
-        if success:
-            out_idx += 1
+    in_paths = ['data/chunks/osm/seattle-{}.osm'.format(trial_idx) for trial_idx in range(input_range_inclusive + 1)]
+    a_dir = 'data/chunks/A/'
+    b_dir = 'data/chunks/B/'
+    res = [(r, r) for r in args.res]  # type: Union[Tuple[int, int], List[Tuple[int, int]]]
+    if len(res) == 1:
+        res = res[0]
+    prefix = 'seattle'
+    manifest_path = 'data/chunks/manifest.json'
+    render_dirs = ('data/chunks/A-png/', 'data/chunks/B-png/') if args.render else None
+
+    build(
+        in_paths, a_dir, b_dir, res, prefix, manifest_path, args.workers,
+        args.force, render_dirs=render_dirs, fmt=args.format,
+        trace_path=args.trace, simplify_tol=args.simplify)
 
 
 if __name__ == '__main__':
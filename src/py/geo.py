@@ -1,8 +1,11 @@
 # imports
 # ---
 
-import math
-from typing import List, Tuple
+# builtins
+from typing import Iterator, List, Sequence, Tuple
+
+# 3rd party
+import numpy as np
 
 
 # types
@@ -15,19 +18,120 @@ Line = Tuple[Point, Point]
 Polyline = List[Point]
 
 
+class Ragged(object):
+    """Many polygons / polylines stored flat: all their points in one (N, 2)
+    array `coords`, and `offsets` (n + 1,) marking where each starts, so item
+    i is coords[offsets[i]:offsets[i + 1]]. Indexing returns views (no
+    copies), and whole-collection math is a single NumPy operation.
+    """
+
+    def __init__(self, coords: np.ndarray, offsets: np.ndarray) -> None:
+        self.coords = coords
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_lists(cls, polys: Sequence[Sequence[Tuple[float, float]]], dtype=np.float64) -> 'Ragged':
+        offsets = np.zeros(len(polys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(poly) for poly in polys])
+        coords = np.array([pt for poly in polys for pt in poly], dtype=dtype).reshape(-1, 2)
+        return cls(coords, offsets)
+
+    @classmethod
+    def from_arrays(cls, polys: Sequence[np.ndarray]) -> 'Ragged':
+        offsets = np.zeros(len(polys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(poly) for poly in polys])
+        coords = np.concatenate([np.zeros((0, 2))] + [np.asarray(poly).reshape(-1, 2) for poly in polys])
+        return cls(coords, offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def with_coords(self, coords: np.ndarray) -> 'Ragged':
+        """Same structure, new points (e.g., after a transform)."""
+        return Ragged(coords, self.offsets)
+
+    def tolist(self) -> List[List[tuple]]:
+        """As the list-of-tuples format everything else uses."""
+        pts = [tuple(pt) for pt in self.coords.tolist()]
+        bounds = self.offsets.tolist()
+        return [pts[bounds[i]:bounds[i + 1]] for i in range(len(self))]
+
+
 # code
 # ---
 
+def geo_range(coords: np.ndarray) -> Tuple[float, float, float, float]:
+    """Returns (minlat, minlon, maxlat, maxlon) of (N, 2) (lat, lon) coords,
+    or the empty range (90, 180, -90, -180) if there are none."""
+    if len(coords) == 0:
+        return (90.0, 180.0, -90.0, -180.0)
+    mins, maxes = coords.min(axis=0), coords.max(axis=0)
+    return (
+        min(float(mins[0]), 90.0), min(float(mins[1]), 180.0),
+        max(float(maxes[0]), -90.0), max(float(maxes[1]), -180.0))
+
+
+def to_pixels(
+        geo_bounds: Tuple[float, float, float, float],
+        pixel_bounds: Tuple[int, int],
+        coords: np.ndarray,
+        flip_y: bool = True) -> np.ndarray:
+    """Converts (N, 2) (lat, lon) coords to (N, 2) (x, y) pixel coords in one
+    go. (Arithmetic is done in the same order as it always was, so results
+    match the old per-point loop exactly.)"""
+    minlat, minlon, maxlat, maxlon = geo_bounds
+    lonrange = maxlon - minlon
+    latrange = maxlat - minlat
+    width, height = pixel_bounds
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) > 0 and (lonrange == 0 or latrange == 0):
+        raise ZeroDivisionError('Empty geo bounds {}'.format(geo_bounds))
+
+    res = np.empty_like(coords)
+    res[:, 0] = ((coords[:, 1] - minlon) / lonrange) * width
+    # we may flip_y because SVG coordinate system has 0,0 at top left.
+    if flip_y:
+        res[:, 1] = ((maxlat - coords[:, 0]) / latrange) * height
+    else:
+        # note: this option may be broken; abs might have failed to fix.
+        res[:, 1] = ((coords[:, 0] - maxlat) / latrange) * height
+    return res
+
+
+def to_pixels_discrete(
+        geo_bounds: Tuple[float, float, float, float],
+        pixel_bounds: Tuple[int, int],
+        coords: np.ndarray,
+        flip_y: bool = True) -> np.ndarray:
+    """to_pixels(), floored to (N, 2) int64."""
+    return np.floor(to_pixels(geo_bounds, pixel_bounds, coords, flip_y)).astype(np.int64)
+
+
+def convert_ragged(
+        geo_bounds: Tuple[float, float, float, float],
+        pixel_bounds: Tuple[int, int],
+        geo_polys: Ragged,
+        discrete: bool = False,
+        flip_y: bool = True) -> Ragged:
+    """Converts all of `geo_polys` to pixel space at once (floored to ints
+    if `discrete`)."""
+    fn = to_pixels_discrete if discrete else to_pixels
+    return geo_polys.with_coords(fn(geo_bounds, pixel_bounds, geo_polys.coords, flip_y))
+
+
+# list-of-tuples adapters
+# ---
+
 def get_geo_range(geo_polys: List[Polygon]) -> Tuple[float, float, float, float]:
     """Returns (minlat, minlon, maxlat, maxlon)"""
-    minlat, minlon, maxlat, maxlon = 90.0, 180.0, -90.0, -180.0
-    for geo_poly in geo_polys:
-        for lat, lon in geo_poly:
-            minlat = min(minlat, lat)
-            minlon = min(minlon, lon)
-            maxlat = max(maxlat, lat)
-            maxlon = max(maxlon, lon)
-    return (minlat, minlon, maxlat, maxlon)
+    return geo_range(Ragged.from_lists(geo_polys).coords)
 
 
 def convert_poly(geo_poly: Polygon, pixel_bounds: Tuple[int, int]) -> Polygon:
@@ -56,8 +160,8 @@ def convert_points_discrete(
         pixel_bounds: Tuple[int, int],
         geo_points: List[Point],
         flip_y: bool = True) -> List[DiscretePoint]:
-    pts = convert_points(geo_bounds, pixel_bounds, geo_points, flip_y)
-    return [(int(math.floor(p[0])), int(math.floor(p[1]))) for p in pts]
+    pts = to_pixels_discrete(geo_bounds, pixel_bounds, np.array(geo_points, dtype=np.float64), flip_y)
+    return [(x, y) for x, y in pts.tolist()]
 
 
 def convert_points(
@@ -65,22 +169,8 @@ def convert_points(
         pixel_bounds: Tuple[int, int],
         geo_points: List[Point],
         flip_y: bool = True) -> List[Point]:
-    minlat, minlon, maxlat, maxlon = geo_bounds
-    lonrange = maxlon - minlon
-    latrange = maxlat - minlat
-    width, height = pixel_bounds
-
-    res = []
-    for lat, lon in geo_points:
-        x = ((lon - minlon) / lonrange) * width
-        # we may flip_y because SVG coordinate system has 0,0 at top left.
-        if flip_y:
-            y = ((maxlat - lat) / latrange) * height
-        else:
-            # note: this option may be broken; abs might have failed to fix.
-            y = ((lat - maxlat) / latrange) * height
-        res.append((x, y))
-    return res
+    pts = to_pixels(geo_bounds, pixel_bounds, np.array(geo_points, dtype=np.float64), flip_y)
+    return [(x, y) for x, y in pts.tolist()]
 
 
 def convert_polys(
@@ -97,4 +187,4 @@ def convert_polys(
     Returns:
         pixel_polys: list of polygons (point lists) in x, y pixel format
     """
-    return [convert_points(geo_bounds, pixel_bounds, poly) for poly in geo_polys]
+    return convert_ragged(geo_bounds, pixel_bounds, Ragged.from_lists(geo_polys)).tolist()
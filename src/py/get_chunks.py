@@ -13,64 +13,136 @@ Greater Seattle:
 
 # builtins
 import argparse
-import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http.server
+import json
 import os
+import random
 import sys
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
 
 # 3rd party
 import requests
+from requests.adapters import HTTPAdapter
+
+
+# settings
+# ---
+
+# url_format = 'http://overpass-api.de/api/map?bbox=-122.3446,47.5970,-122.3150,47.6172'
+URL_FORMAT = 'http://overpass-api.de/api/map?bbox={:.5f},{:.5f},{:.5f},{:.5f}'
+
+# (idx, left, right, bottom, top)
+Window = Tuple[int, float, float, float, float]
 
 
 # main
 # ---
 
-def scrape(fn: str, left: float, right: float, bottom: float, top: float) -> None:
-    # settings
-    max_retries = 5
-    # url_format = 'http://overpass-api.de/api/map?bbox=-122.3446,47.5970,-122.3150,47.6172'
-    url_format = 'http://overpass-api.de/api/map?bbox={:.5f},{:.5f},{:.5f},{:.5f}'
+def make_session() -> requests.Session:
+    """A session for one worker thread, keeping its connection alive between
+    downloads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ThreadSessions(object):
+    """Hands each thread its own session (made on first use), since requests
+    doesn't promise a Session is safe to share between threads. close()
+    closes all of them."""
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.sessions = []  # type: List[requests.Session]
+
+    def get(self) -> requests.Session:
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = make_session()
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def close(self) -> None:
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+
+
+def write_atomic(fn: str, content: bytes) -> None:
+    """Writes to a temp file next to `fn` and renames it into place, so `fn`
+    is either complete or absent."""
+    fd, tmp_fn = tempfile.mkstemp(dir=os.path.dirname(fn) or '.', suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_fn, fn)
+    except BaseException:
+        os.remove(tmp_fn)
+        raise
 
+
+def scrape(
+        session: requests.Session, fn: str, left: float, right: float,
+        bottom: float, top: float, url_format: str = URL_FORMAT,
+        max_retries: int = 5, backoff: float = 1.0,
+        max_backoff: float = 60.0) -> bool:
+    """Downloads one bbox to `fn`. Retries with exponential backoff (plus
+    full jitter) on errors. Returns whether it succeeded."""
+    url = url_format.format(left, bottom, right, top)
     for attempt in range(max_retries):
-        r = requests.get(url_format.format(left, bottom, right, top))
+        if attempt > 0:
+            time.sleep(random.uniform(0, min(max_backoff, backoff * 2**(attempt - 1))))
+        try:
+            r = session.get(url, timeout=180)
+        except requests.RequestException as e:
+            print('WARNING: "{}" failed ({}); retrying...'.format(url, e))
+            continue
         if r.status_code != 200:
             # retry
             continue
 
         # success
         print('INFO: Writing to "{}"...'.format(fn))
-        with open(fn, 'wb') as f:
-            f.write(r.content)
-        return
+        write_atomic(fn, r.content)
+        return True
 
     # at this point, the service is down, connections are bad, our our IP was
-    # banned (or something). if this happens, will building in a "start index"
-    # into the system to skip the ones already downloaded (and maybe --force to
-    # ignore existence of files)
-    print('ERROR: failed after {} retries; aborting...'.format(max_retries))
-    sys.exit(1)
+    # banned (or something). the manifest lets a rerun pick up from here.
+    print('ERROR: "{}" failed after {} retries'.format(url, max_retries))
+    return False
 
 
-def scrape_range(
-        min_lon: float, min_lat: float, max_lon: float, max_lat: float,
-        lon_window: float, lat_window: float, out_dir: str,
-        prefix: str) -> None:
+def scrape_job(sessions: ThreadSessions, *args, **kwargs) -> bool:
+    """scrape() with the calling thread's session (for the worker pool)."""
+    return scrape(sessions.get(), *args, **kwargs)
 
-    # user friendly: estimate nubmer of requests.
-    approx = int((max_lat - min_lat) / lat_window) * int((max_lon - min_lon) / lon_window)
-    print('INFO: Will download approximately {} map chunks.'.format(approx))
 
+def chunk_windows(
+        min_lon: float, min_lat: float, max_lon: float, max_lat: float,
+        lon_window: float, lat_window: float) -> List[Window]:
+    """Lists the capture windows, numbered in download order."""
     # left / right / bottom / top represent the current window
     left = min_lon
     right = left + lon_window
     bottom = min_lat
     top = bottom + lat_window
 
-
     # iterate by lon, then lat
+    windows = []  # type: List[Window]
     idx = 0
     while top < max_lat:
-        fn = os.path.join(out_dir, '{}-{}.osm'.format(prefix, idx))
-        scrape(fn, left, right, bottom, top)
+        windows.append((idx, left, right, bottom, top))
 
         # update window. slide to right if possible.
         left = right
@@ -84,6 +156,137 @@ def scrape_range(
             top = bottom + lat_window
 
         idx += 1
+    return windows
+
+
+def get_manifest_path(out_dir: str, prefix: str) -> str:
+    return os.path.join(out_dir, '{}-manifest.json'.format(prefix))
+
+
+def load_manifest(path: str, params: Dict[str, float]) -> Set[int]:
+    """Returns the indices already downloaded for this exact range/window
+    setup (empty if there's no manifest yet)."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest['params'] != params:
+        raise ValueError(
+            'Manifest "{}" was written for different ranges/windows ({}); '
+            'use --force to start over'.format(path, manifest['params']))
+    return set(manifest['done'])
+
+
+def save_manifest(path: str, params: Dict[str, float], done: Set[int]) -> None:
+    write_atomic(path, json.dumps({
+        'params': params,
+        'done': sorted(done),
+    }).encode('utf-8'))
+
+
+def scrape_range(
+        min_lon: float, min_lat: float, max_lon: float, max_lat: float,
+        lon_window: float, lat_window: float, out_dir: str,
+        prefix: str, workers: int = 2, url_format: str = URL_FORMAT,
+        force: bool = False, **scrape_kwargs) -> List[int]:
+    """Downloads all windows in the range with a bounded pool of workers.
+
+    Finished windows are recorded in a manifest in `out_dir`, so a rerun
+    only fetches what's missing (unless `force`). Returns the indices that
+    failed.
+    """
+    windows = chunk_windows(min_lon, min_lat, max_lon, max_lat, lon_window, lat_window)
+    params = {
+        'min_lon': min_lon, 'min_lat': min_lat, 'max_lon': max_lon,
+        'max_lat': max_lat, 'lon_window': lon_window, 'lat_window': lat_window,
+    }
+    manifest_path = get_manifest_path(out_dir, prefix)
+    done = set() if force else load_manifest(manifest_path, params)
+    todo = [
+        w for w in windows
+        if w[0] not in done or not os.path.exists(os.path.join(out_dir, '{}-{}.osm'.format(prefix, w[0])))
+    ]
+    print('INFO: Will download {} map chunks ({} already done).'.format(
+        len(todo), len(windows) - len(todo)))
+
+    failed = []  # type: List[int]
+    sessions = ThreadSessions()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for idx, left, right, bottom, top in todo:
+            fn = os.path.join(out_dir, '{}-{}.osm'.format(prefix, idx))
+            futures[executor.submit(
+                scrape_job, sessions, fn, left, right, bottom, top, url_format,
+                **scrape_kwargs)] = idx
+        for future in as_completed(futures):
+            idx = futures[future]
+            if future.result():
+                done.add(idx)
+                save_manifest(manifest_path, params, done)
+            else:
+                failed.append(idx)
+    sessions.close()
+
+    return sorted(failed)
+
+
+def test_local_server() -> None:
+    """Runs scrape_range() against a flaky local stand-in server, twice (the
+    second run should have nothing left to do).
+
+    The server's failures follow a fixed schedule: each URL gets a 503 on
+    its first (crc32 of the URL % 3) requests, whatever order the workers
+    ask in.
+    """
+    attempts = {}  # type: Dict[str, int]
+    lock = threading.Lock()
+
+    class FlakyHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            with lock:
+                attempts[self.path] = attempts.get(self.path, 0) + 1
+                n = attempts[self.path]
+            if n <= zlib.crc32(self.path.encode('utf-8')) % 3:
+                self.send_response(503)
+                self.end_headers()
+                return
+            body = '<osm>{}</osm>'.format(self.path).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url_format = 'http://127.0.0.1:{}/api/map?bbox={{:.5f}},{{:.5f}},{{:.5f}},{{:.5f}}'.format(
+        server.server_address[1])
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        args = (-122.40, 47.60, -122.35, 47.63, 0.00731, 0.00492, out_dir, 'test')
+        n_windows = len(chunk_windows(*args[:6]))
+        failed = scrape_range(*args, workers=4, url_format=url_format, max_retries=10, backoff=0.01)
+        assert failed == [], failed
+        for idx in range(n_windows):
+            assert os.path.exists(os.path.join(out_dir, 'test-{}.osm'.format(idx)))
+        assert load_manifest(get_manifest_path(out_dir, 'test'), {
+            'min_lon': args[0], 'min_lat': args[1], 'max_lon': args[2],
+            'max_lat': args[3], 'lon_window': args[4], 'lat_window': args[5],
+        }) == set(range(n_windows))
+        assert not any(fn.endswith('.part') for fn in os.listdir(out_dir))
+        # (the schedule has to have made some requests retry)
+        assert sum(attempts.values()) > n_windows
+
+        # rerun: everything is in the manifest already
+        os.remove(os.path.join(out_dir, 'test-0.osm'))
+        failed = scrape_range(*args, workers=4, url_format=url_format, max_retries=10, backoff=0.01)
+        assert failed == [] and os.path.exists(os.path.join(out_dir, 'test-0.osm'))
+
+    server.shutdown()
+    server.server_close()
+    print('OK: {} windows downloaded from local server'.format(n_windows))
 
 
 def main():
@@ -122,17 +325,26 @@ def main():
         type=float,
         default=0.00492,
         help='latitude delta per capture window')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=2,
+        help='number of concurrent downloads')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='ignore the manifest and download everything again')
     args = parser.parse_args()
 
-    # safety check
-    pattern = os.path.join(args.out_dir, args.prefix) + '*'
-    if len(glob.glob(pattern)) > 0:
-        print('ERROR: Files matching "{}" already exist. Exiting.'.format(pattern))
-
-    # scrape
-    scrape_range(
+    # scrape (already-downloaded chunks are skipped via the manifest)
+    failed = scrape_range(
         args.min_lon, args.min_lat, args.max_lon, args.max_lat,
-        args.lon_window, args.lat_window, args.out_dir, args.prefix)
+        args.lon_window, args.lat_window, args.out_dir, args.prefix,
+        args.workers, force=args.force)
+    if len(failed) > 0:
+        print('ERROR: {} chunks failed ({}); rerun to retry them.'.format(
+            len(failed), ', '.join(str(idx) for idx in failed)))
+        sys.exit(1)
 
 
 if __name__ == '__main__':
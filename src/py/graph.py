@@ -3,66 +3,221 @@
 
 # builtins
 import code
-from math import sqrt
+from math import floor, sqrt
+import multiprocessing
 import os
 from collections import deque
-import math
-import pickle
-from typing import Dict, Set, Tuple, List, FrozenSet
-import xml.etree.ElementTree as ET
+from typing import Dict, Set, Tuple, List, FrozenSet, Iterator, Optional, Union
 
 # 3rd party
+import numpy as np
 from tqdm import tqdm
 
 # local
 import osm
 import geo
-from geo import Point, Line, Polygon
+from geo import Point, Polygon
 import polygon
 from polygon import DiscretePoly
+import spatial
 import svg
+import tracing
 
 
 # code
 # ---
 
-def backtrack_ref(node_combine: Dict[int, int], query: int) -> int:
-    """Traverses a mapping an arbitrary number of steps to lookup the base
-    ref.
+def merge_points(points: List[Point], thresh: float) -> List[int]:
+    """Merges points within `thresh` of each other. Returns, for each point,
+    the index of the point it merges into (its representative).
+
+    This gives exactly what the original O(n^2) loop did (see
+    _merge_points_pairwise()): for each pair (i, j), i < j, in order, if the
+    representatives of i and j are within `thresh`, j's representative is
+    merged into i's. Distances are between representatives, not the pair
+    itself, so a chain of points each close to the next doesn't necessarily
+    collapse.
+
+    i's representative r can't change while the pairs (i, *) are visited, so
+    those pairs merge exactly the other representatives within `thresh` of
+    r that have some member after i. Representatives are kept in a grid of
+    `thresh`-sized cells, so each i only looks at r's neighborhood.
+    """
+    parent = list(range(len(points)))
+    # largest member index of each representative's set
+    last = list(range(len(points)))
+    grid = {}  # type: Dict[Tuple[int, int], List[int]]
+    cells = []  # type: List[Tuple[int, int]]
+    for i, (a, b) in enumerate(points):
+        cell = (int(floor(a / thresh)), int(floor(b / thresh)))
+        cells.append(cell)
+        grid.setdefault(cell, []).append(i)
+
+    def find(i: int) -> int:
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for i in range(len(points)):
+        r = find(i)
+        ra, rb = points[r]
+        ca, cb = cells[r]
+        for da in (-1, 0, 1):
+            for db in (-1, 0, 1):
+                members = grid.get((ca + da, cb + db))
+                if members is None:
+                    continue
+                kept = []  # type: List[int]
+                for s in members:
+                    if s != r and last[s] > i:
+                        sa, sb = points[s]
+                        if sqrt((ra - sa)**2 + (rb - sb)**2) < thresh:
+                            parent[s] = r
+                            last[r] = max(last[r], last[s])
+                            continue
+                    kept.append(s)
+                grid[(ca + da, cb + db)] = kept
+    return [find(i) for i in range(len(points))]
+
+
+def _merge_points_pairwise(points: List[Point], thresh: float) -> List[int]:
+    """The original O(n^2) merge, kept as the reference for merge_points()."""
+    node_combine = {}  # type: Dict[int, int]
+
+    def backtrack(i: int) -> int:
+        while i in node_combine:
+            i = node_combine[i]
+        return i
+
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            id_i, id_j = backtrack(i), backtrack(j)
+            if id_i != id_j and geo_dist(points[id_i], points[id_j]) < thresh:
+                node_combine[id_j] = id_i
+    return [backtrack(i) for i in range(len(points))]
 
-    Example. Say node_combine maps:
-        x -> y
-        y -> z
-        z -> w
 
-    Then the following should happen:
-        w == backtrack_ref(x)
-        w == backtrack_ref(y)
-        w == backtrack_ref(z)
-        w == backtrack_ref(w)
+class CSRGraph(object):
+    """Undirected road graph in compressed sparse row form.
+
+    Nodes are numbered densely 0..n-1; `ids[i]` is node i's OSM id (sorted
+    ascending). Node i's neighbors are `neighbors[offsets[i]:offsets[i+1]]`
+    (dense indices, sorted). That's a few bytes per edge, saves as three
+    flat arrays, and lets whole-graph work happen in NumPy.
+
+    For code written against the old Dict[int, Set[int]] graphs, it also
+    reads like a mapping from OSM id to neighbor OSM ids.
     """
-    while query in node_combine:
-        query = node_combine[query]
-    return query
 
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, neighbors: np.ndarray) -> None:
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.neighbors = np.asarray(neighbors, dtype=np.int64)
+
+    @classmethod
+    def from_edges(cls, ids: np.ndarray, src: np.ndarray, dst: np.ndarray) -> 'CSRGraph':
+        """Builds from undirected edges between dense indices into `ids`
+        (which must be sorted). Duplicate edges are dropped."""
+        n = len(ids)
+        src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+        keys = np.unique(np.concatenate([src * n + dst, dst * n + src]))
+        rows, cols = keys // max(n, 1), keys % max(n, 1)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(rows, minlength=n))
+        return cls(ids, offsets, cols)
+
+    @classmethod
+    def from_dict(cls, graph: Dict[int, Set[int]]) -> 'CSRGraph':
+        ids = np.array(sorted(set(graph.keys()).union(*graph.values())), dtype=np.int64)
+        src = [n for n, nbrs in graph.items() for _ in nbrs]
+        dst = [m for nbrs in graph.values() for m in nbrs]
+        return cls.from_edges(
+            ids, np.searchsorted(ids, np.array(src, dtype=np.int64)),
+            np.searchsorted(ids, np.array(dst, dtype=np.int64)))
+
+    def to_dict(self) -> Dict[int, Set[int]]:
+        return {n: set(nbrs) for n, nbrs in self.items()}
+
+    def save(self, fn: str) -> None:
+        np.savez(fn, ids=self.ids, offsets=self.offsets, neighbors=self.neighbors)
+
+    @classmethod
+    def load(cls, fn: str) -> 'CSRGraph':
+        with np.load(fn) as data:
+            return cls(data['ids'], data['offsets'], data['neighbors'])
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def edge_sources(self) -> np.ndarray:
+        """Dense source index of each entry in `neighbors`."""
+        return np.repeat(np.arange(len(self.ids), dtype=np.int64), self.degrees())
+
+    def index(self, node_id: int) -> int:
+        idx = int(np.searchsorted(self.ids, node_id))
+        if idx >= len(self.ids) or self.ids[idx] != node_id:
+            raise KeyError(node_id)
+        return idx
+
+    # mapping interface (OSM ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids.tolist())
 
-def geo_dist(nodeA: ET.Element, nodeB: ET.Element):
+    def keys(self) -> Iterator[int]:
+        return iter(self)
+
+    def __contains__(self, node_id: int) -> bool:
+        idx = int(np.searchsorted(self.ids, node_id))
+        return idx < len(self.ids) and self.ids[idx] == node_id
+
+    def __getitem__(self, node_id: int) -> List[int]:
+        idx = self.index(node_id)
+        return self.ids[self.neighbors[self.offsets[idx]:self.offsets[idx + 1]]].tolist()
+
+    def items(self) -> Iterator[Tuple[int, List[int]]]:
+        ids = self.ids.tolist()
+        offsets = self.offsets.tolist()
+        neighbor_ids = self.ids[self.neighbors].tolist()
+        for i, node_id in enumerate(ids):
+            yield node_id, neighbor_ids[offsets[i]:offsets[i + 1]]
+
+
+# either representation of the road graph
+Graph = Union[Dict[int, Set[int]], CSRGraph]
+
+
+def as_csr(graph: Graph) -> CSRGraph:
+    return graph if isinstance(graph, CSRGraph) else CSRGraph.from_dict(graph)
+
+
+def geo_dist(pointA: Point, pointB: Point):
     """Computes a geo distance function.
 
     Currently, does l2 in lat, lon space.
     """
-    latA, lonA = float(nodeA.attrib['lat']), float(nodeA.attrib['lon'])
-    latB, lonB = float(nodeB.attrib['lat']), float(nodeB.attrib['lon'])
+    latA, lonA = pointA
+    latB, lonB = pointB
     l2_dist = sqrt((latA - latB)**2 + (lonA - lonB)**2)
     return l2_dist
 
 
+@tracing.traced('graph.build')
 def build(
-        node_map: Dict[int, ET.Element], ways: List[ET.Element],
-        thresh: float = 1e-4) -> Dict[int, Set[int]]:
+        node_map: osm.NodeStore, ways: List[osm.Way],
+        thresh: float = 1e-4) -> CSRGraph:
     """Builds a road network graph by combinging nodes at intersections and
     then using road paths as edges.
 
+    The graph comes out in CSR form (see CSRGraph), built straight from the
+    consecutive node pairs of the highway ways.
+
     TODO: eventually much of this belongs in OSM
 
     Args:
@@ -77,64 +232,39 @@ def build(
     road_ways = []
     for way in ways:
         # only consider roads
-        features = osm.get_way_features(way)
-        if 'highway' not in features:
+        if 'highway' not in way.tags:
             continue
 
         road_ways.append(way)
-        nds = [child for child in way if child.tag == 'nd']
-        road_nds.update([int(nd.attrib['ref']) for nd in nds])
+        road_nds.update(way.refs.tolist())
 
     print('Original: {} road nds'.format(len(road_nds)))
 
-    # then, make a mapping to combine refs when they're within thresh (O(n^2))
-    node_combine = {}  # type: Dict[int, int]
+    # then, merge refs that are within thresh of each other (see
+    # merge_points(); a spatial grid makes this ~linear rather than O(n^2)).
     road_nd_lst = list(road_nds)
-    for i in range(len(road_nd_lst)):
-        for j in range(i+1, len(road_nd_lst)):
-            raw_id_i = road_nd_lst[i]
-            raw_id_j = road_nd_lst[j]
-
-            # backtrack refs to get "true" nodes.
-            id_i = backtrack_ref(node_combine, raw_id_i)
-            id_j = backtrack_ref(node_combine, raw_id_j)
-
-            # if they've already been merged, do nothing
-            if id_i == id_j:
-                continue
-
-            # compute dist
-            node_i = node_map[id_i]
-            node_j = node_map[id_j]
-            dist = geo_dist(node_i, node_j)
-
-            # code.interact(local=dict(globals(), **locals()))
-
-            # how we update ids here determines whether we're following
-            # transitive chains of distances below thresh. we do right now. if
-            # not, would we need to do multiple passes?
-            if dist < thresh:
-                node_combine[id_j] = id_i
+    road_nd_idx = {ref: i for i, ref in enumerate(road_nd_lst)}
+    merged_idx = merge_points(node_map.points(road_nd_lst), thresh)
 
-    combined_nd_lst = set([backtrack_ref(node_combine, ref) for ref in road_nd_lst])
+    def merged_ref(ref: int) -> int:
+        return road_nd_lst[merged_idx[road_nd_idx[ref]]]
+
+    combined_nd_lst = set([merged_ref(ref) for ref in road_nd_lst])
     print('After merging: {} road nds'.format(len(combined_nd_lst)))
+    tracing.count('road_ways', len(road_ways))
+    tracing.count('road_nodes', len(road_nds))
+    tracing.count('nodes_merged', len(road_nds) - len(combined_nd_lst))
 
-    # construct graph
-    graph = {}  # type: Dict[int, Set[int]]
+    # construct graph: each consecutive pair of (merged) nodes along a road
+    # is an edge
+    src_refs, dst_refs = [], []  # type: List[int], List[int]
     for way in road_ways:
-        nds = [child for child in way if child.tag == 'nd']
-        for i in range(len(nds) - 1):
-            id_i = backtrack_ref(node_combine, int(nds[i].attrib['ref']))
-            id_j = backtrack_ref(node_combine, int(nds[i+1].attrib['ref']))
-
-            if id_i not in graph:
-                graph[id_i] = set()
-            if id_j not in graph:
-                graph[id_j] = set()
-            graph[id_i].add(id_j)
-            graph[id_j].add(id_i)
+        refs = [merged_ref(ref) for ref in way.refs.tolist()]
+        src_refs.extend(refs[:-1])
+        dst_refs.extend(refs[1:])
 
-    return graph
+    ids, dense = np.unique(np.array(src_refs + dst_refs, dtype=np.int64), return_inverse=True)
+    return CSRGraph.from_edges(ids, dense[:len(src_refs)], dense[len(src_refs):])
 
 
 def find_blocks_dummy(graph: Dict[int, Set[int]]) -> List[List[int]]:
@@ -186,10 +316,12 @@ def find_rings_at(graph: Dict[int, Set[int]], start: int, maxdist = 7) -> List[L
     start_path = [start]  # type: List[int]
     shortest = {}  # type: Dict[int, List[List[int]]]
     q = deque([(start, start_path)])
+    expansions = 0
 
     # first, find sets of unique paths to surrounding nodes
     while len(q) > 0:
         cur, curpath = q.popleft()
+        expansions += 1
         # print()
         # print('Considering {} {}'.format(cur, strpath(curpath)))
         # print('Shortest: {}'.format(str(shortest)))
@@ -220,9 +352,119 @@ def find_rings_at(graph: Dict[int, Set[int]], start: int, maxdist = 7) -> List[L
             p2 = paths[1]
             rings.append(p1 + list(reversed(p2[1:-1])))
 
+    tracing.count('bfs_expansions', expansions)
     return rings
 
 
+def prune_dead_ends(graph: Graph) -> CSRGraph:
+    """Returns a copy of `graph` with dead ends (and self loops) repeatedly
+    removed, so every remaining node has at least two neighbors. Dead-end
+    roads can't bound a block; left in, they'd show up as spikes in the face
+    boundaries.
+    """
+    csr = as_csr(graph)
+    src = csr.edge_sources()
+    no_loops = src != csr.neighbors
+    degree = np.bincount(src[no_loops], minlength=len(csr)).tolist()
+
+    offsets = csr.offsets.tolist()
+    neighbors = csr.neighbors.tolist()
+    alive = [True] * len(csr)
+    q = deque(i for i in range(len(csr)) if degree[i] < 2)
+    while len(q) > 0:
+        i = q.popleft()
+        if not alive[i]:
+            continue
+        alive[i] = False
+        for j in neighbors[offsets[i]:offsets[i + 1]]:
+            if alive[j] and j != i:
+                degree[j] -= 1
+                if degree[j] < 2:
+                    q.append(j)
+
+    keep = np.array(alive, dtype=bool)
+    src, dst = src[no_loops], csr.neighbors[no_loops]
+    edge_mask = keep[src] & keep[dst]
+    remap = np.cumsum(keep) - 1
+    return CSRGraph.from_edges(csr.ids[keep], remap[src[edge_mask]], remap[dst[edge_mask]])
+
+
+def signed_area(poly: Polygon) -> float:
+    """Shoelace formula. Positive when `poly` winds counter-clockwise (for
+    (x, y) points with y pointing up)."""
+    area = 0.0
+    prev_x, prev_y = poly[-1]
+    for x, y in poly:
+        area += prev_x * y - x * prev_y
+        prev_x, prev_y = x, y
+    return area / 2.0
+
+
+@tracing.traced('graph.find_faces')
+def find_faces(graph: Graph, node_map: osm.NodeStore) -> List[List[int]]:
+    """Finds blocks as the faces of the road graph's planar embedding.
+
+    Each node's neighbors are sorted by angle; then every directed edge is
+    walked exactly once, always turning onto the next edge clockwise from the
+    one we came in on. That traces each face once. The outer face of each
+    connected piece of the graph winds the other way round (clockwise rather
+    than counter-clockwise on the map), so we drop faces by the sign of their
+    area.
+
+    Returns list of blocks, each a list of node IDs (not closed).
+    """
+    csr = prune_dead_ends(graph)
+    n = len(csr)
+    if n == 0:
+        return []
+    coords = node_map.gather(csr.ids)
+    lats, lons = coords[:, 0], coords[:, 1]
+
+    # directed edges (half-edges) are the CSR entries, sorted by (src, dst)
+    src, dst = csr.edge_sources(), csr.neighbors
+    reverse = np.searchsorted(src * n + dst, dst * n + src)
+
+    # each node's half-edges in counter-clockwise order (lon is x, lat is y),
+    # and each half-edge's position in that order. rows keep their CSR
+    # extents, since the sort is by src first.
+    angles = np.arctan2(lats[dst] - lats[src], lons[dst] - lons[src])
+    ccw = np.lexsort((angles, src))
+    ccw_pos = np.empty_like(ccw)
+    ccw_pos[ccw] = np.arange(len(ccw))
+
+    # arriving at v along (u, v), leave on the half-edge just clockwise of
+    # (v, u) around v
+    pos = ccw_pos[reverse]
+    row_start, row_end = csr.offsets[dst], csr.offsets[dst + 1]
+    following = ccw[np.where(pos == row_start, row_end - 1, pos - 1)].tolist()
+
+    # walk the cycles of `following`
+    src_l = src.tolist()
+    faces = []  # type: List[List[int]]
+    visited = bytearray(len(src_l))
+    for start in range(len(src_l)):
+        if visited[start]:
+            continue
+        face = []  # type: List[int]
+        h = start
+        while not visited[h]:
+            visited[h] = 1
+            face.append(src_l[h])
+            h = following[h]
+        faces.append(face)
+
+    # keep faces that wind counter-clockwise (shoelace over all faces at once)
+    flat = np.array([i for face in faces for i in face], dtype=np.int64)
+    starts = np.cumsum([0] + [len(face) for face in faces[:-1]])
+    prev = np.roll(np.arange(len(flat)), 1)
+    prev[starts] = starts + np.array([len(face) - 1 for face in faces])
+    x, y = lons[flat], lats[flat]
+    areas = np.add.reduceat(x[prev] * y - x * y[prev], starts)
+
+    ids = csr.ids
+    return [ids[face].tolist() for face, area in zip(faces, areas.tolist()) if area > 0]
+
+
 def polygon_contains(bigger: DiscretePoly, smaller: DiscretePoly) -> bool:
     """Tests whether bigger contains smaller.
 
@@ -232,53 +474,202 @@ def polygon_contains(bigger: DiscretePoly, smaller: DiscretePoly) -> bool:
     would confuse things. (For those regions, depending on the application,
     it's actually not clear what the desired result should be.)
     """
-    for point in smaller:
-        # if point not in bigger and not polygon.point_in_polygon(bigger, point):
-        if not polygon.point_in_polygon(bigger, point):
-            # print('{}  not in bigger'.format(str(point)))
-            return False
-    return True
+    return bool(np.all(polygon.points_in_polygon(bigger, smaller)))
 
 
+@tracing.traced('graph.filter_encompassing')
 def filter_encompassing_blocks(
         blocks: List[List[int]],
         pixel_blocks: List[DiscretePoly]) -> Set[int]:
+    """Returns indices of blocks that contain some other block.
 
-    # check each pair and remove as needed
+    A polygon can only contain another if its bounding box does, so the exact
+    test only runs on pairs with nested boxes.
+    """
+    index = spatial.BBoxIndex.from_polys(pixel_blocks)
+
+    # check each candidate pair and remove as needed
     toremove = set()
-    for i in tqdm(range(len(blocks))):
+    pairs = index.nested_pairs()
+    tracing.count('containment_tests', 2 * len(pairs))
+    for i, j in tqdm(pairs):
         bi = pixel_blocks[i]
-        for j in range(i+1, len(blocks)):
-            bj = pixel_blocks[j]
-            if polygon_contains(bi, bj):
-                toremove.add(i)
-            if polygon_contains(bj, bi):
-                toremove.add(j)
+        bj = pixel_blocks[j]
+        if polygon_contains(bi, bj):
+            toremove.add(i)
+        if polygon_contains(bj, bi):
+            toremove.add(j)
 
     return toremove
 
 
+# parallel ring search
+# ---
+#
+# find_rings_at() never looks further than `maxdist` hops from where it
+# starts, so the start nodes can be split into partitions and searched in
+# separate processes, each given only the graph around its partition: the
+# partition plus a halo of every node within reach. Partitions are runs of
+# nodes in BFS order, so each is a connected piece of the graph (small
+# components end up whole in one partition).
+
+# partitions per worker process (more than one, so that uneven partitions
+# balance out)
+PARTITIONS_PER_WORKER = 8
+
+# the whole graph, in each worker process (see _init_rings_worker())
+_rings_graph = None  # type: Optional[CSRGraph]
+
+
+def bfs_order(csr: CSRGraph) -> List[int]:
+    """Returns csr's dense node indices in breadth-first order, one connected
+    component after another."""
+    offsets, neighbors = csr.offsets.tolist(), csr.neighbors.tolist()
+    seen = bytearray(len(csr))
+    order = []  # type: List[int]
+    for root in range(len(csr)):
+        if seen[root]:
+            continue
+        seen[root] = 1
+        q = deque([root])
+        while len(q) > 0:
+            i = q.popleft()
+            order.append(i)
+            for j in neighbors[offsets[i]:offsets[i + 1]]:
+                if not seen[j]:
+                    seen[j] = 1
+                    q.append(j)
+    return order
+
+
+def partition_nodes(csr: CSRGraph, n_parts: int) -> List[np.ndarray]:
+    """Splits csr's dense node indices into (up to) `n_parts` connected runs
+    (each sorted)."""
+    order = np.array(bfs_order(csr), dtype=np.int64)
+    return [np.sort(part) for part in np.array_split(order, n_parts) if len(part) > 0]
+
+
+def within_hops(csr: CSRGraph, starts: np.ndarray, hops: int) -> np.ndarray:
+    """Returns the dense indices (sorted) of all nodes at most `hops` edges
+    from `starts`."""
+    reached = np.zeros(len(csr), dtype=bool)
+    reached[starts] = True
+    frontier = starts
+    for _ in range(hops):
+        if len(frontier) == 0:
+            break
+        # every neighbor entry of every frontier node
+        begins, degrees = csr.offsets[frontier], csr.degrees()[frontier]
+        entry = np.repeat(begins - np.cumsum(degrees) + degrees, degrees) + np.arange(degrees.sum())
+        nbrs = csr.neighbors[entry]
+        frontier = np.unique(nbrs[~reached[nbrs]])
+        reached[frontier] = True
+    return np.flatnonzero(reached)
+
+
+def _init_rings_worker(ids: np.ndarray, offsets: np.ndarray, neighbors: np.ndarray) -> None:
+    """Pool initializer: the graph is sent to each worker once, rather than
+    with every partition."""
+    global _rings_graph
+    _rings_graph = CSRGraph(ids, offsets, neighbors)
+
+
+def _rings_job(args: Tuple[np.ndarray, int]) -> List[Tuple[int, List[List[int]]]]:
+    """Pool entry point: runs find_rings_at() from every node of one
+    partition. Returns (dense start index, rings) for each."""
+    starts, maxdist = args
+    csr = _rings_graph
+    assert csr is not None
+    # find_rings_at() only looks up the neighbors of nodes on paths shorter
+    # than maxdist nodes, i.e., at most maxdist - 2 hops out. (this builds
+    # the sets just as CSRGraph.to_dict() does, so they iterate in the same
+    # order and the BFS finds the same rings.)
+    ids, offsets = csr.ids.tolist(), csr.offsets.tolist()
+    neighbor_ids = csr.ids[csr.neighbors].tolist()
+    local = {}  # type: Dict[int, Set[int]]
+    for i in within_hops(csr, starts, max(maxdist - 2, 0)).tolist():
+        local[ids[i]] = set(neighbor_ids[offsets[i]:offsets[i + 1]])
+    return [(i, find_rings_at(local, ids[i], maxdist)) for i in starts.tolist()]
+
+
+@tracing.traced('graph.find_rings')
+def find_rings(graph: Graph, workers: int = 1, maxdist: int = 7) -> List[List[int]]:
+    """Finds unique rings by running find_rings_at() from every node. Rings
+    found this way overlap, so callers need filter_encompassing_blocks().
+
+    With `workers` > 1, the searches are split across that many processes
+    (see partition_nodes()). Rings are merged in start node order, keeping
+    the first one found for each set of nodes, just as the serial loop does;
+    for a CSRGraph, the result is identical to workers=1. (The workers'
+    bfs_expansions aren't traced.)
+    """
+    if workers > 1:
+        return _find_rings_parallel(as_csr(graph), workers, maxdist)
+
+    # the BFS does lots of single-node lookups; sets are quicker for those
+    if isinstance(graph, CSRGraph):
+        graph = graph.to_dict()
+    blocks_map = {}  # type: Dict[FrozenSet[int], List[int]]
+    for n in tqdm(graph.keys()):
+        for ring in find_rings_at(graph, n, maxdist):
+            if frozenset(ring) not in blocks_map:
+                blocks_map[frozenset(ring)] = ring
+    return list(blocks_map.values())
+
+
+def _find_rings_parallel(csr: CSRGraph, workers: int, maxdist: int) -> List[List[int]]:
+    parts = partition_nodes(csr, workers * PARTITIONS_PER_WORKER)
+    tracing.count('ring_partitions', len(parts))
+    jobs = [(part, maxdist) for part in parts]
+    found = []  # type: List[Tuple[int, List[List[int]]]]
+    with multiprocessing.Pool(workers, _init_rings_worker, (csr.ids, csr.offsets, csr.neighbors)) as pool:
+        for res in tqdm(pool.imap_unordered(_rings_job, jobs), total=len(jobs)):
+            found.extend(res)
+
+    # partitions finish in any order; merging in start order makes the result
+    # deterministic (and the same as the serial loop's)
+    found.sort(key=lambda start_rings: start_rings[0])
+    blocks_map = {}  # type: Dict[FrozenSet[int], List[int]]
+    for _, rings in found:
+        for ring in rings:
+            if frozenset(ring) not in blocks_map:
+                blocks_map[frozenset(ring)] = ring
+    return list(blocks_map.values())
+
+
+@tracing.traced('graph.find_blocks')
 def find_blocks(
-        graph: Dict[int, Set[int]], node_map: Dict[int, ET.Element],
+        graph: Graph, node_map: osm.NodeStore,
         geo_bounds: Tuple[float,float,float,float],
-        pixel_bounds: Tuple[int, int]) -> Tuple[List[Polygon], List[List[int]], List[DiscretePoly]]:
+        pixel_bounds: Tuple[int, int],
+        method: str = 'faces',
+        workers: int = 1) -> Tuple[List[Polygon], List[List[int]], List[DiscretePoly]]:
     """
-    Returns 2-tuple of:
+    `method` is 'faces' (planar face traversal; see find_faces()) or 'rings'
+    (the older BFS ring search, followed by encompassing-block removal). The
+    ring search runs in `workers` processes (see find_rings()); the face
+    traversal is a single linear pass, so it ignores `workers`.
+
+    Returns 3-tuple of:
+        - list of blocks in geo format
         - list of blocks in ID format: each block is list of node IDs
         - list of blocks in polygon format in pixel_bounds space
     """
-    # find unique rings
-    blocks_map = {}  # type: Dict[FrozenSet[int], List[int]]
-    for n in tqdm(graph.keys()):
-        for ring in find_rings_at(graph, n):
-            if frozenset(ring) not in blocks_map:
-                blocks_map[frozenset(ring)] = ring
+    if method == 'faces':
+        blocks = find_faces(graph, node_map)
+    elif method == 'rings':
+        blocks = find_rings(graph, workers)
+    else:
+        raise ValueError('Unknown block finding method "{}"'.format(method))
 
     # rasterize blocks
-    blocks = list(blocks_map.values())
     geo_blocks, pixel_blocks = ways_to_pixel_coords(blocks, node_map, geo_bounds, pixel_bounds)
+    tracing.count('candidate_blocks', len(blocks))
 
-    # find encompassing blocks to remove
+    # faces partition the plane, so only rings need encompassing blocks
+    # removed
+    if method == 'faces':
+        return geo_blocks, blocks, pixel_blocks
     toremove = filter_encompassing_blocks(blocks, pixel_blocks)
 
     # print('Encompass filtering: before {}, after {} (removed {})'.format(
@@ -302,119 +693,91 @@ def find_blocks(
 
 
 def geo_ways_to_pixel_coords(
-        geo_ways: List[Polygon],
+        geo_ways: Union[List[Polygon], geo.Ragged],
         geo_bounds: Tuple[float,float,float,float],
         pixel_bounds: Tuple[int, int]) -> List[DiscretePoly]:
 
-    # convert to pixels
-    pixel_ways_float = geo.convert_polys(geo_bounds, pixel_bounds, geo_ways)
-
-    # floor everything to hopefully help out with float rounding errors
-    pixel_ways_int = []
-    for float_polygon in pixel_ways_float:
-        int_polygon = []
-        for point in float_polygon:
-            int_polygon.append((int(math.floor(point[0])), int(math.floor(point[1]))))
-        pixel_ways_int.append(int_polygon)
-
-    return pixel_ways_int
+    # convert to pixels, flooring everything to hopefully help out with float
+    # rounding errors
+    ragged = geo_ways if isinstance(geo_ways, geo.Ragged) else geo.Ragged.from_lists(geo_ways)
+    return geo.convert_ragged(geo_bounds, pixel_bounds, ragged, discrete=True).tolist()
 
 
 def ways_to_pixel_coords(
         ways: List[List[int]],
-        node_map: Dict[int, ET.Element],
+        node_map: osm.NodeStore,
         geo_bounds: Tuple[float,float,float,float],
         pixel_bounds: Tuple[int, int]) -> Tuple[List[Polygon], List[DiscretePoly]]:
-    # turn each way (node list) into geo poly
-    geo_ways = []
-    for way in ways:
-        geo_way = []
-        for node_id in way:
-            node = node_map[node_id]
-            geo_way.append((float(node.attrib['lat']), float(node.attrib['lon'])))
-        geo_ways.append(geo_way)
+    # turn each way (node list) into geo poly, all in one gather
+    geo_ways = osm.gather_ways(node_map, ways)
 
-    return geo_ways, geo_ways_to_pixel_coords(geo_ways, geo_bounds, pixel_bounds)
+    return geo_ways.tolist(), geo_ways_to_pixel_coords(geo_ways, geo_bounds, pixel_bounds)
 
 
 def display(
-        in_path: str, node_map: Dict[int, ET.Element],
+        in_path: str, node_map: osm.NodeStore,
         geo_bounds: Tuple[float,float,float,float],
         pixel_bounds: Tuple[int, int],
-        graph: Dict[int, Set[int]],
+        graph: Graph,
         blocks: List[List[int]],
         pixel_blocks: List[List[int]],
-        special_node_ref: int):
+        special_node_ref: int,
+        precision: Optional[int] = 1,
+        lod: bool = False):
     # file crap
     title = '.'.join(os.path.basename(in_path).split('.')[:-1])
     out_fn = title + '-graph.html'
     out_path = os.path.join(os.path.dirname(in_path), out_fn)
 
     # extract points and lines
-    geo_lines = []  # type: List[Line]
-    geo_points = []  # type: List[Point]
-    for node_id, neighbor_ids in graph.items():
-        node = node_map[node_id]
-        geo_points.append((float(node.attrib['lat']), float(node.attrib['lon'])))
-        for neighbor_id in neighbor_ids:
-            neighbor = node_map[neighbor_id]
-            geo_lines.append([
-                (float(node.attrib['lat']), float(node.attrib['lon'])),
-                (float(neighbor.attrib['lat']), float(neighbor.attrib['lon'])),
-            ])
+    csr = as_csr(graph)
+    geo_points = node_map.gather(csr.ids)
 
     # turn each block (node list) into geo poly
     # geo_blocks = []
     # for block in blocks:
     #     geo_block = []
     #     for node_id in block:
-    #         node = node_map[node_id]
-    #         geo_block.append((float(node.attrib['lat']), float(node.attrib['lon'])))
+    #         geo_block.append(node_map[node_id])
     #     geo_blocks.append(geo_block)
 
     # extract special point coords
-    special_node = node_map[special_node_ref]
-    geo_special_point = (float(special_node.attrib['lat']), float(special_node.attrib['lon']))
+    geo_special_point = node_map[special_node_ref]
 
     # convert
     # pixel_blocks = geo.convert_polys(geo_bounds, pixel_bounds, geo_blocks)
-    pixel_lines = geo.convert_polys(geo_bounds, pixel_bounds, geo_lines)
-    pixel_points = geo.convert_points(geo_bounds, pixel_bounds, geo_points)
+    pixel_points = geo.to_pixels(geo_bounds, pixel_bounds, geo_points)
+    pixel_lines = np.stack([pixel_points[csr.edge_sources()], pixel_points[csr.neighbors]], axis=1)
     pixel_special_point = geo.convert_points(geo_bounds, pixel_bounds, [geo_special_point])[0]
 
     # render
-    contents = '\n'.join([
-        svg.header(pixel_bounds),
-        svg.lines(pixel_lines),
-        svg.circles(pixel_points),
-        svg.polygons(pixel_blocks),
-        # svg.circles([pixel_special_point], '#feb24c', 5),
-        svg.footer(),
-
-    ])
     print('Saving to "{}"'.format(out_path))
-    with open(out_path, 'w') as f:
-        f.write(contents)
+    with svg.Writer(out_path, pixel_bounds, precision, lod) as w:
+        with w.group('edge', svg.line_style()):
+            w.polylines(pixel_lines)
+        with w.group('node', svg.circle_style()):
+            w.circles(pixel_points)
+        with w.group('block', svg.polygon_style()):
+            w.polygons(pixel_blocks)
+        # w.circles([pixel_special_point], 5, svg.circle_style('#feb24c'))
 
 
 def legit():
     intermediate_res_w = 800
     intermediate_res_h = 600
     fn = 'data/business-time.osm'
-    graph_cache_fn = 'data/business-time-graph.pkl'
+    graph_cache_fn = 'data/business-time-graph.npz'
 
     node_map, ways, geo_bounds = osm.preproc(fn)
 
     # build and save graph
     # graph = build(node_map, ways)
-    # with open(graph_cache_fn, 'wb') as f:
-    #     print('Writing graph to "{}"'.format(graph_cache_fn))
-    #     pickle.dump(graph, f)
+    # print('Writing graph to "{}"'.format(graph_cache_fn))
+    # graph.save(graph_cache_fn)
 
     # ... or load it
-    with open(graph_cache_fn, 'rb') as f:
-        print('Reading graph from "{}"'.format(graph_cache_fn))
-        graph = pickle.load(f)
+    print('Reading graph from "{}"'.format(graph_cache_fn))
+    graph = CSRGraph.load(graph_cache_fn)
 
     special_node = list(graph.keys())[300]
     pixel_bounds = (intermediate_res_w, intermediate_res_h)
@@ -444,6 +807,34 @@ def toy():
     print('Rings found: {}'.format(str(find_rings_at(toygraph, 1))))
 
 
+def test_merge_points():
+    # a chain (each point close to the next, but not to the one after), a
+    # tight cluster visited out of order, and random points
+    rng = np.random.RandomState(0)
+    chain = [(0.0, 0.6 * k) for k in range(6)]
+    cluster = [(5.0, 5.0), (5.3, 5.2), (4.9, 5.4), (5.6, 5.1)]
+    scattered = [tuple(p) for p in rng.uniform(0, 10, size=(300, 2)).tolist()]
+    for points in [chain, chain[::-1], cluster + chain, scattered + cluster + chain]:
+        assert merge_points(points, 1.0) == _merge_points_pairwise(points, 1.0)
+    # the chain doesn't collapse into one node (it would with single linkage)
+    assert len(set(merge_points(chain, 1.0))) == 3
+
+
+def test_find_rings_parallel():
+    # a 5x5 grid of streets (node r * 5 + c), plus a separate triangle
+    grid = {}  # type: Dict[int, Set[int]]
+    for r in range(5):
+        for c in range(5):
+            grid[r * 5 + c] = set(
+                (r + dr) * 5 + (c + dc) for dr, dc in [(-1, 0), (1, 0), (0, -1), (0, 1)]
+                if 0 <= r + dr < 5 and 0 <= c + dc < 5)
+    grid.update({100: set([101, 102]), 101: set([100, 102]), 102: set([100, 101])})
+    csr = CSRGraph.from_dict(grid)
+    assert sorted(np.concatenate(partition_nodes(csr, 4)).tolist()) == list(range(len(csr)))
+    for maxdist in (1, 2, 3, 5, 7):
+        assert find_rings(csr, workers=2, maxdist=maxdist) == find_rings(csr, maxdist=maxdist)
+
+
 def test_encompass_check():
     bigger = [
         (187,27),
@@ -6,108 +6,234 @@ Working with OpenStreetMap XML files.
 # ---
 
 # builtin
+from array import array
 import code
 from collections import Counter
+import functools
+import hashlib
+import inspect
 import os
 from math import sqrt
 import random
-from typing import List, Tuple, Set, Dict
+import sys
+from typing import List, Tuple, Set, Dict, FrozenSet, Iterator, Optional
 import xml.etree.ElementTree as ET
 
+# 3rd party
+import numpy as np
+
 # local
+import cache
 import geo
+import spatial
+import svg
+import tracing
 
 
-# TODO: Make high level format some day so other modules don't have to deal
-# with elements.
-
-# class MapObj(object):
-#     features: List[str]
-
-# class Node(MapObj):
-#     point: Tuple[float, float]
-
-# class Road(MapObj):
-#     points: List[Tuple[float, float]]
-
-# class Building(MapObj):
-#     points: List[Tuple[float, float]]
+class NodeStore(object):
+    """Columnar store of OSM nodes: ids, lats and lons in three contiguous
+    arrays, sorted by id.
 
-
-# playing
-
-def get_way_detailed_features(way_el: ET.Element) -> Dict[str, str]:
-    features = {}  # type: Dict[str, str]
-    for child in way_el:
-        if child.tag == 'tag':
-            tag_feats = get_tag_detailed_features(child)
-            for k, v in tag_feats.items():
-                features[k] = v
-    return features
-
-
-def get_way_features(way_el: ET.Element) -> Set[str]:
-    """Gets any features that we're considering and returns them.
+    Stands in for the old `Dict[int, ET.Element]` node map. Coordinates are
+    parsed once when the store is built, lookups are a binary search over the
+    ids, and many lookups can be done at once with `indices()` / `gather()`.
     """
-    features = set()
-    for child in way_el:
-        if child.tag == 'tag':
-            features.update(get_tag_features(child))
-    return features
-
-
-def get_tag_detailed_features(tag_el: ET.Element) -> Dict[str, str]:
-    if 'k' not in tag_el.attrib:
-        return {}
-    key = tag_el.attrib['k']
-
-    if 'v' not in tag_el.attrib:
-        return {key: ''}
-
-    val = tag_el.attrib['v']
-    return {key: val}
 
+    def __init__(self, ids: np.ndarray, lats: np.ndarray, lons: np.ndarray) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+            order = np.argsort(ids, kind='stable')
+            ids, lats, lons = ids[order], lats[order], lons[order]
+        self.ids = ids
+        self.lats = lats
+        self.lons = lons
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids.tolist())
+
+    def keys(self) -> Iterator[int]:
+        return iter(self)
+
+    def __contains__(self, node_id: int) -> bool:
+        idx = int(np.searchsorted(self.ids, node_id))
+        return idx < len(self.ids) and self.ids[idx] == node_id
+
+    def index(self, node_id: int) -> int:
+        """Returns the row of `node_id`. Raises KeyError if it's not stored."""
+        idx = int(np.searchsorted(self.ids, node_id))
+        if idx >= len(self.ids) or self.ids[idx] != node_id:
+            raise KeyError(node_id)
+        return idx
+
+    def indices(self, node_ids) -> np.ndarray:
+        """Returns the rows of all of `node_ids` (any int sequence or array).
+        Raises KeyError if any of them aren't stored."""
+        node_ids = np.asarray(node_ids, dtype=np.int64)
+        if len(node_ids) == 0:
+            return np.zeros(0, dtype=np.int64)
+        idxes = np.searchsorted(self.ids, node_ids)
+        # clip so that ids past the end can be checked (and fail) below
+        clipped = np.minimum(idxes, max(len(self.ids) - 1, 0))
+        if len(self.ids) == 0 or not np.array_equal(self.ids[clipped], node_ids):
+            missing = node_ids if len(self.ids) == 0 else node_ids[self.ids[clipped] != node_ids]
+            raise KeyError(int(missing[0]))
+        return idxes
+
+    def __getitem__(self, node_id: int) -> Tuple[float, float]:
+        """Returns (lat, lon) of `node_id`."""
+        idx = self.index(node_id)
+        return (float(self.lats[idx]), float(self.lons[idx]))
+
+    def gather(self, node_ids) -> np.ndarray:
+        """Returns an (n, 2) array of (lat, lon) rows, one per id in
+        `node_ids`."""
+        idxes = self.indices(node_ids)
+        res = np.empty((len(idxes), 2), dtype=np.float64)
+        res[:, 0] = self.lats[idxes]
+        res[:, 1] = self.lons[idxes]
+        return res
+
+    def points(self, node_ids) -> List[Tuple[float, float]]:
+        """Like gather(), but as a list of (lat, lon) tuples."""
+        return [(lat, lon) for lat, lon in self.gather(node_ids).tolist()]
+
+
+# ways
+# ---
 
-def get_tag_features(tag_el: ET.Element) -> Set[str]:
-    """Gets any features that we're considering and returns them.
+def get_category(features: Dict[str, str]) -> Optional[str]:
     """
-    if 'k' not in tag_el.attrib:
-        return set()
-    key = tag_el.attrib['k']
-
-    # new new: any, w/ val
-    return set([','.join([key, tag_el.attrib['v']])])
+    From the set of way features, returns a single one as the category.
 
-    # new: any
-    # return set([key])
-
-    # old: restrict
-    # feature_set = {'building', 'highway', 'water'}
-    # if key in feature_set:
-    #     return set([key])
-    # return set()
-
-
-def nd_to_geo_coords(
-        node_map: Dict[int, ET.Element],
-        nd: ET.Element) -> Tuple[float, float]:
-    node = node_map[int(nd.attrib['ref'])]
-    return (float(node.attrib['lat']), float(node.attrib['lon']))
+    This is probably overkill, as we'll likely only have one, but we have to
+    make sure that we pick one.
+    """
+    # priority order. maps feature key to its category
+    key_categories = [
+        ('building', 'building'),
+        ('water', 'water'),
+    ]
+    for key, cat in key_categories:
+        if key in features:
+            return cat
+
+    # secondary: try at more detailed key/vals
+    kv_categories = [
+        # not a footpath, but an area to walk on
+        ('man_made', 'pier', 'walkarea'),
+
+        # things that are "highway"s but for people, not cars
+        ('highway', 'path', 'footpath'),
+        ('highway', 'steps', 'footpath'),
+        ('highway', 'pedestrian', 'footpath'),
+        ('highway', 'footway', 'footpath'),
+        ('highway', 'track', 'footpath'),
+
+        # parks / greenery
+        ('liesure', 'park', 'park'),
+        ('landuse', 'meadow', 'park'),
+        ('natural', 'wood', 'park'),
+    ]
+    for key, val, cat in kv_categories:
+        if key in features and features[key] == val:
+            return cat
+
+    # backup: some have very little info
+    backup = [
+        ('highway', 'highway'),
+        # ('source', 'water'),
+    ]
+    for key, cat in backup:
+        if key in features:
+            return cat
+
+    return None
+
+
+Tags = Tuple[Tuple[str, str], ...]
+
+
+class TagSet(object):
+    """One distinct list of a way's tags, as (key, value) pairs.
+
+    Lots of ways have identical tags (every 'building=yes', every block of
+    the same street, ...), and all of them share one TagSet (see
+    get_tag_set()), so the strings, the lookups below and the category are
+    made once per distinct list instead of once per way.
+        - `tags`: key -> value (a tag without a value gets '')
+        - `features`: 'key,value' strings
+        - `category`: get_category() of the tags
+    """
+    __slots__ = ('pairs', 'tags', 'features', 'category')
+
+    def __init__(self, pairs: Tags) -> None:
+        self.pairs = pairs
+        self.tags = dict(pairs)
+        self.features = frozenset(','.join(pair) for pair in pairs)
+        self.category = get_category(self.tags)
+
+
+def get_tag_set(tag_sets: Dict[Tags, TagSet], pairs: List[Tuple[str, str]]) -> TagSet:
+    """Returns the TagSet for `pairs` out of `tag_sets` (the memo for one
+    parse), making it (with interned strings) if it's new."""
+    key = tuple(pairs)
+    tag_set = tag_sets.get(key)
+    if tag_set is None:
+        key = tuple((sys.intern(k), sys.intern(v)) for k, v in key)
+        tag_set = TagSet(key)
+        tag_sets[key] = tag_set
+    return tag_set
+
+
+class Way(object):
+    """An OSM way, parsed once: its id, node refs (an int64 array; a closed
+    way's last ref repeats its first) and tags (a shared TagSet)."""
+    __slots__ = ('id', 'refs', 'tag_set')
+
+    def __init__(self, way_id: int, refs: np.ndarray, tag_set: TagSet) -> None:
+        self.id = way_id
+        self.refs = refs
+        self.tag_set = tag_set
+
+    @property
+    def tags(self) -> Dict[str, str]:
+        return self.tag_set.tags
+
+    @property
+    def features(self) -> FrozenSet[str]:
+        return self.tag_set.features
+
+    @property
+    def category(self) -> Optional[str]:
+        return self.tag_set.category
+
+
+def make_ways(
+        way_ids: np.ndarray, nd_offsets: np.ndarray, nd_refs: np.ndarray,
+        tag_sets: List[TagSet]) -> List[Way]:
+    """Way i's refs are nd_refs[nd_offsets[i]:nd_offsets[i + 1]] (views,
+    not copies)."""
+    bounds = nd_offsets.tolist()
+    return [
+        Way(way_id, nd_refs[bounds[i]:bounds[i + 1]], tag_sets[i])
+        for i, way_id in enumerate(way_ids.tolist())
+    ]
 
 
 def transform_ways(
-        node_map: Dict[int, ET.Element], ways: List[ET.Element],
+        node_map: NodeStore, ways: List[Way],
         closed: bool = False) -> Tuple[List[List[Tuple[float, float]]], List[List[int]]]:
-    geo_coords, ids = [], []
-    for way in ways:
-        g, i = transform_way(node_map, way, closed)
-        geo_coords.append(g)
-        ids.append(i)
-    return geo_coords, ids
+    ids = [way_refs(way, closed) for way in ways]
+    return gather_ways(node_map, ids).tolist(), ids
 
 
 def transform_way(
-        node_map: Dict[int, ET.Element], way: ET.Element,
+        node_map: NodeStore, way: Way,
         closed: bool = False) -> Tuple[List[Tuple[float, float]], List[int]]:
     """
     `closed` is whether to duplicate the first point as the last
@@ -118,13 +244,27 @@ def transform_way(
         - list of coords
         - list of node ref IDs
     """
-    nds = [el for el in way if el.tag == 'nd']
+    refs = way_refs(way, closed)
+    return node_map.points(refs), refs
+
+
+def way_refs(way: Way, closed: bool = False) -> List[int]:
+    """Returns the node refs of `way` (see transform_way() for `closed`)."""
+    refs = way.refs
 
     # remove the final node if the poly shouldn't be closed and it currently is
-    if (not closed) and len(nds) > 0 and nds[0].attrib['ref'] == nds[-1].attrib['ref']:
-        nds = nds[:-1]
+    if (not closed) and len(refs) > 0 and refs[0] == refs[-1]:
+        refs = refs[:-1]
+
+    return refs.tolist()
 
-    return [nd_to_geo_coords(node_map, nd) for nd in nds], [int(nd.attrib['ref']) for nd in nds]
+
+def gather_ways(node_map: NodeStore, ref_lists: List[List[int]]) -> geo.Ragged:
+    """Looks up the (lat, lon) coords of many ways' node refs at once."""
+    offsets = np.zeros(len(ref_lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(refs) for refs in ref_lists])
+    all_refs = np.fromiter((ref for refs in ref_lists for ref in refs), dtype=np.int64, count=int(offsets[-1]))
+    return geo.Ragged(node_map.gather(all_refs).reshape(-1, 2), offsets)
 
 
 def get_color(features_blobs: List[str]) -> str:
@@ -147,51 +287,99 @@ def get_line_width(features: List[str]) -> int:
         return 5
     return 1
 
-def get_geo_bounds(root: ET.Element) -> Tuple[float, float, float, float]:
+def bounds_from_el(bounds_el: ET.Element) -> Tuple[float, float, float, float]:
     """
     Returns minlat, minlon, maxlat, maxlon
     """
-    geo_bounds_el = [child for child in root if child.tag == 'bounds'][0]
     return (
-        float(geo_bounds_el.attrib['minlat']),
-        float(geo_bounds_el.attrib['minlon']),
-        float(geo_bounds_el.attrib['maxlat']),
-        float(geo_bounds_el.attrib['maxlon']),
+        float(bounds_el.attrib['minlat']),
+        float(bounds_el.attrib['minlon']),
+        float(bounds_el.attrib['maxlat']),
+        float(bounds_el.attrib['maxlon']),
     )
 
-def render_v2(root: ET.Element, in_path: str):
+
+def get_geo_bounds(root: ET.Element) -> Tuple[float, float, float, float]:
+    """
+    Returns minlat, minlon, maxlat, maxlon
+    """
+    geo_bounds_el = [child for child in root if child.tag == 'bounds'][0]
+    return bounds_from_el(geo_bounds_el)
+
+def render_v2(
+        in_path: str, node_map: NodeStore, ways: List[Way],
+        geo_bounds: Tuple[float,float,float,float],
+        pixel_bounds: Tuple[int, int] = (800, 600),
+        precision: Optional[int] = 1, lod: bool = True, min_size: float = 1.0,
+        road_points: bool = True) -> str:
+    """Renders ways to SVG (in HTML) next to `in_path`, streaming elements to
+    the file as they're made (see svg.Writer for `precision`, `lod` and
+    `min_size`). Elements are grouped by style, so each style is written
+    once. Returns the path written."""
     # file crap
     title = '.'.join(os.path.basename(in_path).split('.')[:-1])
     out_fn = title + '.html'
     out_path = os.path.join(os.path.dirname(in_path), out_fn)
-
-    # settings
-    geo_bounds = get_geo_bounds(root)
-    pixel_bounds = (800, 600)
-
-    # build node mapping (from id -> node)
-    node_map = {int(child.attrib['id']): child for child in root if child.tag == 'node'}
-    ways = [child for child in root if child.tag == 'way']
     print('INFO: Found {} ways'.format(len(ways)))
 
-    # extract stuff
-    # TODO: keep going
+    # roads appear to be not closed.
+    refs = [way_refs(way, closed=True) for way in ways]
+    is_road = [len(r) >= 2 and r[0] != r[-1] for r in refs]
+    features = [sorted(way.features) for way in ways]
+
+    # convert all at once
+    geo_ways = gather_ways(node_map, refs)
+    pixel_ways = geo.convert_ragged(geo_bounds, pixel_bounds, geo_ways)
+
+    # group by (is road, style), keeping the order groups are first seen in.
+    # areas go first so roads draw over them.
+    groups = {}  # type: Dict[Tuple[bool, str], List[int]]
+    for road in [False, True]:
+        for i in range(len(ways)):
+            if is_road[i] != road:
+                continue
+            if road:
+                style = svg.line_style(get_color(features[i]), get_line_width(features[i]))
+            else:
+                style = svg.polygon_style(get_color(features[i]))
+            groups.setdefault((road, style), []).append(i)
+
+    with svg.Writer(out_path, pixel_bounds, precision, lod, min_size) as w:
+        for (road, style), idxs in groups.items():
+            with w.group('road' if road else 'area', style):
+                for i in idxs:
+                    cls = ';'.join(features[i])
+                    if road:
+                        w.polylines([pixel_ways[i]], cls=cls)
+                    else:
+                        w.polygons([pixel_ways[i]], cls=cls)
+
+        if road_points:
+            # collapse geo road points (test before trying to turn into a graph)
+            road_idxs = [i for i in range(len(ways)) if is_road[i]]
+            geo_road_points = [pt for i in road_idxs for pt in map(tuple, geo_ways[i].tolist())]
+            thresh = 1e-4
+            toremove = set()
+            for i, j in spatial.pairs_within(geo_road_points, thresh):
+                # could end up with some really bad chaining of small distances and
+                # deleting all intermediate points but probably fine
+                toremove.add(j)
+            keep = np.ones(len(geo_road_points), dtype=bool)
+            keep[list(toremove)] = False
+            pixel_road_points = geo.to_pixels(
+                geo_bounds, pixel_bounds, np.array(geo_road_points, dtype=np.float64).reshape(-1, 2)[keep])
+            w.circles(pixel_road_points, style='fill:orange;stroke:black')
+
+    print('INFO: Wrote "{}" ({})'.format(out_path, ', '.join(
+        '{} {}'.format(v, k) for k, v in sorted(w.counts.items()))))
+    return out_path
 
 
 def render(
-        in_path: str, node_map: Dict[int, ET.Element], ways: List[ET.Element],
+        in_path: str, node_map: NodeStore, ways: List[Way],
         geo_bounds: Tuple[float,float,float,float]):
-    """Just renders OSM tree below root to SVG"""
-    # could pass most of the immediate below in if desired
-
-    # file crap
-    title = '.'.join(os.path.basename(in_path).split('.')[:-1])
-    out_fn = title + '.html'
-    out_path = os.path.join(os.path.dirname(in_path), out_fn)
-
-    # settings
-    pixel_bounds = (800, 600)
-
+    """Just renders OSM tree below root to SVG, at full precision and detail.
+    (For anything region-sized, use render_v2().)"""
     # reporting to have some idea of scale
     print('Lat range: {:.5f} -- {:.5f} (delta: {:.5f})'.format(
         geo_bounds[0], geo_bounds[2], abs(geo_bounds[2] - geo_bounds[0])
@@ -199,120 +387,7 @@ def render(
     print('Lon range: {:.5f} -- {:.5f} (delta: {:.5f})'.format(
         geo_bounds[1], geo_bounds[3], abs(geo_bounds[3] - geo_bounds[1])
     ))
-
-    # build node mapping (from id -> node)
-    print('INFO: Found {} ways'.format(len(ways)))
-
-    # extract polys
-    geo_meta_polys = []
-    geo_meta_roads = []
-    geo_road_points = []
-    for way in ways:
-        # 'points': [(float,float)], 'features': [str] <-- don't know how to get yet
-        meta_poly = {
-            'points': [],
-            'features': [],
-        }
-        tags, nds = [], []
-        for child in way:
-            if child.tag == 'tag':
-                tags.append(child)
-            elif child.tag == 'nd':
-                nds.append(child)
-            else:
-                print('WARNING: Weird sub-way element found: {}'.format(child.tag))
-
-        meta_poly['features'] = get_way_features(way)
-
-        objtype = "obj"
-        # roads appear to be not closed.
-        if len(nds) >= 2 and nds[0].attrib['ref'] != nds[-1].attrib['ref']:
-            objtype = "road"
-
-        for nd in nds:
-            # look up the node and add to list of points
-            node = node_map[int(nd.attrib['ref'])]
-            meta_poly['points'].append((float(node.attrib['lat']), float(node.attrib['lon'])))
-
-        # add to the relevant list
-        if objtype == "obj":
-            geo_meta_polys.append(meta_poly)
-        elif objtype == "road":
-            geo_meta_roads.append(meta_poly)
-            for point in meta_poly['points']:
-                geo_road_points.append(point)
-
-    # collapse geo road points (test before trying to turn into a graph)
-    thresh = 1e-4
-    toremove = set()
-    for i in range(len(geo_road_points)):
-        for j in range(i+1, len(geo_road_points)):
-            p1 = geo_road_points[i]
-            p2 = geo_road_points[j]
-            l2_diff = sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
-            # could end up with some really bad chaining of small distances and
-            # deleting all intermediate points but probably fine
-            if l2_diff < thresh:
-                toremove.add(j)
-    filtered_geo_road_points = [pt for i, pt in enumerate(geo_road_points) if i not in toremove]
-
-    # get just geo ones for now
-    geo_polys = [geo_meta_poly['points'] for geo_meta_poly in geo_meta_polys]
-    geo_roads = [geo_meta_road['points'] for geo_meta_road in geo_meta_roads]
-
-    # convert
-    pixel_polys = geo.convert_polys(geo_bounds, pixel_bounds, geo_polys)
-    pixel_roads = geo.convert_polys(geo_bounds, pixel_bounds, geo_roads)
-    pixel_road_points = geo.convert_points(geo_bounds, pixel_bounds, filtered_geo_road_points)
-
-    # add back in any features
-    pixel_meta_polys = []
-    for i, geo_meta_poly in enumerate(geo_meta_polys):
-        pixel_poly = pixel_polys[i]
-        pixel_meta_polys.append({
-            'points': pixel_poly,
-            'features': geo_meta_poly['features'],
-        })
-    pixel_meta_roads = []
-    for i, geo_meta_road in enumerate(geo_meta_roads):
-        pixel_road = pixel_roads[i]
-        pixel_meta_roads.append({
-            'points': pixel_road,
-            'features': geo_meta_road['features'],
-        })
-
-    # create doc
-    header = '<!DOCTYPE html>\n<html>\n<body>\n\n<svg width="{}" height="{}">\n'.format(*pixel_bounds)
-    inner_els = []
-    for i, pixel_meta_poly in enumerate(pixel_meta_polys):
-        points = ' '.join(','.join(str(coord) for coord in point) for point in pixel_meta_poly['points'])
-        inner_els.append(
-            '<polygon points="{}" fill-opacity="0.4" style="fill:{};stroke:black;stroke-width:1" class="{}"/>'.format(
-                points,
-                get_color(pixel_meta_poly['features']),
-                ';'.join(pixel_meta_poly['features']),
-            )
-        )
-    for i, pixel_meta_road in enumerate(pixel_meta_roads):
-        points = ' '.join(','.join(str(coord) for coord in point) for point in pixel_meta_road['points'])
-        inner_els.append(
-            '<polyline points="{}" style="fill:none;stroke:{};stroke-width:{}" class="{}"/>'.format(
-                points,
-                get_color(pixel_meta_road['features']),
-                get_line_width(pixel_meta_road['features']),
-                ';'.join(pixel_meta_road['features']),
-            )
-        )
-    for x, y in pixel_road_points:
-        inner_els.append(
-            '<circle cx="{}" cy="{}" r="{}" fill="orange" stroke="black" />'.format(
-                x, y, 3)#random.randint(1, 5))
-        )
-    footer = '\n</svg>\n\n</body>\n</html>'
-
-    # write out
-    with open(out_path, 'w') as f:
-        f.write('\n'.join([header] + inner_els + [footer]))
+    render_v2(in_path, node_map, ways, geo_bounds, precision=None, lod=False)
 
 
 def detective(root: ET.Element) -> None:
@@ -494,12 +569,289 @@ def detective(root: ET.Element) -> None:
     code.interact(local=dict(globals(), **locals()))
 
 
-def preproc(fn: str) -> Tuple[Dict[int, ET.Element], List[ET.Element], Tuple[float,float,float,float]]:
-    tree = ET.parse(fn)
-    root = tree.getroot()
-    node_map = {int(child.attrib['id']): child for child in root if child.tag == 'node'}
-    ways = [child for child in root if child.tag == 'way']
-    geo_bounds = get_geo_bounds(root)
+def iterparse(fn: str) -> Iterator[Tuple[str, ET.Element]]:
+    """Streams the top-level elements (bounds, node, way, relation) of an OSM
+    file as (tag, element) pairs.
+
+    Each element is complete (i.e., has all of its children) when it's
+    yielded. Right after, it's detached from the document root, so the tree
+    never holds more than the element currently being read. Callers that want
+    to keep an element around just hold on to a reference; anything else gets
+    garbage collected.
+    """
+    depth = 0
+    root = None
+    for event, el in ET.iterparse(fn, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = el
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1:
+            yield el.tag, el
+            # drop the element (and anything before it) from the tree.
+            root.clear()
+
+
+def read_way(el: ET.Element, nd_refs: array, tag_sets: Dict[Tags, TagSet]) -> TagSet:
+    """Appends the node refs of way element `el` to `nd_refs`, and returns
+    its TagSet (out of the parse's memo, `tag_sets`)."""
+    pairs = []  # type: List[Tuple[str, str]]
+    for child in el:
+        if child.tag == 'nd':
+            nd_refs.append(int(child.attrib['ref']))
+        elif child.tag == 'tag' and 'k' in child.attrib:
+            pairs.append((child.attrib['k'], child.attrib.get('v', '')))
+    return get_tag_set(tag_sets, pairs)
+
+
+def is_wanted(tag_set: TagSet) -> bool:
+    """Whether anything downstream uses ways with these tags: those with a
+    category. (That covers everything graph.build() and buildings.get()
+    pick out too, since every highway and building gets one.)"""
+    return tag_set.category is not None
+
+
+def parse(fn: str) -> Tuple[NodeStore, List[Way], Tuple[float,float,float,float]]:
+    """Streams `fn` once, returning (node_map, ways, geo_bounds).
+
+    Nodes go straight into a NodeStore (their tags are never used
+    downstream); ways become Way records, their refs all in one array;
+    relations are dropped.
+    """
+    node_ids, node_lats, node_lons = array('q'), array('d'), array('d')
+    way_ids, nd_offsets, nd_refs = array('q'), array('q', [0]), array('q')
+    way_tags = []  # type: List[TagSet]
+    tag_sets = {}  # type: Dict[Tags, TagSet]
+    geo_bounds = None  # type: Optional[Tuple[float, float, float, float]]
+    for tag, el in iterparse(fn):
+        if tag == 'node':
+            attrib = el.attrib
+            node_ids.append(int(attrib['id']))
+            node_lats.append(float(attrib['lat']))
+            node_lons.append(float(attrib['lon']))
+        elif tag == 'way':
+            way_ids.append(int(el.attrib['id']))
+            way_tags.append(read_way(el, nd_refs, tag_sets))
+            nd_offsets.append(len(nd_refs))
+        elif tag == 'bounds' and geo_bounds is None:
+            geo_bounds = bounds_from_el(el)
+
+    if geo_bounds is None:
+        raise ValueError('No <bounds> element found in "{}"'.format(fn))
+
+    node_map = NodeStore(
+        np.frombuffer(node_ids, dtype=np.int64),
+        np.frombuffer(node_lats, dtype=np.float64),
+        np.frombuffer(node_lons, dtype=np.float64))
+    ways = make_ways(
+        np.frombuffer(way_ids, dtype=np.int64),
+        np.frombuffer(nd_offsets, dtype=np.int64),
+        np.frombuffer(nd_refs, dtype=np.int64),
+        way_tags)
+    return node_map, ways, geo_bounds
+
+
+def parse_wanted(
+        fn: str, batch_size: int = 65536) -> Tuple[NodeStore, List[Way], Tuple[float,float,float,float]]:
+    """Like parse(), but keeps only the ways we use (see is_wanted()) and
+    the nodes they reference, for inputs too big to hold whole. Most nodes in
+    a big extract are addresses and POIs no way references.
+
+    Streams `fn` twice. The first pass reads the ways (and bounds), keeping
+    the wanted ones and collecting their refs into one sorted array of ids.
+    The second pass reads the nodes, checking their ids against that array
+    `batch_size` at a time (a binary search each), and keeps the hits. Peak
+    memory goes with what's kept, not with the size of the file.
+    """
+    way_ids, nd_offsets, nd_refs = array('q'), array('q', [0]), array('q')
+    way_tags = []  # type: List[TagSet]
+    tag_sets = {}  # type: Dict[Tags, TagSet]
+    geo_bounds = None  # type: Optional[Tuple[float, float, float, float]]
+    with tracing.stage('osm.parse_ways'):
+        for tag, el in iterparse(fn):
+            if tag == 'way':
+                start = len(nd_refs)
+                tag_set = read_way(el, nd_refs, tag_sets)
+                if not is_wanted(tag_set):
+                    del nd_refs[start:]
+                    tracing.count('ways_skipped')
+                    continue
+                way_ids.append(int(el.attrib['id']))
+                way_tags.append(tag_set)
+                nd_offsets.append(len(nd_refs))
+            elif tag == 'bounds' and geo_bounds is None:
+                geo_bounds = bounds_from_el(el)
+
+    if geo_bounds is None:
+        raise ValueError('No <bounds> element found in "{}"'.format(fn))
+    refs = np.frombuffer(nd_refs, dtype=np.int64)
+    wanted = np.unique(refs)
+
+    node_ids, node_lats, node_lons = [], [], []  # type: List[np.ndarray], List[np.ndarray], List[np.ndarray]
+    batch_ids, batch_lats, batch_lons = array('q'), array('d'), array('d')
+
+    def flush() -> None:
+        # (copies, so the batch buffers can be reused)
+        ids = np.array(batch_ids, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(wanted, ids), max(len(wanted) - 1, 0))
+        keep = wanted[pos] == ids if len(wanted) > 0 else np.zeros(len(ids), dtype=bool)
+        tracing.count('nodes_skipped', len(ids) - int(keep.sum()))
+        node_ids.append(ids[keep])
+        node_lats.append(np.array(batch_lats, dtype=np.float64)[keep])
+        node_lons.append(np.array(batch_lons, dtype=np.float64)[keep])
+        del batch_ids[:], batch_lats[:], batch_lons[:]
+
+    with tracing.stage('osm.parse_nodes'):
+        for tag, el in iterparse(fn):
+            if tag == 'node':
+                attrib = el.attrib
+                batch_ids.append(int(attrib['id']))
+                batch_lats.append(float(attrib['lat']))
+                batch_lons.append(float(attrib['lon']))
+                if len(batch_ids) >= batch_size:
+                    flush()
+        flush()
+
+    node_map = NodeStore(np.concatenate(node_ids), np.concatenate(node_lats), np.concatenate(node_lons))
+    ways = make_ways(
+        np.frombuffer(way_ids, dtype=np.int64),
+        np.frombuffer(nd_offsets, dtype=np.int64),
+        refs,
+        way_tags)
+    return node_map, ways, geo_bounds
+
+
+def pack(
+        node_map: NodeStore, ways: List[Way],
+        geo_bounds: Tuple[float,float,float,float]) -> Dict[str, np.ndarray]:
+    """Flattens parsed data into arrays (for the parse cache).
+
+    Ways become their ids, a CSR-style run of node refs each, and a run of
+    (key, value) tag pairs each, with tag strings interned into one table.
+    """
+    strings = {}  # type: Dict[str, int]
+
+    def intern(s: str) -> int:
+        if s not in strings:
+            strings[s] = len(strings)
+        return strings[s]
+
+    # each distinct tag list only needs its strings looked up once
+    tag_codes = {}  # type: Dict[int, Tuple[List[int], List[int]]]
+    nd_offsets = np.zeros(len(ways) + 1, dtype=np.int64)
+    nd_offsets[1:] = np.cumsum([len(way.refs) for way in ways])
+    tag_offsets, tag_keys, tag_vals = array('q', [0]), array('i'), array('i')
+    for way in ways:
+        codes = tag_codes.get(id(way.tag_set))
+        if codes is None:
+            codes = ([intern(k) for k, _ in way.tag_set.pairs], [intern(v) for _, v in way.tag_set.pairs])
+            tag_codes[id(way.tag_set)] = codes
+        tag_keys.extend(codes[0])
+        tag_vals.extend(codes[1])
+        tag_offsets.append(len(tag_keys))
+
+    encoded = [s.encode('utf-8') for s in strings.keys()]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    string_offsets[1:] = np.cumsum([len(e) for e in encoded])
+
+    return {
+        'bounds': np.array(geo_bounds, dtype=np.float64),
+        'node_ids': node_map.ids,
+        'node_lats': node_map.lats,
+        'node_lons': node_map.lons,
+        'way_ids': np.array([way.id for way in ways], dtype=np.int64),
+        'nd_offsets': nd_offsets,
+        'nd_refs': np.concatenate([way.refs for way in ways] + [np.zeros(0, dtype=np.int64)]),
+        'tag_offsets': np.frombuffer(tag_offsets, dtype=np.int64),
+        'tag_keys': np.frombuffer(tag_keys, dtype=np.int32),
+        'tag_vals': np.frombuffer(tag_vals, dtype=np.int32),
+        'strings': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+        'string_offsets': string_offsets,
+    }
+
+
+def unpack(arrays: Dict[str, np.ndarray]) -> Tuple[NodeStore, List[Way], Tuple[float,float,float,float]]:
+    """Inverse of pack(). Nodes and way refs stay backed by `arrays` (e.g.,
+    a memory map); tags go back into shared TagSets."""
+    node_map = NodeStore(arrays['node_ids'], arrays['node_lats'], arrays['node_lons'])
+    geo_bounds = tuple(arrays['bounds'].tolist())
+
+    blob = arrays['strings'].tobytes()
+    offsets = arrays['string_offsets'].tolist()
+    strings = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    tag_offsets = arrays['tag_offsets'].tolist()
+    tag_keys = arrays['tag_keys'].tolist()
+    tag_vals = arrays['tag_vals'].tolist()
+    tag_sets = {}  # type: Dict[Tags, TagSet]
+    by_codes = {}  # type: Dict[Tuple[int, ...], TagSet]
+    way_tags = []  # type: List[TagSet]
+    for i in range(len(tag_offsets) - 1):
+        lo, hi = tag_offsets[i], tag_offsets[i + 1]
+        codes = tuple(tag_keys[lo:hi] + tag_vals[lo:hi])
+        tag_set = by_codes.get(codes)
+        if tag_set is None:
+            pairs = [
+                (strings[k], strings[v]) for k, v in zip(tag_keys[lo:hi], tag_vals[lo:hi])
+            ]
+            tag_set = get_tag_set(tag_sets, pairs)
+            by_codes[codes] = tag_set
+        way_tags.append(tag_set)
+
+    ways = make_ways(arrays['way_ids'], arrays['nd_offsets'], arrays['nd_refs'], way_tags)
+    return node_map, ways, geo_bounds
+
+
+@functools.lru_cache(maxsize=None)
+def cache_version(wanted_only: bool = False) -> str:
+    """Hash of the code whose output goes in the parse cache, so changing
+    how files are parsed or packed invalidates old entries. With
+    `wanted_only`, the filter (is_wanted() and get_category()) is hashed
+    too, since it decides which ways those entries keep."""
+    h = hashlib.blake2b(digest_size=16)
+    fns = [read_way, parse, parse_wanted, pack]
+    if wanted_only:
+        fns += [is_wanted, get_category]
+    for fn in fns:
+        h.update(inspect.getsource(fn).encode('utf-8'))
+    return h.hexdigest()
+
+
+@tracing.traced('osm.preproc')
+def preproc(
+        fn: str, cache_dir: Optional[str] = cache.CACHE_DIR,
+        wanted_only: bool = False) -> Tuple[NodeStore, List[Way], Tuple[float,float,float,float]]:
+    """Returns (node_map, ways, geo_bounds) for `fn`.
+
+    Parsed files are cached in `cache_dir` (see cache.py), so later runs on
+    an unchanged file skip the XML parse. Pass cache_dir=None to always
+    parse.
+
+    With `wanted_only`, only the ways we use and their nodes are kept (see
+    parse_wanted()), which bounds memory on huge inputs. That's cached
+    separately from the full parse.
+    """
+    kind = 'osm-wanted' if wanted_only else 'osm'
+    version = cache_version(wanted_only)
+    if cache_dir is not None:
+        arrays = cache.load(fn, cache_dir, kind, version)
+        if arrays is not None:
+            tracing.count('cache_hits')
+            return unpack(arrays)
+        tracing.count('cache_misses')
+
+    node_map, ways, geo_bounds = parse_wanted(fn) if wanted_only else parse(fn)
+    tracing.count('nodes', len(node_map))
+    tracing.count('ways', len(ways))
+
+    if cache_dir is not None:
+        try:
+            cache.store(fn, cache_dir, kind, pack(node_map, ways, geo_bounds), version)
+        except (OSError, ValueError) as e:
+            print('WARNING: Could not cache "{}": {}'.format(fn, e))
 
     return node_map, ways, geo_bounds
 
@@ -513,7 +865,7 @@ def main():
     # detective(root)
 
     # do some basic renderering
-    render(fn, node_map, ways, geo_bounds)
+    render_v2(fn, node_map, ways, geo_bounds)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,8 @@
 """Let's see if we can rasterize a polygon."""
 
-from typing import List, Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
 
 DiscretePoint = Tuple[int, int]
 DiscretePoly = List[DiscretePoint]
@@ -22,13 +24,168 @@ def brute_force_raster(poly: Union[DiscretePoly, Poly], resolution: int) -> Rast
     '''
     All coordinates in `poly` should be in the range [0, resolution).
     '''
-    res = []
-    for y in reversed(range(resolution)):
-        row = []
-        for x in range(resolution):
-            inside = point_in_polygon(poly, (x, y))
-            row.append('+' if inside else '.')
-        res.append(row)
+    # all pixels, row by row from the top (highest y) down
+    ys, xs = np.mgrid[resolution - 1:-1:-1, 0:resolution]
+    pixels = np.stack([xs.ravel(), ys.ravel()], axis=1)
+    inside = points_in_polygon(poly, pixels).reshape(resolution, resolution)
+    return [['+' if px else '.' for px in row] for row in inside.tolist()]
+
+
+def scanline_fill(poly: Union[DiscretePoly, Poly, np.ndarray], width: int, height: int) -> np.ndarray:
+    """Fills `poly` with an edge-table scanline pass. Returns a (height,
+    width) bool array indexed [y, x] in `poly`'s own coordinates (so row 0 is
+    y = 0).
+
+    Pixel (x, y) is filled exactly when point_in_polygon(poly, (x, y)) would
+    say so: each edge is only visited on the rows it spans, and its crossing
+    toggles every pixel to the right of it.
+    """
+    verts, prev_verts = _edges(poly)
+    res = np.zeros((height, width), dtype=bool)
+    if len(verts) == 0 or width <= 0 or height <= 0:
+        return res
+
+    # edge table: the integer rows each edge straddles are (min y, max y]
+    lo = np.minimum(verts[:, 1], prev_verts[:, 1])
+    hi = np.maximum(verts[:, 1], prev_verts[:, 1])
+    first_row = np.maximum(np.floor(lo).astype(np.int64) + 1, 0)
+    last_row = np.minimum(np.floor(hi).astype(np.int64), height - 1)
+    n_rows = np.maximum(last_row - first_row + 1, 0)
+
+    # one entry per (edge, row) pair
+    edge_idx = np.repeat(np.arange(len(verts)), n_rows)
+    row_starts = np.cumsum(n_rows) - n_rows
+    y = (first_row[edge_idx] + np.arange(len(edge_idx)) - np.repeat(row_starts, n_rows)).astype(np.float64)
+    v_x, v_y = verts[edge_idx, 0], verts[edge_idx, 1]
+    pv_x, pv_y = prev_verts[edge_idx, 0], prev_verts[edge_idx, 1]
+    x_int = v_x + (y - v_y) / (pv_y - v_y) * (pv_x - v_x)
+
+    # each crossing toggles pixels x > x_int, i.e., from floor(x_int) + 1 on
+    toggles = np.zeros((height, width + 1), dtype=np.uint8)
+    first_col = np.clip(np.floor(x_int) + 1, 0, width).astype(np.int64)
+    np.add.at(toggles, (y.astype(np.int64), first_col), 1)
+    res = (np.cumsum(toggles, axis=1, dtype=np.uint32)[:, :width] % 2).astype(bool)
+
+    # vertices count as inside
+    on_grid = (
+        (verts[:, 0] == np.floor(verts[:, 0])) & (verts[:, 1] == np.floor(verts[:, 1])) &
+        (verts[:, 0] >= 0) & (verts[:, 0] < width) & (verts[:, 1] >= 0) & (verts[:, 1] < height))
+    res[verts[on_grid, 1].astype(np.int64), verts[on_grid, 0].astype(np.int64)] = True
+    return res
+
+
+def scanline_raster(poly: Union[DiscretePoly, Poly, np.ndarray], resolution: int) -> np.ndarray:
+    '''
+    Scanline replacement for brute_force_raster(). Returns a (resolution,
+    resolution) uint8 array with 1 inside and 0 outside, laid out like
+    brute_force_raster() (row 0 is the top, i.e., y = resolution - 1).
+
+    All coordinates in `poly` should be in the range [0, resolution).
+    '''
+    return scanline_fill(poly, resolution, resolution)[::-1].astype(np.uint8)
+
+
+def raster_to_str(raster: np.ndarray) -> Raster:
+    """Converts a 0/1 raster to the legacy '+' / '.' format."""
+    return [['+' if px else '.' for px in row] for row in raster.tolist()]
+
+
+def rasterize_labels(
+        polys: Sequence[Union[DiscretePoly, Poly, np.ndarray]],
+        width: int, height: int,
+        labels: Optional[Sequence[int]] = None) -> np.ndarray:
+    """Rasterizes many polygons into one (height, width) label image, indexed
+    [y, x] like scanline_fill(). 0 is background; polygon i gets labels[i]
+    (default: i + 1). Later polygons are drawn on top of earlier ones.
+    """
+    res = np.zeros((height, width), dtype=np.int32)
+    for i, poly in enumerate(polys):
+        res[scanline_fill(poly, width, height)] = i + 1 if labels is None else labels[i]
+    return res
+
+
+# max number of (point, edge) pairs to broadcast at once
+BATCH_ELEMENTS = 1 << 22
+
+
+def _edges(poly: Union[DiscretePoly, Poly, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (vertices, previous vertices) of `poly` as float arrays."""
+    verts = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+    return verts, np.roll(verts, 1, axis=0)
+
+
+def _crossings(
+        verts: np.ndarray, prev_verts: np.ndarray,
+        points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Broadcasts `points` (n, 2) against edges (e, 2) and returns two (n, e)
+    bool arrays: whether each edge crosses the point's leftward ray, and
+    whether the point is the edge's vertex."""
+    v_x, v_y = verts[:, 0], verts[:, 1]
+    pv_x, pv_y = prev_verts[:, 0], prev_verts[:, 1]
+    x, y = points[:, 0:1], points[:, 1:2]
+    straddles = ((v_y < y) & (pv_y >= y)) | ((pv_y < y) & (v_y >= y))
+    # (division by zero only happens for edges that don't straddle, which are
+    # masked out anyway)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_int = v_x + (y - v_y) / (pv_y - v_y) * (pv_x - v_x)
+    crosses = straddles & (x_int < x)
+    is_vertex = (v_x == x) & (v_y == y)
+    return crosses, is_vertex
+
+
+def points_in_polygon(
+        poly: Union[DiscretePoly, Poly, np.ndarray],
+        points: Union[Sequence[DiscretePoint], Sequence[Point], np.ndarray]) -> np.ndarray:
+    """Batch version of point_in_polygon(): tests every one of `points`
+    against `poly` at once. Returns a bool array, one per point.
+
+    Same semantics as the scalar version, including that the polygon's
+    vertices count as inside.
+    """
+    verts, prev_verts = _edges(poly)
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    res = np.zeros(len(points), dtype=bool)
+    if len(verts) == 0:
+        return res
+
+    step = max(1, BATCH_ELEMENTS // len(verts))
+    for start in range(0, len(points), step):
+        chunk = points[start:start + step]
+        crosses, is_vertex = _crossings(verts, prev_verts, chunk)
+        res[start:start + step] = (
+            (np.count_nonzero(crosses, axis=1) % 2 == 1) | is_vertex.any(axis=1))
+    return res
+
+
+def points_in_polygons(
+        polys: Sequence[Union[DiscretePoly, Poly, np.ndarray]],
+        points: Union[Sequence[DiscretePoint], Sequence[Point], np.ndarray]) -> np.ndarray:
+    """Tests every one of `points` against every one of `polys`. Returns a
+    (len(polys), len(points)) bool array.
+
+    All polygons' edges are stacked into one array, so each batch of points
+    is a single broadcast; per-polygon results are then reduced over each
+    polygon's run of edges.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    res = np.zeros((len(polys), len(points)), dtype=bool)
+
+    # empty polygons contain nothing; leave them out of the stacked edges
+    nonempty = [i for i, poly in enumerate(polys) if len(poly) > 0]
+    if len(nonempty) == 0 or len(points) == 0:
+        return res
+    edges = [_edges(polys[i]) for i in nonempty]
+    verts = np.concatenate([e[0] for e in edges])
+    prev_verts = np.concatenate([e[1] for e in edges])
+    starts = np.cumsum([0] + [len(e[0]) for e in edges[:-1]])
+
+    step = max(1, BATCH_ELEMENTS // len(verts))
+    for start in range(0, len(points), step):
+        chunk = points[start:start + step]
+        crosses, is_vertex = _crossings(verts, prev_verts, chunk)
+        odd = np.add.reduceat(crosses.astype(np.uint32), starts, axis=1) % 2 == 1
+        on_vertex = np.logical_or.reduceat(is_vertex, starts, axis=1)
+        res[nonempty, start:start + step] = (odd | on_vertex).T
     return res
 
 
@@ -40,23 +197,123 @@ def point_in_polygon(
 
     Algorithm from Darel Rex Finley:
     http://alienryderflex.com/polygon/
+
+    A point is inside when a ray from it crosses the polygon's edges an odd
+    number of times; the polygon's own vertices also count as inside (not
+    great for rasterizing, but spectacular for poly-in-poly tests). The work
+    is done by points_in_polygon(), so callers with many points should call
+    that directly.
     """
-    # optimization -- not great for rasterizing, but spectacularly for
-    # poly-in-poly tests
-    if point in poly:
-        return True
-
-    x, y = point
-    prev_vertex = poly[-1]
-    oddNodes = False
-    for v_x, v_y in poly:
-        pv_x, pv_y = prev_vertex
-        if (v_y < y and pv_y >= y) or (pv_y < y and v_y >= y):
-            # there might be an intersection.
-            if v_x + (y - v_y) / (pv_y - v_y) * (pv_x - v_x) < x:
-                oddNodes = not oddNodes
-        prev_vertex = (v_x, v_y)
-    return oddNodes
+    return bool(points_in_polygon(poly, [point])[0])
+
+
+# clipping
+# ---
+
+Box = Tuple[float, float, float, float]
+
+
+def _clip_half_plane(pts: np.ndarray, axis: int, bound: float, keep_above: bool) -> np.ndarray:
+    """One Sutherland-Hodgman pass: clips polygon `pts` (n, 2) to the side of
+    the line pts[:, axis] == bound that `keep_above` says."""
+    n = len(pts)
+    if n == 0:
+        return pts
+    v = pts[:, axis]
+    inside = v >= bound if keep_above else v <= bound
+    prev = np.roll(pts, 1, axis=0)
+    prev_inside = np.roll(inside, 1)
+
+    # where edge (prev -> cur) crosses the line. (division by zero only for
+    # edges along it, which never cross.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (bound - prev[:, axis]) / (v - prev[:, axis])
+        crossing = prev + t[:, None] * (pts - prev)
+    crossing[:, axis] = bound
+
+    # for each edge, emit the crossing (if it crosses), then cur (if inside)
+    out = np.empty((2 * n, 2), dtype=np.float64)
+    out[0::2] = crossing
+    out[1::2] = pts
+    keep = np.empty(2 * n, dtype=bool)
+    keep[0::2] = inside != prev_inside
+    keep[1::2] = inside
+    return out[keep]
+
+
+def clip_polygon(poly: Union[Poly, np.ndarray], box: Box) -> np.ndarray:
+    """Clips `poly` (not repeating its first point at the end) to `box`
+    (minx, miny, maxx, maxy) with Sutherland-Hodgman. Returns the (m, 2)
+    clipped polygon, which is empty (or degenerate, with < 3 points) if
+    nothing was left. A concave polygon split in two by the box comes back
+    as one polygon joined by zero-width edges along the box's border."""
+    pts = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+    minx, miny, maxx, maxy = box
+    pts = _clip_half_plane(pts, 0, minx, True)
+    pts = _clip_half_plane(pts, 0, maxx, False)
+    pts = _clip_half_plane(pts, 1, miny, True)
+    pts = _clip_half_plane(pts, 1, maxy, False)
+    return pts
+
+
+def clip_polyline(line: Union[Poly, np.ndarray], box: Box) -> List[np.ndarray]:
+    """Clips `line` to `box` (minx, miny, maxx, maxy), clipping each segment
+    with Liang-Barsky. Returns the pieces (each (m, 2), m >= 2) left inside,
+    as a line that leaves the box and comes back is split in two."""
+    pts = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+    if len(pts) < 2:
+        return []
+    a, d = pts[:-1], pts[1:] - pts[:-1]
+
+    # each segment is a + t * d for t in [t0, t1]
+    t0 = np.zeros(len(a))
+    t1 = np.ones(len(a))
+    for axis, lo, hi in ((0, box[0], box[2]), (1, box[1], box[3])):
+        p, q = d[:, axis], a[:, axis]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_lo, t_hi = (lo - q) / p, (hi - q) / p
+        parallel = p == 0
+        t0 = np.where(parallel, t0, np.maximum(t0, np.where(p > 0, t_lo, t_hi)))
+        t1 = np.where(parallel, t1, np.minimum(t1, np.where(p > 0, t_hi, t_lo)))
+        # segments parallel to this axis' bounds and outside them are gone
+        t1[parallel & ((q < lo) | (q > hi))] = -1.0
+    visible = np.flatnonzero(t0 <= t1)
+    if len(visible) == 0:
+        return []
+    starts = a[visible] + t0[visible, None] * d[visible]
+    ends = a[visible] + t1[visible, None] * d[visible]
+
+    # a new piece starts wherever a segment doesn't pick up exactly where the
+    # previous visible one left off
+    new_piece = np.ones(len(visible), dtype=bool)
+    new_piece[1:] = (
+        (visible[1:] != visible[:-1] + 1) | (t0[visible[1:]] > 0) | (t1[visible[:-1]] < 1))
+    bounds = np.append(np.flatnonzero(new_piece), len(visible)).tolist()
+    return [
+        np.concatenate([starts[lo:lo + 1], ends[lo:hi]])
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def test_clip() -> None:
+    box = (0.0, 0.0, 10.0, 10.0)
+    # a square half in the box
+    assert clip_polygon([(-5, 2), (5, 2), (5, 8), (-5, 8)], box).tolist() == [
+        [0, 2], [5, 2], [5, 8], [0, 8]]
+    # entirely inside / outside
+    tri = [(1, 1), (9, 1), (5, 9)]
+    assert clip_polygon(tri, box).tolist() == [list(p) for p in tri]
+    assert len(clip_polygon([(20, 20), (30, 20), (25, 30)], box)) == 0
+    # a box inside a polygon comes out as the box
+    clipped = clip_polygon([(-1, -1), (11, -1), (11, 11), (-1, 11)], box)
+    assert sorted(map(tuple, clipped.tolist())) == [(0, 0), (0, 10), (10, 0), (10, 10)]
+
+    # a line that leaves and comes back is two pieces
+    pieces = clip_polyline([(-5, 5), (5, 5), (5, 15), (8, 15), (8, 5)], box)
+    assert [p.tolist() for p in pieces] == [[[0, 5], [5, 5], [5, 10]], [[8, 10], [8, 5]]]
+    # a segment through the whole box, and one along its edge outside
+    assert [p.tolist() for p in clip_polyline([(-1, 3), (11, 3)], box)] == [[[0, 3], [10, 3]]]
+    assert clip_polyline([(-1, -1), (11, -1)], box) == []
 
 
 def main() -> None:
@@ -71,8 +328,8 @@ def main() -> None:
         (100, 50),
         (50, 75),
     ]
-    display_raster(brute_force_raster(triangle, 101))
-    display_raster(brute_force_raster(cmplx, 101))
+    display_raster(raster_to_str(scanline_raster(triangle, 101)))
+    display_raster(raster_to_str(scanline_raster(cmplx, 101)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,224 @@
+"""
+Renders chunk geometry to images with NumPy, in the style of the Processing
+sketch in src/processing/chunkrender (same colors, fills, stroke weights and
+draw order). That lets datasets be made headless, in the same process that
+extracts the geometry.
+
+Differences from the sketch:
+    * no anti-aliasing: a pixel is either painted or not
+    * outlines always use their category's weight. (Processing carries
+      strokeWeight over from whatever was drawn last, so outline widths there
+      depend on draw history.)
+"""
+
+# imports
+# ---
+
+# builtins
+import io
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 3rd party
+import numpy as np
+from PIL import Image
+
+# local
+import polygon
+from polygon import DiscretePoly
+
+
+# settings
+# ---
+
+Color = Tuple[int, int, int]
+
+BACKGROUND = (240, 240, 240)  # type: Color
+
+# category -> (fill, stroke, stroke weight). None means no fill / no stroke.
+STYLES = {
+    'building': ((178, 24, 43), None, 0),
+    'park': ((153, 213, 148), (153, 213, 148), 1),
+    'walkarea': ((200, 200, 200), (200, 200, 200), 1),
+    'highway': (None, (254, 224, 139), 4),
+    'footpath': (None, (200, 200, 200), 2),
+    'water': ((50, 136, 189), (50, 136, 189), 1),
+}  # type: Dict[str, Tuple[Optional[Color], Optional[Color], int]]
+
+# categories drawn as lines (no fill); the rest are areas
+LINE_CATEGORIES = frozenset(cat for cat, (fill, _, _) in STYLES.items() if fill is None)
+
+# non-building categories, in draw order (e.g., so water doesn't get drawn on
+# top of piers). buildings are drawn last.
+REST_ORDER = ['water', 'park', 'highway', 'walkarea', 'footpath']
+
+# max number of candidate pixels to test at once when stroking
+BATCH_ELEMENTS = 1 << 22
+
+
+# code
+# ---
+
+def fill_mask(polys: Sequence[DiscretePoly], width: int, height: int) -> np.ndarray:
+    """Returns the (height, width) bool mask, indexed [y, x], of pixels whose
+    centers are inside any of `polys`. Each polygon is only scanned over its
+    own bounding box."""
+    mask = np.zeros((height, width), dtype=bool)
+    for poly in polys:
+        pts = np.asarray(poly, dtype=np.float64).reshape(-1, 2)
+        if len(pts) < 3:
+            continue
+        x0, y0 = np.maximum(np.floor(pts.min(axis=0)).astype(np.int64), 0)
+        x1 = min(int(np.ceil(pts[:, 0].max())) + 1, width)
+        y1 = min(int(np.ceil(pts[:, 1].max())) + 1, height)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        # pixel (x, y)'s center is (x + .5, y + .5)
+        local = pts - (x0 + 0.5, y0 + 0.5)
+        mask[y0:y1, x0:x1] |= polygon.scanline_fill(local, x1 - x0, y1 - y0)
+    return mask
+
+
+def _segments(lines: Sequence[DiscretePoly], closed: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns (starts, ends), each (n, 2), of all segments in `lines`."""
+    starts, ends = [], []  # type: List[np.ndarray], List[np.ndarray]
+    for line in lines:
+        pts = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+        if len(pts) < 2:
+            continue
+        starts.append(pts[:-1])
+        ends.append(pts[1:])
+        if closed:
+            starts.append(pts[-1:])
+            ends.append(pts[:1])
+    if len(starts) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 2))
+    return np.concatenate(starts), np.concatenate(ends)
+
+
+def stroke_mask(
+        lines: Sequence[DiscretePoly], weight: int, width: int, height: int,
+        closed: bool = False) -> np.ndarray:
+    """Returns the (height, width) bool mask, indexed [y, x], of pixels covered
+    by stroking `lines` with a `weight`-wide round-capped pen (i.e., the union
+    of a capsule around every segment).
+
+    Odd widths are sampled at pixel corners and even ones at pixel centers,
+    so an axis-aligned line along integer coordinates comes out exactly
+    `weight` pixels wide.
+    """
+    mask = np.zeros((height, width), dtype=bool)
+    a, b = _segments(lines, closed)
+    if len(a) == 0 or weight <= 0:
+        return mask
+    r = weight / 2
+    offset = 0.5 if weight % 2 == 0 else 0.0
+
+    # candidate pixels: each segment's bounding box, grown by r
+    lo = np.minimum(a, b) - r - offset
+    hi = np.maximum(a, b) + r - offset
+    x0 = np.clip(np.ceil(lo[:, 0]), 0, width).astype(np.int64)
+    y0 = np.clip(np.ceil(lo[:, 1]), 0, height).astype(np.int64)
+    nx = np.maximum(np.clip(np.floor(hi[:, 0]) + 1, 0, width).astype(np.int64) - x0, 0)
+    ny = np.maximum(np.clip(np.floor(hi[:, 1]) + 1, 0, height).astype(np.int64) - y0, 0)
+    counts = nx * ny
+
+    # test segments in batches of roughly BATCH_ELEMENTS candidates
+    cum = np.cumsum(counts)
+    batch_ends = np.searchsorted(cum, np.arange(BATCH_ELEMENTS, cum[-1], BATCH_ELEMENTS), side='right')
+    bounds = [0] + sorted(set(batch_ends.tolist())) + [len(a)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        if end <= start:
+            continue
+        c = counts[start:end]
+        seg = np.repeat(np.arange(start, end), c)
+        local = np.arange(len(seg)) - np.repeat(np.cumsum(c) - c, c)
+        px = x0[seg] + local % nx[seg]
+        py = y0[seg] + local // nx[seg]
+
+        # distance from each sample point to its segment
+        sa, sd = a[seg], b[seg] - a[seg]
+        qx, qy = px + offset - sa[:, 0], py + offset - sa[:, 1]
+        len2 = (sd * sd).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(len2 > 0, (qx * sd[:, 0] + qy * sd[:, 1]) / len2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        dx, dy = qx - t * sd[:, 0], qy - t * sd[:, 1]
+        hit = dx * dx + dy * dy <= r * r
+        mask[py[hit], px[hit]] = True
+    return mask
+
+
+def draw(img: np.ndarray, category: str, shapes: Sequence[DiscretePoly]) -> None:
+    """Draws `shapes` of `category` onto `img` (height, width, 3) in place,
+    each filled and then stroked per STYLES."""
+    fill, stroke, weight = STYLES[category]
+    height, width = img.shape[:2]
+
+    # when fill and stroke are the same color (or there's only one of them),
+    # draw order within the category doesn't matter, so do them all at once.
+    if fill is None or stroke is None or fill == stroke:
+        batches = [shapes]
+    else:
+        batches = [[shape] for shape in shapes]
+    for batch in batches:
+        if fill is not None:
+            img[fill_mask(batch, width, height)] = fill
+        if stroke is not None and weight > 0:
+            img[stroke_mask(batch, weight, width, height, closed=fill is not None)] = stroke
+
+
+def render_chunk(
+        geometry: Dict[str, List[DiscretePoly]], res: Tuple[int, int],
+        buildings: bool = True) -> np.ndarray:
+    """Renders one chunk's pixel geometry (category -> shapes) to a (height,
+    width, 3) uint8 RGB image. Without `buildings`, that's the A image;
+    with, the B image."""
+    width, height = res
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = BACKGROUND
+    order = REST_ORDER + (['building'] if buildings else [])
+    for category in order:
+        draw(img, category, geometry.get(category, []))
+    return img
+
+
+def png_bytes(img: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def save_png(img: np.ndarray, path: str) -> None:
+    Image.fromarray(img).save(path)
+
+
+def test_stroke_widths() -> None:
+    """Axis-aligned strokes come out exactly as wide as their weight."""
+    for weight in range(1, 6):
+        mask = stroke_mask([[(5, 10), (15, 10)]], weight, 20, 20)
+        assert mask[:, 10].sum() == weight, (weight, mask[:, 10].sum())
+        mask = stroke_mask([[(10, 5), (10, 15)]], weight, 20, 20)
+        assert mask[10, :].sum() == weight, (weight, mask[10, :].sum())
+
+
+def test_fill() -> None:
+    """A w x h rectangle covers exactly w x h pixels."""
+    mask = fill_mask([[(2, 3), (9, 3), (9, 7), (2, 7)]], 20, 20)
+    assert mask.sum() == 7 * 4 and mask[3:7, 2:9].all()
+
+
+def main() -> None:
+    test_stroke_widths()
+    test_fill()
+    geometry = {
+        'water': [[(0, 0), (60, 0), (60, 30), (0, 30)]],
+        'park': [[(70, 60), (95, 60), (95, 95), (70, 95)]],
+        'highway': [[(0, 50), (99, 50)], [(50, 0), (50, 99)]],
+        'footpath': [[(10, 90), (60, 60)]],
+        'building': [[(10, 60), (30, 60), (30, 80), (10, 80)]],
+    }  # type: Dict[str, List[DiscretePoly]]
+    save_png(render_chunk(geometry, (100, 100)), 'data/render-test.png')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""
+Vertex simplification for pixel geometry.
+
+At chunk resolutions, lots of consecutive OSM vertices land on the same
+pixel or sit nearly on a line. Simplifying removes them before they're
+written out and drawn:
+    1. consecutive duplicate points are dropped
+    2. Douglas-Peucker, with a tolerance in pixels: a point is dropped if it's
+       within `tolerance` of the simplified line around it. (0 drops only
+       exactly collinear points.)
+
+Everything runs over a whole geo.Ragged at once: each round of
+Douglas-Peucker splits every open span of every shape in one NumPy pass.
+
+Simplification never removes a shape, and a polygon with 3+ distinct points
+keeps at least 3.
+
+Usage (reports how much each category would shrink):
+    python simplify.py data/chunks/osm/seattle-1*.osm --tolerance 0.5
+"""
+
+# imports
+# ---
+
+# builtins
+import argparse
+from typing import Dict, List, Tuple
+
+# 3rd party
+import numpy as np
+from tqdm import tqdm
+
+# local
+import geo
+
+
+# code
+# ---
+
+def _shape_ids(ragged: geo.Ragged) -> np.ndarray:
+    """Which shape each point belongs to."""
+    return np.repeat(np.arange(len(ragged)), np.diff(ragged.offsets))
+
+
+def compress(ragged: geo.Ragged, keep: np.ndarray) -> geo.Ragged:
+    """Returns `ragged` with only the points where `keep` (N,) is set."""
+    counts = np.bincount(_shape_ids(ragged)[keep], minlength=len(ragged))
+    offsets = np.zeros(len(ragged) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+    return geo.Ragged(ragged.coords[keep], offsets)
+
+
+def dedupe(ragged: geo.Ragged) -> geo.Ragged:
+    """Drops points equal to the point before them (in the same shape)."""
+    coords = ragged.coords
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+    starts = ragged.offsets[:-1][np.diff(ragged.offsets) > 0]
+    keep[starts] = True
+    return compress(ragged, keep)
+
+
+def _segment_dists(pts: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distances from each of `pts` to segment (a, b) (all (n, 2))."""
+    ab, ap = b - a, pts - a
+    len2 = (ab * ab).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(len2 > 0, (ap * ab).sum(axis=1) / len2, 0.0)
+    d = ap - np.clip(t, 0.0, 1.0)[:, None] * ab
+    return np.sqrt((d * d).sum(axis=1))
+
+
+def douglas_peucker(ragged: geo.Ragged, tolerance: float) -> np.ndarray:
+    """Returns the (N,) mask of points Douglas-Peucker keeps, over every shape
+    in `ragged` at once. Each shape's first and last points are kept."""
+    coords = ragged.coords.astype(np.float64)
+    keep = np.zeros(len(coords), dtype=bool)
+    nonempty = np.diff(ragged.offsets) > 0
+    s = ragged.offsets[:-1][nonempty]
+    e = ragged.offsets[1:][nonempty] - 1
+    keep[s] = True
+    keep[e] = True
+
+    # (s, e): the spans still to split, by their (kept) end points
+    active = e - s > 1
+    s, e = s[active], e[active]
+    while len(s) > 0:
+        # every interior point of every span
+        n_inner = e - s - 1
+        span_starts = np.cumsum(n_inner) - n_inner
+        span = np.repeat(np.arange(len(s)), n_inner)
+        idx = s[span] + 1 + np.arange(len(span)) - span_starts[span]
+        dists = _segment_dists(coords[idx], coords[s[span]], coords[e[span]])
+
+        # each span's farthest point (the first, on ties)
+        max_dist = np.maximum.reduceat(dists, span_starts)
+        at_max = np.flatnonzero(dists == max_dist[span])
+        _, first = np.unique(span[at_max], return_index=True)
+        farthest = idx[at_max[first]]
+
+        # split spans whose farthest point is out of tolerance there
+        split = max_dist > tolerance
+        k = farthest[split]
+        keep[k] = True
+        s, e = np.concatenate([s[split], k]), np.concatenate([k, e[split]])
+        active = e - s > 1
+        s, e = s[active], e[active]
+    return keep
+
+
+def simplify(ragged: geo.Ragged, tolerance: float, closed: np.ndarray) -> geo.Ragged:
+    """Dedupes and then Douglas-Peucker simplifies every shape in `ragged`.
+    `closed` (one bool per shape) marks polygons, which keep 3+ points if
+    they had them after deduping."""
+    deduped = dedupe(ragged)
+    keep = douglas_peucker(deduped, tolerance)
+
+    # polygons that would collapse stay as they were (deduped)
+    lengths = np.diff(deduped.offsets)
+    kept = np.bincount(_shape_ids(deduped)[keep], minlength=len(deduped))
+    restore = np.asarray(closed, dtype=bool) & (kept < 3) & (lengths >= 3)
+    keep |= restore[_shape_ids(deduped)]
+    return compress(deduped, keep)
+
+
+def count_points(
+        categories: List[str], before: geo.Ragged,
+        after: geo.Ragged) -> Dict[str, Tuple[int, int]]:
+    """Returns category -> (points before, points after) for shapes with
+    `categories`."""
+    codes = {cat: i for i, cat in enumerate(sorted(set(categories)))}
+    cat_idx = np.array([codes[cat] for cat in categories], dtype=np.int64)
+    totals = [
+        np.bincount(cat_idx, np.diff(r.offsets), minlength=len(codes)).astype(np.int64).tolist()
+        for r in (before, after)
+    ]
+    return {cat: (totals[0][i], totals[1][i]) for cat, i in codes.items()}
+
+
+def reduction(counts: Dict[str, Tuple[int, int]]) -> Dict[str, float]:
+    """Turns category -> (points before, points after) into category ->
+    fraction of points removed."""
+    return {cat: 1.0 - after / before if before > 0 else 0.0 for cat, (before, after) in counts.items()}
+
+
+def report(counts: Dict[str, Tuple[int, int]]) -> None:
+    ratios = reduction(counts)
+    print('{:<10} {:>10} {:>10} {:>9}'.format('category', 'before', 'after', 'removed'))
+    for cat in sorted(counts):
+        before, after = counts[cat]
+        print('{:<10} {:>10} {:>10} {:>8.1f}%'.format(cat, before, after, 100 * ratios[cat]))
+
+
+def test_simplify() -> None:
+    # a line with duplicates and a near-collinear point, and a square
+    # polygon that's too small to simplify away
+    shapes = [
+        [(0, 0), (0, 0), (5, 0), (10, 0), (15, 1), (20, 0), (20, 0), (20, 10)],
+        [(0, 0), (1, 0), (1, 1), (0, 1)],
+        [],
+        [(3, 3)],
+    ]  # type: List[List[Tuple[int, int]]]
+    ragged = geo.Ragged.from_lists(shapes, dtype=np.int64)
+    assert dedupe(ragged).tolist()[0] == [(0, 0), (5, 0), (10, 0), (15, 1), (20, 0), (20, 10)]
+    res = simplify(ragged, 1.0, np.array([False, True, False, True])).tolist()
+    assert res == [[(0, 0), (20, 0), (20, 10)], shapes[1], [], [(3, 3)]], res
+    # tolerance 0 drops just exactly collinear points
+    line = geo.Ragged.from_lists([[(0, 0), (5, 0), (10, 0), (10, 5)]], dtype=np.int64)
+    assert simplify(line, 0.0, np.array([False])).tolist() == [[(0, 0), (10, 0), (10, 5)]]
+    # without the polygon rule, the square would lose points
+    assert douglas_peucker(geo.Ragged.from_lists(shapes[1:2]), 1.0).sum() == 2
+    assert count_points(['a', 'b', 'a', 'b'], ragged, dedupe(ragged)) == {'a': (8, 6), 'b': (5, 5)}
+
+
+def main() -> None:
+    # (imported here; chunks_dataset imports this module)
+    import chunks_dataset
+
+    parser = argparse.ArgumentParser(description='Reports how much simplifying shrinks chunks')
+    parser.add_argument('in_paths', type=str, nargs='+', help='.osm files')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='Douglas-Peucker tolerance in pixels')
+    parser.add_argument('--res', type=int, default=500, help='chunk resolution (per side)')
+    args = parser.parse_args()
+
+    totals = {}  # type: Dict[str, Tuple[int, int]]
+    for in_path in tqdm(args.in_paths):
+        categories, geo_ways, geo_bounds = chunks_dataset.extract_ways(in_path)
+        pixel_ways = geo.convert_ragged(geo_bounds, (args.res - 1, args.res - 1), geo_ways, discrete=True)
+        _, counts = chunks_dataset.simplify_ways(categories, pixel_ways, args.tolerance)
+        for cat, (before, after) in counts.items():
+            b, a = totals.get(cat, (0, 0))
+            totals[cat] = (b + before, a + after)
+    report(totals)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Spatial indexes for the pairwise geometry steps (node merging, block
+filtering, ...).
+"""
+
+# imports
+# ---
+
+# builtins
+from math import floor, sqrt
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# local
+from geo import Point
+
+
+# types
+# ---
+
+# minx, miny, maxx, maxy
+Box = Tuple[float, float, float, float]
+
+
+# code
+# ---
+
+def pairs_within(points: List[Point], thresh: float) -> List[Tuple[int, int]]:
+    """Finds all index pairs (i, j), i < j, of `points` whose l2 distance is
+    under `thresh`.
+
+    Points are hashed into a grid of `thresh`-sized cells, so only points in
+    the same or adjacent cells are ever compared. Pairs are returned sorted,
+    i.e., in the same order a doubly nested loop over `points` would find
+    them.
+    """
+    grid = {}  # type: Dict[Tuple[int, int], List[int]]
+    for i, (a, b) in enumerate(points):
+        cell = (int(floor(a / thresh)), int(floor(b / thresh)))
+        if cell not in grid:
+            grid[cell] = []
+        grid[cell].append(i)
+
+    res = []  # type: List[Tuple[int, int]]
+    for (ca, cb), members in grid.items():
+        # compare against our own cell and the four "forward" neighbors so
+        # that each pair of adjacent cells is only visited once.
+        for da, db in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+            if (da, db) == (0, 0):
+                others = members
+            elif (ca + da, cb + db) in grid:
+                others = grid[(ca + da, cb + db)]
+            else:
+                continue
+            for i in members:
+                pa, pb = points[i]
+                for j in others:
+                    if (da, db) == (0, 0) and j <= i:
+                        continue
+                    qa, qb = points[j]
+                    if sqrt((pa - qa)**2 + (pb - qb)**2) < thresh:
+                        res.append((i, j) if i < j else (j, i))
+    res.sort()
+    return res
+
+
+def poly_bbox(poly: Sequence[Tuple[float, float]]) -> Box:
+    """Returns (minx, miny, maxx, maxy) of `poly`'s points."""
+    xs = [p[0] for p in poly]
+    ys = [p[1] for p in poly]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def box_contains(bigger: Box, smaller: Box) -> bool:
+    """Whether `bigger` contains `smaller` (boundaries included)."""
+    return (bigger[0] <= smaller[0] and bigger[1] <= smaller[1] and
+            bigger[2] >= smaller[2] and bigger[3] >= smaller[3])
+
+
+def boxes_intersect(a: Box, b: Box) -> bool:
+    """Whether `a` and `b` overlap (touching counts)."""
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class BBoxIndex(object):
+    """Index over axis-aligned bounding boxes (e.g., of polygons), so pairwise
+    geometry tests only need to run on pairs whose boxes could pass.
+
+    Boxes are bucketed into a uniform grid for point/box queries, and kept
+    sorted by minx for sweeping over all overlapping pairs.
+
+    Any exact test that implies its box test (e.g., polygon A containing
+    polygon B implies A's box contains B's box) gives the same answer run
+    over the candidates from here as over all pairs.
+    """
+
+    def __init__(self, boxes: List[Box], cell_size: Optional[float] = None) -> None:
+        self.boxes = boxes
+
+        # default cell size: the median box side, so typical boxes land in a
+        # handful of cells
+        if cell_size is None:
+            sides = sorted(max(b[2] - b[0], b[3] - b[1]) for b in boxes)
+            cell_size = sides[len(sides) // 2] if len(sides) > 0 else 1.0
+        self.cell_size = cell_size if cell_size > 0 else 1.0
+
+        self.cells = {}  # type: Dict[Tuple[int, int], List[int]]
+        for i, box in enumerate(boxes):
+            x0, y0, x1, y1 = self.cell_range(box)
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    if (cx, cy) not in self.cells:
+                        self.cells[(cx, cy)] = []
+                    self.cells[(cx, cy)].append(i)
+
+        self.by_minx = sorted(range(len(boxes)), key=lambda i: boxes[i][0])
+
+    @classmethod
+    def from_polys(cls, polys: Sequence[Sequence[Tuple[float, float]]],
+                   cell_size: Optional[float] = None) -> 'BBoxIndex':
+        return cls([poly_bbox(poly) for poly in polys], cell_size)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    def cell(self, x: float, y: float) -> Tuple[int, int]:
+        return (int(floor(x / self.cell_size)), int(floor(y / self.cell_size)))
+
+    def cell_range(self, box: Box) -> Tuple[int, int, int, int]:
+        """Returns the (inclusive) range of cells that `box` covers."""
+        x0, y0 = self.cell(box[0], box[1])
+        x1, y1 = self.cell(box[2], box[3])
+        return x0, y0, x1, y1
+
+    def query(self, box: Box) -> List[int]:
+        """Returns (sorted) indices of boxes that intersect `box`."""
+        x0, y0, x1, y1 = self.cell_range(box)
+        found = set()
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                found.update(self.cells.get((cx, cy), []))
+        return sorted(i for i in found if boxes_intersect(self.boxes[i], box))
+
+    def containing(self, box: Box) -> List[int]:
+        """Returns (sorted) indices of boxes that contain `box`. Any such box
+        also covers `box`'s min corner, so only that one cell is checked."""
+        candidates = self.cells.get(self.cell(box[0], box[1]), [])
+        return sorted(i for i in candidates if box_contains(self.boxes[i], box))
+
+    def overlapping_pairs(self) -> List[Tuple[int, int]]:
+        """Returns all (sorted) pairs (i, j), i < j, of intersecting boxes, by
+        sweeping over boxes in order of minx."""
+        boxes, order = self.boxes, self.by_minx
+        res = []  # type: List[Tuple[int, int]]
+        for n in range(len(order)):
+            i = order[n]
+            box_i = boxes[i]
+            for m in range(n + 1, len(order)):
+                j = order[m]
+                box_j = boxes[j]
+                if box_j[0] > box_i[2]:
+                    break
+                if box_j[1] <= box_i[3] and box_i[1] <= box_j[3]:
+                    res.append((i, j) if i < j else (j, i))
+        res.sort()
+        return res
+
+    def nested_pairs(self) -> List[Tuple[int, int]]:
+        """Returns all (sorted) pairs (i, j), i < j, where one box contains
+        the other."""
+        boxes = self.boxes
+        return [
+            (i, j) for i, j in self.overlapping_pairs()
+            if box_contains(boxes[i], boxes[j]) or box_contains(boxes[j], boxes[i])
+        ]
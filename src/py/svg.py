@@ -1,11 +1,36 @@
+"""
+Writes SVG (wrapped in a bare HTML page) for debugging, streaming each
+element straight to the file as it goes rather than building the whole
+document in memory.
+
+Coordinates are rounded to `precision` decimal places (full float reprs are
+most of the bytes otherwise). With `lod` (level of detail) on, geometry
+smaller than `min_size` pixels is dropped, and points of a shape that fall in
+the same `min_size` cell as the point before them are dropped too, so big
+regions come out at roughly one point per pixel.
+
+    with svg.Writer(path, (800, 600), lod=True) as w:
+        with w.group('road', svg.line_style('yellow', 5)):
+            w.polylines(roads)
+        w.circles(points, style=svg.circle_style())
+"""
+
 # imports
 # ---
 
 # builtins
-from typing import List, Tuple, Set, Dict, Union
+from collections import Counter
+import contextlib
+import os
+import tempfile
+from typing import Iterable, Iterator, Optional, Sequence, Tuple
+from xml.sax.saxutils import quoteattr
+
+# 3rd party
+import numpy as np
 
 # local
-from geo import Point, Line, Polyline, Polygon
+from geo import Point
 
 
 # code
@@ -20,43 +45,150 @@ def footer() -> str:
     return '\n</svg>\n\n</body>\n</html>'
 
 
-def polygons(polygons: List[Polygon], color: str = '#ef8a62') -> str:
-    els = []
-    for polygon in polygons:
-        points = ' '.join(','.join(str(coord) for coord in point) for point in polygon)
-        els.append(
-            '<polygon points="{}" style="fill:{};stroke:black;stroke-width:1" fill-opacity="0.4"/>'.format(
-                points,
-                color,
-            )
-        )
-    return '\n'.join(els)
+def polygon_style(color: str = '#ef8a62') -> str:
+    return 'fill:{};stroke:black;stroke-width:1;fill-opacity:0.4'.format(color)
 
 
-def lines(lines: Union[List[Polyline], List[Line]], color: str = '#b2df8a', line_width: int = 3) -> str:
-    """
-    Note: This works for lists of either lines or polylines (i.e., it doesn't
-    care how many points are in the line).
+def line_style(color: str = '#b2df8a', line_width: int = 3) -> str:
+    return 'fill:none;stroke:{};stroke-width:{}'.format(color, line_width)
+
+
+def circle_style(color: str = '#1f78b4') -> str:
+    return 'fill:{};stroke:black'.format(color)
+
+
+def format_points(pts: np.ndarray, precision: Optional[int]) -> str:
+    """Formats (n, 2) points as 'x,y x,y ...', rounded to `precision` decimal
+    places (None: full float repr)."""
+    if precision is None:
+        vals = pts.tolist()
+    elif precision <= 0:
+        vals = np.round(pts, precision).astype(np.int64).tolist()
+    else:
+        # (+ 0.0 turns -0.0 into 0.0)
+        vals = (np.round(pts, precision) + 0.0).tolist()
+    return ' '.join('{},{}'.format(x, y) for x, y in vals)
+
+
+class Writer(object):
+    """Streams SVG elements to `path`. Use as a context manager (or call
+    close()) so the document gets finished.
+
+    `counts` tracks elements written and dropped, and points dropped, by
+    level of detail.
     """
-    els = []  # type: List[str]
-    for line in lines:
-        points = ' '.join(','.join(str(coord) for coord in point) for point in line)
-        els.append(
-            '<polyline points="{}" style="fill:none;stroke:{};stroke-width:{}" />'.format(
-                points,
-                color,
-                line_width,
-            )
-        )
-    return '\n'.join(els)
-
-
-def circles(points: List[Point], color: str = '#1f78b4', r: int = 3) -> str:
-    els = []  # type: List[str]
-    for x, y in points:
-        els.append(
-            '<circle cx="{}" cy="{}" r="{}" fill="{}" stroke="black" />'.format(
-                x, y, r, color
-            )
-        )
-    return '\n'.join(els)
+
+    def __init__(
+            self, path: str, pixel_bounds: Tuple[int, int],
+            precision: Optional[int] = 1, lod: bool = False,
+            min_size: float = 1.0) -> None:
+        self.precision = precision
+        self.lod = lod
+        self.min_size = min_size
+        self.counts = Counter()  # type: Counter
+        self.f = open(path, 'w')
+        self.f.write(header(pixel_bounds))
+
+    def __enter__(self) -> 'Writer':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.f.closed:
+            return
+        self.f.write(footer())
+        self.f.close()
+
+    @contextlib.contextmanager
+    def group(self, cls: str, style: Optional[str] = None) -> Iterator[None]:
+        """Wraps elements written inside in a <g>, so a style shared by all of
+        them is written once."""
+        self.f.write('<g{}>\n'.format(self._attrs(cls, style)))
+        try:
+            yield
+        finally:
+            self.f.write('</g>\n')
+
+    def polygons(
+            self, polygons: Iterable[Sequence[Point]], style: Optional[str] = None,
+            cls: Optional[str] = None) -> None:
+        attrs = self._attrs(cls, style)
+        for polygon in polygons:
+            points = self._points(polygon, 3)
+            if points is not None:
+                self.f.write('<polygon points="{}"{}/>\n'.format(points, attrs))
+
+    def polylines(
+            self, lines: Iterable[Sequence[Point]], style: Optional[str] = None,
+            cls: Optional[str] = None) -> None:
+        """Note: This works for lines or polylines (i.e., it doesn't care how
+        many points are in the line)."""
+        attrs = self._attrs(cls, style)
+        for line in lines:
+            points = self._points(line, 2)
+            if points is not None:
+                self.f.write('<polyline points="{}"{}/>\n'.format(points, attrs))
+
+    def circles(
+            self, points: Sequence[Point], r: int = 3, style: Optional[str] = None,
+            cls: Optional[str] = None) -> None:
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.lod and len(pts) > 0:
+            # one circle per cell is plenty
+            _, first = np.unique(np.floor(pts / self.min_size), axis=0, return_index=True)
+            self.counts['dropped'] += len(pts) - len(first)
+            pts = pts[np.sort(first)]
+        attrs = self._attrs(cls, style)
+        for xy in format_points(pts, self.precision).split():
+            x, y = xy.split(',')
+            self.f.write('<circle cx="{}" cy="{}" r="{}"{}/>\n'.format(x, y, r, attrs))
+        self.counts['written'] += len(pts)
+
+    def _attrs(self, cls: Optional[str], style: Optional[str]) -> str:
+        res = ''
+        if cls is not None:
+            res += ' class={}'.format(quoteattr(cls))
+        if style is not None:
+            res += ' style={}'.format(quoteattr(style))
+        return res
+
+    def _points(self, shape: Sequence[Point], min_points: int) -> Optional[str]:
+        """Formats a shape's points, or returns None if level of detail drops
+        it. Shapes with under `min_points` points left are dropped."""
+        pts = np.asarray(shape, dtype=np.float64).reshape(-1, 2)
+        if self.lod and len(pts) > 0:
+            if (pts.max(axis=0) - pts.min(axis=0)).max() < self.min_size:
+                self.counts['dropped'] += 1
+                return None
+            # keep points that move to a new cell (and always the last one)
+            cells = np.floor(pts / self.min_size)
+            keep = np.ones(len(pts), dtype=bool)
+            keep[1:-1] = np.any(cells[1:-1] != cells[:-2], axis=1)
+            self.counts['points_dropped'] += len(pts) - int(keep.sum())
+            pts = pts[keep]
+            if len(pts) < min_points:
+                self.counts['dropped'] += 1
+                return None
+        self.counts['written'] += 1
+        return format_points(pts, self.precision)
+
+
+def test_writer() -> None:
+    path = os.path.join(tempfile.mkdtemp(), 'test.html')
+    with Writer(path, (100, 100), precision=1, lod=True) as w:
+        with w.group('a', polygon_style()):
+            w.polygons([
+                [(0.0, 0.0), (10.04, 0.0), (10.0, 10.0)],
+                [(5.0, 5.0), (5.2, 5.1), (5.1, 5.3)],  # sub-pixel
+            ])
+        w.polylines([[(0.0, 0.0), (0.1, 0.1), (0.2, 0.2), (5.56, -0.01)]], line_style())
+        w.circles([(1.0, 1.0), (1.2, 1.3), (50.0, 50.0)], style=circle_style())
+    with open(path) as f:
+        out = f.read()
+    assert '<polygon points="0.0,0.0 10.0,0.0 10.0,10.0"/>' in out
+    assert '<polyline points="0.0,0.0 5.6,0.0" style=' in out
+    assert out.count('<polygon') == 1 and out.count('<circle') == 2
+    assert w.counts == Counter({'written': 4, 'dropped': 2, 'points_dropped': 2})
+    assert out.endswith(footer())
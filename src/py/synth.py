@@ -0,0 +1,228 @@
+"""
+Generates synthetic .osm files: a jittered street grid with blocks full of
+buildings, parks, water, etc. Useful for benchmarks (see bench.py) and for
+testing without real map extracts.
+
+Everything is controlled by arguments (grid size and spacing, buildings per
+block, how blocks are used, ...) and a seed, so the same call always writes
+the same file.
+"""
+
+# imports
+# ---
+
+# builtins
+import argparse
+import math
+import random
+from typing import Dict, List, Tuple
+from xml.sax.saxutils import quoteattr
+
+
+# settings
+# ---
+
+# what each block is used for, by probability. (the rest are left empty.)
+DEFAULT_TAG_MIX = {
+    'building': 0.6,
+    'park': 0.15,
+    'water': 0.05,
+    'walkarea': 0.05,
+    'footpath': 0.1,
+}
+
+# tags for each use. these are what osm.get_category() looks for.
+USE_TAGS = {
+    'building': [('building', 'yes')],
+    'park': [('leisure', 'park'), ('landuse', 'meadow')],
+    'water': [('natural', 'water'), ('water', 'pond')],
+    'walkarea': [('man_made', 'pier')],
+    'footpath': [('highway', 'footway')],
+}
+
+Tags = List[Tuple[str, str]]
+
+
+# code
+# ---
+
+class OSMWriter(object):
+    """Collects nodes and ways, then writes them out as .osm XML."""
+
+    def __init__(self) -> None:
+        self.nodes = []  # type: List[Tuple[int, float, float, Tags]]
+        self.ways = []  # type: List[Tuple[int, List[int], Tags]]
+
+    def node(self, lat: float, lon: float, tags: Tags = []) -> int:
+        node_id = len(self.nodes) + 1
+        self.nodes.append((node_id, lat, lon, tags))
+        return node_id
+
+    def way(self, refs: List[int], tags: Tags) -> int:
+        way_id = len(self.ways) + 1
+        self.ways.append((way_id, refs, tags))
+        return way_id
+
+    def write(self, path: str, bounds: Tuple[float, float, float, float]) -> None:
+        """Writes to `path`. `bounds` is (minlat, minlon, maxlat, maxlon)."""
+        with open(path, 'w') as f:
+            f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+            f.write('<osm version="0.6" generator="mapgen-synth">\n')
+            f.write(' <bounds minlat="{:.7f}" minlon="{:.7f}" maxlat="{:.7f}" maxlon="{:.7f}"/>\n'.format(*bounds))
+            for node_id, lat, lon, tags in self.nodes:
+                attrs = 'id="{}" visible="true" version="1" lat="{:.7f}" lon="{:.7f}"'.format(node_id, lat, lon)
+                if len(tags) == 0:
+                    f.write(' <node {}/>\n'.format(attrs))
+                    continue
+                f.write(' <node {}>\n'.format(attrs))
+                for k, v in tags:
+                    f.write('  <tag k={} v={}/>\n'.format(quoteattr(k), quoteattr(v)))
+                f.write(' </node>\n')
+            for way_id, refs, tags in self.ways:
+                f.write(' <way id="{}" visible="true" version="1">\n'.format(way_id))
+                for ref in refs:
+                    f.write('  <nd ref="{}"/>\n'.format(ref))
+                for k, v in tags:
+                    f.write('  <tag k={} v={}/>\n'.format(quoteattr(k), quoteattr(v)))
+                f.write(' </way>\n')
+            f.write('</osm>\n')
+
+
+def pick_use(rng: random.Random, tag_mix: Dict[str, float]) -> str:
+    """Picks a block use from `tag_mix` ('' for none)."""
+    r = rng.random()
+    for use, p in sorted(tag_mix.items()):
+        if r < p:
+            return use
+        r -= p
+    return ''
+
+
+def generate(
+        path: str, grid: int = 16, spacing: float = 0.001,
+        jitter: float = 1e-5, shape_nodes: int = 0, dup_frac: float = 0.2,
+        dead_end_frac: float = 0.05, buildings_per_block: int = 1,
+        tag_mix: Dict[str, float] = DEFAULT_TAG_MIX, poi_frac: float = 1.0,
+        seed: int = 0, origin: Tuple[float, float] = (47.6, -122.3)) -> Dict[str, int]:
+    """
+    Writes a synthetic .osm file to `path` and returns counts of what's in
+    it.
+
+    Roads form a `grid` x `grid` lattice of intersections `spacing` degrees
+    apart, each nudged by up to `jitter`. Each road segment gets
+    `shape_nodes` extra nodes along it. At `dup_frac` of intersections, the
+    crossing road uses its own node, a hair away (so graph.build() has nodes
+    to merge). `dead_end_frac` of intersections get a dead-end spur.
+
+    Each of the (grid - 1)^2 blocks gets a use drawn from `tag_mix`;
+    building blocks get `buildings_per_block` rectangular buildings. There
+    are also `poi_frac` * grid^2 tagged point nodes (which nothing uses, as
+    in real extracts).
+    """
+    rng = random.Random(seed)
+    w = OSMWriter()
+    lat0, lon0 = origin
+    counts = {'roads': 0, 'buildings': 0}  # type: Dict[str, int]
+
+    def j() -> float:
+        return rng.uniform(-jitter, jitter)
+
+    # intersections
+    inter = {}  # type: Dict[Tuple[int, int], int]
+    dups = {}  # type: Dict[Tuple[int, int], int]
+    coords = {}  # type: Dict[Tuple[int, int], Tuple[float, float]]
+    for r in range(grid):
+        for c in range(grid):
+            lat, lon = lat0 + r * spacing + j(), lon0 + c * spacing + j()
+            coords[(r, c)] = (lat, lon)
+            inter[(r, c)] = w.node(lat, lon)
+            if rng.random() < dup_frac:
+                dups[(r, c)] = w.node(lat + spacing * 0.02, lon + spacing * 0.01)
+
+    def road(keys: List[Tuple[int, int]], use_dups: bool, tags: Tags) -> None:
+        refs = []  # type: List[int]
+        for n, key in enumerate(keys):
+            if n > 0 and shape_nodes > 0:
+                (la0, lo0), (la1, lo1) = coords[keys[n - 1]], coords[key]
+                for s in range(1, shape_nodes + 1):
+                    t = s / (shape_nodes + 1)
+                    refs.append(w.node(la0 + (la1 - la0) * t + j(), lo0 + (lo1 - lo0) * t + j()))
+            refs.append(dups[key] if use_dups and key in dups else inter[key])
+        w.way(refs, tags)
+        counts['roads'] += 1
+
+    # roads: east-west streets, north-south avenues (which use the dups)
+    for r in range(grid):
+        road([(r, c) for c in range(grid)], False, [('highway', 'residential'), ('name', 'Street {}'.format(r))])
+    for c in range(grid):
+        road([(r, c) for r in range(grid)], True, [('highway', 'residential'), ('name', 'Avenue {}'.format(c))])
+    for key in sorted(coords):
+        if rng.random() < dead_end_frac:
+            lat, lon = coords[key]
+            spur = w.node(lat - spacing * 0.3, lon + spacing * 0.3)
+            w.way([inter[key], spur], [('highway', 'service')])
+            counts['roads'] += 1
+
+    # blocks
+    per_side = int(math.ceil(math.sqrt(max(buildings_per_block, 1))))
+    for r in range(grid - 1):
+        for c in range(grid - 1):
+            use = pick_use(rng, tag_mix)
+            key = '{}_blocks'.format(use or 'empty')
+            counts[key] = counts.get(key, 0) + 1
+            la, lo = lat0 + r * spacing, lon0 + c * spacing
+            if use == 'building':
+                # a per_side x per_side lattice of lots, buildings in the first few
+                lot = spacing * 0.8 / per_side
+                for b in range(buildings_per_block):
+                    bla = la + spacing * 0.1 + (b // per_side) * lot + lot * 0.1
+                    blo = lo + spacing * 0.1 + (b % per_side) * lot + lot * 0.1
+                    pts = [(bla, blo), (bla + lot * 0.7, blo), (bla + lot * 0.7, blo + lot * 0.8), (bla, blo + lot * 0.8)]
+                    refs = [w.node(p[0], p[1]) for p in pts]
+                    w.way(refs + refs[:1], USE_TAGS['building'])
+                    counts['buildings'] += 1
+            elif use == 'footpath':
+                # diagonal path across the block
+                refs = [w.node(la + spacing * t, lo + spacing * t) for t in (0.15, 0.5, 0.85)]
+                w.way(refs, USE_TAGS['footpath'])
+            elif use != '':
+                # an irregular area filling most of the block
+                pts = [(0.1, 0.1), (0.9, 0.15), (0.85, 0.9), (0.5, 0.8), (0.15, 0.85)]
+                refs = [w.node(la + spacing * a + j(), lo + spacing * b + j()) for a, b in pts]
+                w.way(refs + refs[:1], USE_TAGS[use])
+
+    # points of interest
+    for k in range(int(poi_frac * grid * grid)):
+        w.node(
+            lat0 + rng.random() * (grid - 1) * spacing, lon0 + rng.random() * (grid - 1) * spacing,
+            [('addr:street', 'Street {}'.format(rng.randrange(grid))), ('addr:housenumber', str(k))])
+
+    margin = spacing * 0.5
+    w.write(path, (
+        lat0 - margin, lon0 - margin,
+        lat0 + (grid - 1) * spacing + margin, lon0 + (grid - 1) * spacing + margin))
+    counts['nodes'] = len(w.nodes)
+    counts['ways'] = len(w.ways)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Writes a synthetic .osm file')
+    parser.add_argument('out_path', type=str, help='where to write the .osm file')
+    parser.add_argument('--grid', type=int, default=16, help='intersections per side')
+    parser.add_argument('--spacing', type=float, default=0.001, help='degrees between intersections')
+    parser.add_argument('--shape-nodes', type=int, default=0, help='extra nodes along each road segment')
+    parser.add_argument('--buildings-per-block', type=int, default=1, help='buildings in each building block')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    counts = generate(
+        args.out_path, grid=args.grid, spacing=args.spacing,
+        shape_nodes=args.shape_nodes,
+        buildings_per_block=args.buildings_per_block, seed=args.seed)
+    print('Wrote "{}": {}'.format(args.out_path, ', '.join(
+        '{} {}'.format(v, k) for k, v in sorted(counts.items()))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Cuts one big local .osm extract into training chunks, instead of
+downloading every chunk from Overpass (get_chunks.py) and parsing each one
+separately (chunks_dataset.py). Neighboring chunks share lots of ways, so
+this does one parse where that did thousands of downloads and parses, and
+it runs offline.
+
+The extract is parsed once (and cached, see osm.preproc()), and the
+bounding box of every way we consider goes into a spatial index. Then, for
+each window (the same windows get_chunks.py downloads, numbered the same),
+the ways that touch it are clipped to it and go through the same code
+chunks_dataset.py runs on a downloaded chunk.
+
+One difference from downloaded chunks: Overpass sends whole ways (any way
+with a node in the window), which run off the chunk's edges. Here, ways are
+clipped to the window (polygons with Sutherland-Hodgman, lines with
+Liang-Barsky; see polygon.py). A way that crosses a window without having
+a node in it counts too.
+
+Usage:
+    python tiler.py data/seattle.osm seattle
+"""
+
+# imports
+# ---
+
+# builtins
+import argparse
+import os
+from typing import List, Optional, Tuple
+
+# 3rd party
+import numpy as np
+from tqdm import tqdm
+
+# local
+import chunks_dataset
+from chunks_dataset import FORMATS
+import geo
+from get_chunks import Window, chunk_windows
+import osm
+import polygon
+import render
+import spatial
+import tracing
+
+
+# code
+# ---
+
+class Tiler(object):
+    """The considered ways of one extract, in geo (lat, lon) coords, with a
+    spatial index over their bounding boxes.
+
+    `cell_size` (in degrees) is the index's grid size; about a window's size
+    works well.
+    """
+
+    def __init__(
+            self, node_map: osm.NodeStore, ways: List[osm.Way],
+            cell_size: Optional[float] = None) -> None:
+        categories, refs = chunks_dataset.select_ways(ways)
+        keep = [i for i, r in enumerate(refs) if len(r) > 0]
+        self.categories = [categories[i] for i in keep]
+        self.geo_ways = osm.gather_ways(node_map, [refs[i] for i in keep])
+
+        # boxes are (minlat, minlon, maxlat, maxlon), like geo bounds
+        self.boxes = []  # type: List[spatial.Box]
+        if len(self.categories) > 0:
+            starts = self.geo_ways.offsets[:-1]
+            mins = np.minimum.reduceat(self.geo_ways.coords, starts)
+            maxes = np.maximum.reduceat(self.geo_ways.coords, starts)
+            self.boxes = [tuple(box) for box in np.hstack([mins, maxes]).tolist()]
+        self.index = spatial.BBoxIndex(self.boxes, cell_size)
+
+    def clip(self, geo_bounds: Tuple[float, float, float, float]) -> Tuple[List[str], geo.Ragged]:
+        """Returns the categories and geo coords of all ways (or pieces of
+        ways) inside `geo_bounds` (minlat, minlon, maxlat, maxlon)."""
+        categories = []  # type: List[str]
+        pieces = []  # type: List[np.ndarray]
+        for i in self.index.query(geo_bounds):
+            category, pts = self.categories[i], self.geo_ways[i]
+            if spatial.box_contains(geo_bounds, self.boxes[i]):
+                tracing.count('ways_inside')
+                categories.append(category)
+                pieces.append(pts)
+                continue
+
+            tracing.count('ways_clipped')
+            if category in render.LINE_CATEGORIES:
+                for piece in polygon.clip_polyline(pts, geo_bounds):
+                    categories.append(category)
+                    pieces.append(piece)
+            else:
+                clipped = polygon.clip_polygon(pts, geo_bounds)
+                if len(clipped) >= 3:
+                    categories.append(category)
+                    pieces.append(clipped)
+        return categories, geo.Ragged.from_arrays(pieces)
+
+
+def window_bounds(window: Window) -> Tuple[float, float, float, float]:
+    """Returns a get_chunks window's (minlat, minlon, maxlat, maxlon)."""
+    _, left, right, bottom, top = window
+    return (bottom, left, top, right)
+
+
+def tile(
+        in_path: str, a_dir: str, b_dir: str, res: Tuple[int, int],
+        prefix: str, lon_window: float, lat_window: float,
+        bounds: Optional[Tuple[float, float, float, float]] = None,
+        render_dirs: Optional[Tuple[str, str]] = None,
+        fmt: str = 'txt', simplify_tol: Optional[float] = None,
+        wanted_only: bool = False) -> List[int]:
+    """
+    Writes out a chunk (as chunks_dataset.process_file() would) for every
+    window of `in_path` that has buildings, numbered by window. Windows
+    cover `bounds` (minlat, minlon, maxlat, maxlon; default: the extract's
+    bounds). Ways are simplified to `simplify_tol` pixels, if given. Returns
+    the window indices written. `wanted_only` reads the extract keeping just
+    the nodes of ways we use (see osm.preproc()).
+    """
+    with tracing.stage('tiler.index', path=in_path):
+        node_map, ways, geo_bounds = osm.preproc(in_path, wanted_only=wanted_only)
+        tiler = Tiler(node_map, ways, max(lon_window, lat_window))
+    minlat, minlon, maxlat, maxlon = bounds if bounds is not None else geo_bounds
+    windows = chunk_windows(minlon, minlat, maxlon, maxlat, lon_window, lat_window)
+    print('INFO: Tiling {} ways into {} windows'.format(len(tiler.categories), len(windows)))
+
+    written = []  # type: List[int]
+    for window in tqdm(windows):
+        idx = window[0]
+        with tracing.stage('tile', idx=idx):
+            categories, geo_ways = tiler.clip(window_bounds(window))
+            geometry = chunks_dataset.pixel_geometry(
+                categories, geo_ways, window_bounds(window), res, simplify_tol)
+            if geometry is None:
+                continue
+            chunks_dataset.write_geometry(geometry, a_dir, b_dir, res, prefix, idx, render_dirs, fmt)
+            written.append(idx)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Cuts one .osm extract into chunks')
+    parser.add_argument('in_path', type=str, help='the .osm extract')
+    parser.add_argument('prefix', type=str, help='name to use for files')
+    parser.add_argument('--out_dir', type=str, default='data/chunks/', help='where A/ and B/ go')
+    parser.add_argument('--lon_window', type=float, default=0.00731, help='longitude delta per window')
+    parser.add_argument('--lat_window', type=float, default=0.00492, help='latitude delta per window')
+    parser.add_argument(
+        '--bounds', type=float, nargs=4, default=None,
+        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+        help="range to tile (default: the extract's bounds)")
+    parser.add_argument('--render', action='store_true', help='also render A/B images')
+    parser.add_argument('--format', choices=sorted(FORMATS.keys()), default='txt', help='output file format')
+    parser.add_argument(
+        '--simplify', type=float, default=None, metavar='PX',
+        help='simplify ways with this tolerance in pixels (see simplify.py)')
+    parser.add_argument(
+        '--wanted_only', action='store_true',
+        help='read in two passes, keeping only nodes of ways we use (for huge extracts)')
+    parser.add_argument('--trace', type=str, default=None, help='trace stages to this path')
+    args = parser.parse_args()
+
+    a_dir, b_dir = os.path.join(args.out_dir, 'A'), os.path.join(args.out_dir, 'B')
+    render_dirs = None  # type: Optional[Tuple[str, str]]
+    if args.render:
+        render_dirs = (os.path.join(args.out_dir, 'A-png'), os.path.join(args.out_dir, 'B-png'))
+    for d in [a_dir, b_dir] + list(render_dirs or []):
+        os.makedirs(d, exist_ok=True)
+    if args.trace is not None:
+        tracing.enable(args.trace)
+
+    written = tile(
+        args.in_path, a_dir, b_dir, (500, 500), args.prefix, args.lon_window,
+        args.lat_window, tuple(args.bounds) if args.bounds is not None else None,
+        render_dirs, args.format, args.simplify, args.wanted_only)
+    print('INFO: Wrote {} chunks'.format(len(written)))
+    tracing.disable()
+
+
+if __name__ == '__main__':
+    main()
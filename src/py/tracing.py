@@ -0,0 +1,261 @@
+"""
+Lightweight tracing for the extraction pipeline: per-stage wall time, CPU
+time, memory and domain counters (nodes merged, BFS expansions, ...),
+written as JSON lines that can be aggregated over a whole batch.
+
+Code being traced just does:
+
+    with tracing.stage('graph.build'):
+        ...
+        tracing.count('nodes_merged', n)
+
+(or decorates a whole function with @tracing.traced('graph.build')).
+
+When tracing is off (the default), stage() hands back one shared no-op
+context manager and count() returns right away, so leaving the calls in
+costs next to nothing. Turn it on with enable().
+
+Each finished stage becomes one record:
+
+    {"stage": "graph.build", "path": "file/graph.build", "attrs": {...},
+     "wall_s": ..., "cpu_s": ..., "max_rss_kb": ..., "counters": {...},
+     "pid": ...}
+
+`path` is the chain of enclosing stages. A stage's counters include its
+children's, so e.g. a "file" stage has that file's totals. With
+enable(memory=True), records also get "peak_mem_bytes" (from tracemalloc,
+which slows things down noticeably).
+"""
+
+# imports
+# ---
+
+# builtins
+import argparse
+from collections import Counter
+import contextlib
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, IO, Iterator, List, Optional
+
+
+# code
+# ---
+
+class _Frame(object):
+    def __init__(self, name: str, attrs: Dict[str, Any]) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.counters = Counter()  # type: Counter
+        self.peak_seen = 0
+        self.start_mem = 0
+
+
+class Tracer(object):
+    """Records stages and counters, writing a JSON line per finished stage to
+    `path` (if given; '{pid}' in it is filled in, so each process of a pool
+    can get its own file). Records are also kept in `records`."""
+
+    def __init__(self, path: Optional[str] = None, memory: bool = False) -> None:
+        self.memory = memory
+        self.records = []  # type: List[Dict[str, Any]]
+        self.stack = []  # type: List[_Frame]
+        self.out = None  # type: Optional[IO[str]]
+        if path is not None:
+            path = path.replace('{pid}', str(os.getpid()))
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.out = open(path, 'a')
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def close(self) -> None:
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str, **attrs: Any) -> Iterator[None]:
+        frame = _Frame(name, attrs)
+        if self.memory:
+            # a nested stage resets tracemalloc's peak, so first hand the
+            # peak so far up to whoever's open
+            cur, peak = tracemalloc.get_traced_memory()
+            if len(self.stack) > 0:
+                self.stack[-1].peak_seen = max(self.stack[-1].peak_seen, peak)
+            tracemalloc.reset_peak()
+            frame.start_mem = cur
+        self.stack.append(frame)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self.stack.pop()
+            record = {
+                'stage': name,
+                'path': '/'.join([f.name for f in self.stack] + [name]),
+                'attrs': attrs,
+                'wall_s': wall,
+                'cpu_s': cpu,
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                'counters': dict(frame.counters),
+                'pid': os.getpid(),
+            }  # type: Dict[str, Any]
+            if self.memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(frame.peak_seen, peak)
+                record['peak_mem_bytes'] = peak - frame.start_mem
+                if len(self.stack) > 0:
+                    self.stack[-1].peak_seen = max(self.stack[-1].peak_seen, peak)
+            if len(self.stack) > 0:
+                self.stack[-1].counters.update(frame.counters)
+            self.emit(record)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if len(self.stack) > 0:
+            self.stack[-1].counters[name] += n
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        self.records.append(record)
+        if self.out is not None:
+            self.out.write(json.dumps(record) + '\n')
+            self.out.flush()
+
+
+# the active tracer (None: tracing off)
+_tracer = None  # type: Optional[Tracer]
+
+# (stateless and reusable, so one is shared for every disabled stage)
+_NULL_STAGE = contextlib.nullcontext()
+
+
+def enable(path: Optional[str] = None, memory: bool = False) -> Tracer:
+    """Turns tracing on (for this process). See Tracer for args."""
+    global _tracer
+    disable()
+    _tracer = Tracer(path, memory)
+    return _tracer
+
+
+def disable() -> None:
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+        _tracer = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def stage(name: str, **attrs: Any) -> Any:
+    """Context manager timing a stage (a no-op unless tracing is on)."""
+    if _tracer is None:
+        return _NULL_STAGE
+    return _tracer.stage(name, **attrs)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Adds `n` to counter `name` of the innermost open stage."""
+    if _tracer is not None:
+        _tracer.count(name, n)
+
+
+def traced(name: str) -> Callable[[Callable], Callable]:
+    """Decorator that runs each call of a function as stage `name`."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with _tracer.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# aggregation
+# ---
+
+def read(paths: List[str]) -> Iterator[Dict[str, Any]]:
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip() != '':
+                    yield json.loads(line)
+
+
+def aggregate(records: Iterator[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Sums records per stage name: number of runs, total and max wall / CPU
+    time, max memory, and counter totals."""
+    res = {}  # type: Dict[str, Dict[str, Any]]
+    for r in records:
+        if r['stage'] not in res:
+            res[r['stage']] = {
+                'runs': 0, 'wall_s': 0.0, 'max_wall_s': 0.0, 'cpu_s': 0.0,
+                'max_rss_kb': 0, 'peak_mem_bytes': 0, 'counters': Counter(),
+            }
+        agg = res[r['stage']]
+        agg['runs'] += 1
+        agg['wall_s'] += r['wall_s']
+        agg['max_wall_s'] = max(agg['max_wall_s'], r['wall_s'])
+        agg['cpu_s'] += r['cpu_s']
+        agg['max_rss_kb'] = max(agg['max_rss_kb'], r['max_rss_kb'])
+        agg['peak_mem_bytes'] = max(agg['peak_mem_bytes'], r.get('peak_mem_bytes', 0))
+        agg['counters'].update(r['counters'])
+    for agg in res.values():
+        agg['counters'] = dict(agg['counters'])
+    return res
+
+
+def test_tracing() -> None:
+    # off: nothing recorded, nothing breaks
+    with stage('off'):
+        count('x')
+
+    tracer = enable(memory=True)
+    with stage('file', path='a.osm'):
+        count('ways', 2)
+        with stage('inner'):
+            count('ways', 3)
+            count('merged')
+            _ = [0] * 100000
+    disable()
+    inner, outer = tracer.records
+    assert inner['path'] == 'file/inner' and inner['counters'] == {'ways': 3, 'merged': 1}
+    assert outer['attrs'] == {'path': 'a.osm'} and outer['counters'] == {'ways': 5, 'merged': 1}
+    assert outer['peak_mem_bytes'] >= inner['peak_mem_bytes'] > 0
+    agg = aggregate(iter(tracer.records))
+    assert agg['file']['runs'] == 1 and agg['inner']['counters']['ways'] == 3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Aggregates trace files (JSON lines)')
+    parser.add_argument('paths', type=str, nargs='+', help='trace files')
+    parser.add_argument('--json', action='store_true', help='print aggregate as JSON')
+    args = parser.parse_args()
+
+    agg = aggregate(read(args.paths))
+    if args.json:
+        json.dump(agg, sys.stdout, indent=2, sort_keys=True)
+        print()
+        return
+    by_time = sorted(agg.items(), key=lambda kv: -kv[1]['wall_s'])
+    print('{:<24} {:>7} {:>10} {:>10} {:>10} {:>10}'.format(
+        'stage', 'runs', 'wall_s', 'max_wall_s', 'cpu_s', 'rss_mb'))
+    for name, a in by_time:
+        print('{:<24} {:>7} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.1f}'.format(
+            name, a['runs'], a['wall_s'], a['max_wall_s'], a['cpu_s'], a['max_rss_kb'] / 1024))
+    for name, a in by_time:
+        if len(a['counters']) > 0:
+            print('{}: {}'.format(name, ', '.join(
+                '{} {}'.format(k, v) for k, v in sorted(a['counters'].items()))))
+
+
+if __name__ == '__main__':
+    main()